@@ -1,15 +1,11 @@
 from __future__ import annotations
 
-from enum import StrEnum
 from typing import Callable, Set, Dict
 
 import networkx
 from scipy.stats import fisher_exact
 
-class EnrichmentMethod(StrEnum):
-    independent = "independent"
-    parent_child_union = "parent-child-union"
-    parent_child_intersection = "parent-child-intersection"
+from go_enrich.types import EnrichmentMethod
 
 
 EnrichmentFunction = Callable[
@@ -0,0 +1,9 @@
+from enum import StrEnum
+
+
+# kept apart from go_enrich.methods, so that code that only needs the
+# method names does not import networkx and scipy
+class EnrichmentMethod(StrEnum):
+    independent = "independent"
+    parent_child_union = "parent-child-union"
+    parent_child_intersection = "parent-child-intersection"
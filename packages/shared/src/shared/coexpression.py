@@ -0,0 +1,313 @@
+"""
+Gene co-expression from exported expression matrices.
+
+Every gene row of a matrix is centred and scaled to unit length, so the
+Pearson correlation of two genes is the dot product of their rows and
+the correlations of a block of genes with every gene are one matrix
+product. Spearman correlation is the same on the per-gene ranks of the
+values. Missing values are set to the gene's mean, which is zero after
+centring, so they do not add to any correlation; genes with the same
+value in every sample have no correlation.
+
+`build_coexpression_network` stores the top-k partners of every gene
+next to the matrix of the experiment, as a CSR table whose rows and
+column indices are the rows of the matrix:
+
+    <matrix_path>/<experiment_id>/network-<method>/network.json
+    <matrix_path>/<experiment_id>/network-<method>/indptr.npy        int64
+    <matrix_path>/<experiment_id>/network-<method>/indices.npy       int32
+    <matrix_path>/<experiment_id>/network-<method>/correlations.npy  float16
+
+The partners of gene row `i` are `indices[indptr[i]:indptr[i + 1]]`,
+most correlated first. Exporting the matrix again replaces the whole
+experiment directory, networks included, since they describe the old
+matrix.
+"""
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Literal, Optional, Tuple
+
+import numpy
+from numpy.typing import NDArray
+from pydantic import BaseModel
+
+CoexpressionMethod = Literal["pearson", "spearman"]
+
+NETWORK_MANIFEST_FILENAME = "network.json"
+
+# memory for one block of correlations, per process
+DEFAULT_BLOCK_BYTES = 256 * 2**20
+
+
+class CoexpressionNetworkManifest(BaseModel):
+    experiment_id: int
+    method: CoexpressionMethod
+    k: int
+    gene_count: int
+
+
+def network_directory_name(method: CoexpressionMethod) -> str:
+    return f"network-{method}"
+
+
+def average_ranks(
+    values: NDArray[numpy.float32],
+) -> NDArray[numpy.float32]:
+    """
+    The rank of each value within its row, starting at 1, with ties
+    given their average rank and NaN kept as NaN.
+    """
+    genes, samples = values.shape
+    if values.size == 0:
+        return values.astype(numpy.float32)
+
+    # NaN sorts last, so it never shifts the rank of a value
+    order = numpy.argsort(values, axis=1, kind="stable")
+    sorted_values = numpy.take_along_axis(values, order, axis=1)
+
+    # runs of equal values in a sorted row share their mean position;
+    # NaN != NaN, so every NaN is a run of its own
+    starts = numpy.ones((genes, samples), dtype=bool)
+    starts[:, 1:] = sorted_values[:, 1:] != sorted_values[:, :-1]
+    starts = starts.ravel()
+
+    run = numpy.cumsum(starts) - 1
+    positions = numpy.tile(numpy.arange(samples), genes)
+    mean_positions = positions[starts] + (numpy.bincount(run) - 1) / 2
+
+    ranks = numpy.empty((genes, samples), dtype=numpy.float32)
+    numpy.put_along_axis(
+        ranks, order, (mean_positions[run] + 1).reshape(genes, samples), 1
+    )
+    ranks[numpy.isnan(values)] = numpy.nan
+    return ranks
+
+
+def standardize(
+    values: NDArray[numpy.float32], method: CoexpressionMethod
+) -> Tuple[NDArray[numpy.float32], NDArray[numpy.bool_]]:
+    """
+    The rows of `values` centred and scaled to unit length, and which
+    rows vary across samples; the rows that do not are all zero.
+    """
+    values = numpy.asarray(values, dtype=numpy.float32)
+    if method == "spearman":
+        values = average_ranks(values)
+
+    present = ~numpy.isnan(values)
+    counts = present.sum(axis=1, keepdims=True)
+    means = numpy.divide(
+        numpy.where(present, values, 0).sum(axis=1, keepdims=True),
+        counts,
+        out=numpy.zeros_like(counts, dtype=numpy.float32),
+        where=counts > 0,
+    )
+    centred = numpy.where(present, values - means, 0).astype(numpy.float32)
+    norms = numpy.sqrt(numpy.einsum("ij,ij->i", centred, centred))
+
+    valid = norms > 1e-6 * numpy.maximum(numpy.abs(means.ravel()), 1)
+    standardized = numpy.divide(
+        centred,
+        norms[:, None],
+        out=numpy.zeros_like(centred),
+        where=valid[:, None],
+    )
+    return standardized, valid
+
+
+def top_k(
+    correlations: NDArray[numpy.float32], k: int
+) -> Tuple[NDArray[numpy.intp], NDArray[numpy.float32]]:
+    """
+    The columns of the `k` highest values of each row, highest first
+    and equal values in column order, and the values. Columns that must
+    not be picked are expected to hold -inf.
+    """
+    k = min(k, correlations.shape[1])
+    if k <= 0:
+        empty = numpy.empty((correlations.shape[0], 0))
+        return empty.astype(numpy.intp), empty.astype(numpy.float32)
+
+    top = numpy.argpartition(-correlations, k - 1, axis=1)[:, :k]
+    top.sort(axis=1)
+    scores = numpy.take_along_axis(correlations, top, axis=1)
+    order = numpy.argsort(-scores, axis=1, kind="stable")
+
+    return (
+        numpy.take_along_axis(top, order, axis=1),
+        numpy.take_along_axis(scores, order, axis=1),
+    )
+
+
+def _network_block(
+    standardized_path: str, valid_path: str, start: int, stop: int, k: int
+) -> Tuple[NDArray[numpy.int32], NDArray[numpy.float32]]:
+    """
+    The top-k partners of gene rows [start, stop), read from the memory
+    mapped standardized matrix, so worker processes share its pages.
+    """
+    standardized = numpy.load(standardized_path, mmap_mode="r")
+    valid = numpy.load(valid_path)
+
+    correlations = numpy.asarray(standardized[start:stop]) @ standardized.T
+    correlations[:, ~valid] = -numpy.inf
+    correlations[~valid[start:stop]] = -numpy.inf
+    rows = numpy.arange(stop - start)
+    correlations[rows, rows + start] = -numpy.inf
+
+    partners, scores = top_k(correlations, k)
+    return partners.astype(numpy.int32), scores
+
+
+def build_coexpression_network(
+    matrix_directory: Path,
+    method: CoexpressionMethod = "pearson",
+    k: int = 100,
+    processes: int = 1,
+    block_bytes: int = DEFAULT_BLOCK_BYTES,
+) -> Path:
+    """
+    Computes the top-k partners of every gene of the exported matrix in
+    `matrix_directory` and writes them next to it. Genes are processed
+    in blocks whose correlations take at most about `block_bytes`, in
+    `processes` worker processes. Returns the network directory, which
+    is written to a temporary directory first and moved into place.
+    """
+    # shared.expression_matrix imports this module
+    from shared.expression_matrix import ExpressionMatrix
+
+    matrix = ExpressionMatrix(matrix_directory)
+    gene_count = len(matrix.manifest.gene_ids)
+    block_rows = max(1, block_bytes // (max(gene_count, 1) * 4))
+
+    output = matrix_directory / network_directory_name(method)
+    staging = matrix_directory / f".{output.name}.tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir()
+
+    try:
+        with tempfile.TemporaryDirectory(dir=matrix_directory) as scratch:
+            standardized, valid = standardize(matrix.values, method)
+            standardized_path = os.path.join(scratch, "standardized.npy")
+            valid_path = os.path.join(scratch, "valid.npy")
+            numpy.save(standardized_path, standardized)
+            numpy.save(valid_path, valid)
+            del standardized
+
+            blocks = [
+                (start, min(start + block_rows, gene_count))
+                for start in range(0, gene_count, block_rows)
+            ]
+            arguments = [
+                (standardized_path, valid_path, start, stop, k)
+                for start, stop in blocks
+            ]
+
+            if processes > 1 and len(blocks) > 1:
+                # workers only get file names, and forking a process
+                # with BLAS threads running can deadlock
+                with ProcessPoolExecutor(
+                    max_workers=processes,
+                    mp_context=multiprocessing.get_context("forkserver"),
+                ) as pool:
+                    results = list(
+                        pool.map(_network_block, *zip(*arguments))
+                    )
+            else:
+                results = [_network_block(*args) for args in arguments]
+
+        indptr, indices, correlations = _to_csr(results, gene_count)
+        numpy.save(staging / "indptr.npy", indptr)
+        numpy.save(staging / "indices.npy", indices)
+        numpy.save(staging / "correlations.npy", correlations)
+        (staging / NETWORK_MANIFEST_FILENAME).write_text(
+            CoexpressionNetworkManifest(
+                experiment_id=matrix.experiment_id,
+                method=method,
+                k=k,
+                gene_count=gene_count,
+            ).model_dump_json()
+        )
+
+        shutil.rmtree(output, ignore_errors=True)
+        os.replace(staging, output)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    return output
+
+
+def _to_csr(
+    blocks: List[Tuple[NDArray[numpy.int32], NDArray[numpy.float32]]],
+    gene_count: int,
+) -> Tuple[
+    NDArray[numpy.int64], NDArray[numpy.int32], NDArray[numpy.float16]
+]:
+    counts: List[NDArray[numpy.intp]] = []
+    indices: List[NDArray[numpy.int32]] = []
+    correlations: List[NDArray[numpy.float16]] = []
+
+    for partners, scores in blocks:
+        # genes without partners, and rows with fewer than k, end at the
+        # first column that was never a candidate
+        present = numpy.isfinite(scores)
+        counts.append(present.sum(axis=1))
+        indices.append(partners[present])
+        correlations.append(
+            numpy.clip(scores[present], -1, 1).astype(numpy.float16)
+        )
+
+    indptr = numpy.zeros(gene_count + 1, dtype=numpy.int64)
+    if counts:
+        numpy.cumsum(numpy.concatenate(counts), out=indptr[1:])
+
+    return (
+        indptr,
+        numpy.concatenate(indices)
+        if indices
+        else numpy.empty(0, numpy.int32),
+        (
+            numpy.concatenate(correlations)
+            if correlations
+            else numpy.empty(0, numpy.float16)
+        ),
+    )
+
+
+class CoexpressionNetwork:
+    """A stored top-k network, memory-mapped."""
+
+    def __init__(self, directory: Path) -> None:
+        self.manifest = CoexpressionNetworkManifest.model_validate_json(
+            (directory / NETWORK_MANIFEST_FILENAME).read_text()
+        )
+        self.indptr: NDArray[numpy.int64] = numpy.load(
+            directory / "indptr.npy", mmap_mode="r"
+        )
+        self.indices: NDArray[numpy.int32] = numpy.load(
+            directory / "indices.npy", mmap_mode="r"
+        )
+        self.correlations: NDArray[numpy.float16] = numpy.load(
+            directory / "correlations.npy", mmap_mode="r"
+        )
+
+    @property
+    def k(self) -> int:
+        return self.manifest.k
+
+    def partners(
+        self, row: int, k: Optional[int] = None
+    ) -> Tuple[List[int], List[float]]:
+        start, stop = int(self.indptr[row]), int(self.indptr[row + 1])
+        if k is not None:
+            stop = min(stop, start + k)
+        return (
+            self.indices[start:stop].tolist(),
+            self.correlations[start:stop].astype(numpy.float32).tolist(),
+        )
@@ -0,0 +1,301 @@
+"""
+Dense, memory-mappable copies of the per-experiment expression tables.
+
+Each experiment is exported into its own directory:
+
+    <matrix_path>/<experiment_id>/matrix.npy     float32, genes x samples
+    <matrix_path>/<experiment_id>/manifest.json  gene and sample ids
+
+Pairs of (gene, sample) that have no value in the expression table are
+stored as NaN.
+"""
+
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy
+from duckdb import DuckDBPyConnection
+from numpy.typing import NDArray
+from pydantic import BaseModel
+
+from shared.coexpression import (
+    NETWORK_MANIFEST_FILENAME,
+    CoexpressionMethod,
+    CoexpressionNetwork,
+    network_directory_name,
+)
+from shared.services.database import quote_identifier
+
+# where the matrices of a release are kept, next to its database
+EXPRESSION_MATRIX_DIRECTORY_NAME = "expression-matrices"
+MATRIX_FILENAME = "matrix.npy"
+MANIFEST_FILENAME = "manifest.json"
+
+
+def release_matrix_path(
+    release_path: Path,
+    releases_path: Path,
+    matrix_path: Optional[str | Path] = None,
+) -> Path:
+    """
+    Where the matrices of the database release in `release_path` are
+    kept: next to its database or, with a separate `matrix_path`
+    (EXPRESSION_MATRIX_PATH), in a directory named after the release
+    below it, so that matrices exported from one release are never
+    served with another. A database outside the releases directory uses
+    `matrix_path` itself.
+    """
+    if not matrix_path:
+        return release_path / EXPRESSION_MATRIX_DIRECTORY_NAME
+    if release_path.parent == releases_path.resolve():
+        return Path(matrix_path) / release_path.name
+    return Path(matrix_path)
+
+
+class ExpressionMatrixManifest(BaseModel):
+    experiment_id: int
+    relation_name: str
+    expression_units: Optional[str]
+    gene_ids: List[str]
+    sample_ids: List[str]
+
+
+def read_expression_matrix(
+    connection: DuckDBPyConnection, experiment_id: int
+) -> Tuple[ExpressionMatrixManifest, NDArray[numpy.float32]]:
+    """
+    Reads the expression table of one experiment into a dense genes x
+    samples matrix, with genes sorted by id and samples in the order of
+    the expression metadata.
+    """
+    experiment = connection.execute(
+        "SELECT relation_name, expression_units FROM experiments WHERE id = ?",
+        [experiment_id],
+    ).fetchone()
+
+    if experiment is None:
+        raise ValueError(f"Experiment with id={experiment_id} not found")
+
+    relation_name, expression_units = experiment
+    table = quote_identifier(relation_name)
+
+    # same ordering as the sample_collector of the expression query
+    sample_ids: List[str] = [
+        row[0]
+        for row in connection.execute(
+            """
+            SELECT abbreviation
+            FROM (
+                SELECT
+                    ROW_NUMBER() OVER () AS sample_order,
+                    abbreviation
+                FROM expression_metadata
+                WHERE experiment_id = ?
+            )
+            ORDER BY sample_order
+            """,
+            [experiment_id],
+        ).fetchall()
+    ]
+    gene_ids: List[str] = [
+        row[0]
+        for row in connection.execute(
+            f"SELECT DISTINCT gene_id FROM {table} ORDER BY gene_id"
+        ).fetchall()
+    ]
+
+    manifest = ExpressionMatrixManifest(
+        experiment_id=experiment_id,
+        relation_name=relation_name,
+        expression_units=expression_units,
+        gene_ids=gene_ids,
+        sample_ids=sample_ids,
+    )
+
+    cells = connection.execute(
+        f"""
+        WITH
+            genes AS (
+                SELECT
+                    UNNEST($gene_ids::VARCHAR[]) AS gene_id,
+                    generate_subscripts($gene_ids::VARCHAR[], 1) - 1
+                        AS gene_row
+            ),
+            samples AS (
+                SELECT
+                    UNNEST($sample_ids::VARCHAR[]) AS sample_id,
+                    generate_subscripts($sample_ids::VARCHAR[], 1) - 1
+                        AS sample_column
+            )
+        SELECT g.gene_row, s.sample_column, e.expression_value
+        FROM {table} e
+            JOIN genes g ON (g.gene_id = e.gene_id)
+            JOIN samples s ON (s.sample_id = e.sample_id)
+        """,
+        {"gene_ids": gene_ids, "sample_ids": sample_ids},
+    ).fetchnumpy()
+
+    values = numpy.full(
+        (len(gene_ids), len(sample_ids)), numpy.nan, dtype=numpy.float32
+    )
+    values[cells["gene_row"], cells["sample_column"]] = cells[
+        "expression_value"
+    ]
+
+    return manifest, values
+
+
+def export_expression_matrix(
+    connection: DuckDBPyConnection,
+    experiment_id: int,
+    output_path: Path,
+) -> Path:
+    """
+    Writes the dense matrix of one experiment to
+    `output_path/<experiment_id>`. The files are written to a temporary
+    directory first and moved into place, so readers never see a
+    partially written matrix.
+    """
+    manifest, values = read_expression_matrix(connection, experiment_id)
+
+    output_path.mkdir(parents=True, exist_ok=True)
+    final_directory = output_path / str(experiment_id)
+    staging_directory = output_path / f".{experiment_id}.tmp"
+    shutil.rmtree(staging_directory, ignore_errors=True)
+    staging_directory.mkdir()
+
+    numpy.save(staging_directory / MATRIX_FILENAME, values)
+
+    (staging_directory / MANIFEST_FILENAME).write_text(
+        manifest.model_dump_json()
+    )
+
+    if final_directory.exists():
+        retired_directory = output_path / f".{experiment_id}.old"
+        shutil.rmtree(retired_directory, ignore_errors=True)
+        os.replace(final_directory, retired_directory)
+        os.replace(staging_directory, final_directory)
+        shutil.rmtree(retired_directory, ignore_errors=True)
+    else:
+        os.replace(staging_directory, final_directory)
+
+    return final_directory
+
+
+class ExpressionMatrix:
+    """
+    A read-only, memory-mapped expression matrix of one experiment with
+    a hash index from gene id to matrix row.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self.manifest = ExpressionMatrixManifest(
+            **json.loads((directory / MANIFEST_FILENAME).read_text())
+        )
+        self.values: NDArray[numpy.float32] = numpy.load(
+            directory / MATRIX_FILENAME, mmap_mode="r"
+        )
+        self.gene_index: Dict[str, int] = {
+            gene_id: row
+            for row, gene_id in enumerate(self.manifest.gene_ids)
+        }
+        self._networks: Dict[str, CoexpressionNetwork] = {}
+
+        expected_shape = (
+            len(self.manifest.gene_ids),
+            len(self.manifest.sample_ids),
+        )
+        if self.values.shape != expected_shape:
+            raise ValueError(
+                f"{directory}: matrix shape {self.values.shape} does not"
+                f" match manifest {expected_shape}"
+            )
+
+    @property
+    def experiment_id(self) -> int:
+        return self.manifest.experiment_id
+
+    @property
+    def sample_ids(self) -> List[str]:
+        return self.manifest.sample_ids
+
+    def lookup(
+        self, gene_ids: List[str]
+    ) -> Tuple[List[str], NDArray[numpy.intp], List[str]]:
+        """
+        Maps requested gene ids to matrix rows, keeping the request order
+        and the first occurrence of duplicates. Returns the found gene
+        ids, their rows and the gene ids that are not in the matrix.
+        """
+        found: List[str] = []
+        rows: List[int] = []
+        missing: List[str] = []
+        seen = set()
+
+        for gene_id in gene_ids:
+            if gene_id in seen:
+                continue
+            seen.add(gene_id)
+
+            row = self.gene_index.get(gene_id)
+            if row is None:
+                missing.append(gene_id)
+            else:
+                found.append(gene_id)
+                rows.append(row)
+
+        return found, numpy.asarray(rows, dtype=numpy.intp), missing
+
+    def rows(self, rows: NDArray[numpy.intp]) -> NDArray[numpy.float32]:
+        return numpy.asarray(self.values[rows])
+
+    def network(
+        self, method: CoexpressionMethod
+    ) -> Optional[CoexpressionNetwork]:
+        """
+        The precomputed co-expression network, if one has been built.
+        Looked up on first use, so a network built while the API runs
+        is picked up without a restart.
+        """
+        network = self._networks.get(method)
+        if network is None:
+            directory = self.directory / network_directory_name(method)
+            if not (directory / NETWORK_MANIFEST_FILENAME).exists():
+                return None
+            network = self._networks.setdefault(
+                method, CoexpressionNetwork(directory)
+            )
+        return network
+
+
+class ExpressionMatrixStore:
+    """
+    All exported expression matrices below a directory, memory-mapped
+    once and shared by every request.
+    """
+
+    def __init__(self, matrix_path: Path) -> None:
+        self.matrix_path = matrix_path
+        self.matrices: Dict[int, ExpressionMatrix] = {}
+
+        if not matrix_path.is_dir():
+            return
+
+        for directory in sorted(matrix_path.iterdir()):
+            # staging and retired directories of an export in progress
+            if directory.name.startswith("."):
+                continue
+            if not (directory / MANIFEST_FILENAME).exists():
+                continue
+            matrix = ExpressionMatrix(directory)
+            self.matrices[matrix.experiment_id] = matrix
+
+    def get(self, experiment_id: int) -> Optional[ExpressionMatrix]:
+        return self.matrices.get(experiment_id)
+
+    def __len__(self) -> int:
+        return len(self.matrices)
@@ -0,0 +1,101 @@
+"""
+Versioned database releases.
+
+Each release is a directory holding a complete database, published by
+pointing the `current` symlink at it:
+
+    <releases_path>/2025-06-01/plantgenie-backend.db
+    <releases_path>/2025-07-15/plantgenie-backend.db
+    <releases_path>/current -> 2025-07-15
+
+Readers resolve `current` once, when they open the database, and keep
+using that release; a new release never changes a file that is open.
+"""
+
+import os
+from pathlib import Path
+from typing import List, Optional
+
+RELEASES_DIRECTORY_NAME = "releases"
+CURRENT_RELEASE_NAME = "current"
+
+
+def releases_path_for(
+    data_path: str | Path, releases_path: Optional[str | Path] = None
+) -> Path:
+    return (
+        Path(releases_path)
+        if releases_path
+        else Path(data_path) / RELEASES_DIRECTORY_NAME
+    )
+
+
+def resolve_database_path(
+    data_path: str | Path,
+    database_name: str,
+    releases_path: Optional[str | Path] = None,
+) -> Path:
+    """
+    The database file of the current release, or
+    `data_path/database_name` when no release has been published. The
+    returned path is fully resolved, so it keeps pointing at the same
+    release after `current` moves on.
+    """
+    current = releases_path_for(data_path, releases_path) / (
+        CURRENT_RELEASE_NAME
+    )
+
+    if current.is_symlink() or current.exists():
+        return (current.resolve(strict=True) / database_name).resolve(
+            strict=True
+        )
+
+    return (Path(data_path) / database_name).resolve(strict=True)
+
+
+def list_releases(releases_path: Path) -> List[str]:
+    if not releases_path.is_dir():
+        return []
+
+    return sorted(
+        path.name
+        for path in releases_path.iterdir()
+        if path.is_dir()
+        and not path.is_symlink()
+        and not path.name.startswith(".")
+    )
+
+
+def current_release(releases_path: Path) -> Optional[str]:
+    current = releases_path / CURRENT_RELEASE_NAME
+    if not current.is_symlink():
+        return None
+    return Path(os.readlink(current)).name
+
+
+def publish_release(
+    releases_path: Path, release: str, database_name: str
+) -> Path:
+    """
+    Atomically points `current` at `release`. The release must already
+    be complete: the database file is checked before the switch.
+    """
+    release_path = releases_path / release
+
+    if release in (CURRENT_RELEASE_NAME, "") or release.startswith("."):
+        raise ValueError(f"Invalid release name: {release!r}")
+
+    if not (release_path / database_name).is_file():
+        raise FileNotFoundError(
+            f"Release {release} has no database {database_name}"
+        )
+
+    # a symlink cannot be replaced in place, so create it next to
+    # `current` and rename it over, which is atomic
+    staging_link = releases_path / f".{CURRENT_RELEASE_NAME}.tmp"
+    if staging_link.is_symlink() or staging_link.exists():
+        staging_link.unlink()
+    staging_link.symlink_to(release, target_is_directory=True)
+    os.replace(staging_link, releases_path / CURRENT_RELEASE_NAME)
+
+    return release_path
@@ -5,6 +5,10 @@ import duckdb
 from duckdb import DuckDBPyConnection
 
 
+def quote_identifier(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
 class SafeDuckDbConnection:
     def __init__(
         self,
@@ -20,6 +20,7 @@ from task_queue.blast.models import (
     ExecuteBlastPipelineArgs,
 )
 from task_queue.celery import app
+from task_queue.client import EXECUTE_BLAST_PIPELINE
 from task_queue.tasks import (
     PathValidationTask,
     SubprocessPathValidationTask,
@@ -231,7 +232,7 @@ def upload_results_to_object_store(query_path: str) -> List[str]:
 
 
 @app.task(
-    name="blast.execute_blast_pipeline", pydantic=True, rate_limit="10/m"
+    name=EXECUTE_BLAST_PIPELINE, pydantic=True, rate_limit="10/m"
 )
 def execute_blast_pipeline(args: ExecuteBlastPipelineArgs):
     workflow = chain(
@@ -0,0 +1,27 @@
+"""
+Enqueues tasks and looks up their results by task name, for processes
+that submit work but do not run it.
+
+Importing the task modules themselves pulls in the worker-side
+dependencies (networkx, scipy, the FASTA validator, ...), which the web
+process never needs, so nothing here imports them.
+"""
+
+from celery.result import AsyncResult
+from pydantic import BaseModel
+
+from task_queue.celery import app
+
+RUN_GO_ENRICHMENT_PIPELINE = "enrichment.run_pipeline"
+EXECUTE_BLAST_PIPELINE = "blast.execute_blast_pipeline"
+BUILD_COEXPRESSION_NETWORK = "coexpression.build_network"
+
+
+def enqueue(task_name: str, args: BaseModel, task_id: str) -> AsyncResult:
+    return app.send_task(
+        task_name, args=(args.model_dump(),), task_id=task_id
+    )
+
+
+def get_result(task_id: str) -> AsyncResult:
+    return AsyncResult(task_id, app=app)
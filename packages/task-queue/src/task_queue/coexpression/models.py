@@ -0,0 +1,13 @@
+from typing import Literal
+
+from pydantic import BaseModel, Field
+
+
+class BuildCoexpressionNetworkArgs(BaseModel):
+    experiment_id: int
+    method: Literal["pearson", "spearman"] = "pearson"
+    k: int = Field(gt=0, le=1000, default=100)
+    # prefork workers are daemonic and cannot start processes of their
+    # own, so more than one needs a threads or solo pool
+    processes: int = Field(gt=0, default=1)
+    block_memory_mb: int = Field(gt=0, default=256)
@@ -0,0 +1,54 @@
+import os
+
+from celery import Task
+from shared.coexpression import build_coexpression_network
+from shared.expression_matrix import (
+    ExpressionMatrixStore,
+    release_matrix_path,
+)
+from shared.releases import releases_path_for, resolve_database_path
+
+from task_queue.celery import app
+from task_queue.client import BUILD_COEXPRESSION_NETWORK
+from task_queue.coexpression.models import BuildCoexpressionNetworkArgs
+
+
+@app.task(
+    name=BUILD_COEXPRESSION_NETWORK,
+    typing=True,
+    pydantic=True,
+    bind=True,
+)
+def build_network(self: Task, args: BuildCoexpressionNetworkArgs) -> str:
+    """
+    Stores the top-k co-expressed partners of every gene next to the
+    exported matrix of the experiment of the current release, the same
+    place the API looks.
+    """
+    releases_path = releases_path_for(
+        os.environ["DATA_PATH"],
+        os.environ.get("DATABASE_RELEASES_PATH") or None,
+    )
+    release_path = resolve_database_path(
+        os.environ["DATA_PATH"], os.environ["DATABASE_NAME"], releases_path
+    ).parent
+    matrix_path = release_matrix_path(
+        release_path,
+        releases_path,
+        os.environ.get("EXPRESSION_MATRIX_PATH") or None,
+    )
+
+    matrix = ExpressionMatrixStore(matrix_path).get(args.experiment_id)
+    if matrix is None:
+        raise ValueError(
+            f"Experiment with id={args.experiment_id} is not exported"
+            f" to {matrix_path}"
+        )
+
+    return build_coexpression_network(
+        matrix.directory,
+        method=args.method,
+        k=args.k,
+        processes=args.processes,
+        block_bytes=args.block_memory_mb * 2**20,
+    ).as_posix()
@@ -1,4 +1,4 @@
-from go_enrich.methods import EnrichmentMethod
+from go_enrich.types import EnrichmentMethod
 from typing import Literal, List
 
 from pydantic import BaseModel, Field
@@ -6,12 +6,14 @@ import duckdb
 from celery import Task
 from go_enrich.main import main
 from shared.constants import GO_ENRICH_BUCKET_NAME
+from shared.releases import resolve_database_path
 from shared.services.openstack import (
     SwiftClient,
     SwiftUploadableObject,
 )
 
 from task_queue.celery import app
+from task_queue.client import RUN_GO_ENRICHMENT_PIPELINE
 from task_queue.enrichment.models import GoEnrichPipelineArgs
 from task_queue.tasks import (
     PathValidationTask,
@@ -39,7 +41,7 @@ def verify_background_genes_file(background_path: str) -> str:
 
 
 @app.task(
-    name="enrichment.run_pipeline",
+    name=RUN_GO_ENRICHMENT_PIPELINE,
     typing=True,
     pydantic=True,
     bind=True,
@@ -53,11 +55,13 @@ def run_go_enrichment_pipeline(self: Task, args: GoEnrichPipelineArgs):
     resolved_background_path = (
         Path(args.background_path).resolve(True).as_posix()
     )
-    resolved_database_path = (
-        (Path(os.environ["DATA_PATH"]) / os.environ["DATABASE_NAME"])
-        .resolve(True)
-        .as_posix()
-    )
+    # resolved once, so the whole task reads from one database release
+    # even if a new one is published while it runs
+    resolved_database_path = resolve_database_path(
+        os.environ["DATA_PATH"],
+        os.environ["DATABASE_NAME"],
+        os.environ.get("DATABASE_RELEASES_PATH") or None,
+    ).as_posix()
 
     with duckdb.connect(
         resolved_database_path, read_only=True
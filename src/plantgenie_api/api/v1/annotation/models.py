@@ -1,5 +1,8 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 
+from pydantic import Field, model_validator
+
+from plantgenie_api.genes import MAX_GENE_IDS
 from plantgenie_api.models import PlantGenieModel
 
 
@@ -22,8 +25,31 @@ class GeneAnnotation(PlantGenieModel):
 
 class AnnotationsRequest(PlantGenieModel):
     species: str
-    gene_ids: List[str]
+    gene_ids: List[str] = Field(default=[], max_length=MAX_GENE_IDS)
+    gene_list_id: Optional[str] = Field(default=None)
+
+    @model_validator(mode="after")
+    def check_genes(self) -> "AnnotationsRequest":
+        if self.gene_ids and self.gene_list_id is not None:
+            raise ValueError("Provide either geneIds or a geneListId")
+        return self
 
 
 class AnnotationsResponse(PlantGenieModel):
     results: List[GeneAnnotation]
+    resolved_gene_ids: Dict[str, str] = Field(default={})
+    unresolved_gene_ids: List[str] = Field(default=[])
+    # unknown ids that are an alias of several genes, and those genes
+    ambiguous_gene_ids: Dict[str, List[str]] = Field(default={})
+
+
+class AnnotationSearchHit(PlantGenieModel):
+    gene_id: str
+    gene_name: Optional[str]
+    description: Optional[str]
+    score: float
+
+
+class AnnotationSearchResponse(PlantGenieModel):
+    total: int
+    results: List[AnnotationSearchHit]
@@ -0,0 +1,17 @@
+# the requested genes are bound as a single VARCHAR[] parameter so the
+# query text does not depend on the number of genes requested
+ANNOTATIONS_QUERY = """
+    WITH requested_genes AS (
+        SELECT
+            UNNEST($gene_ids::VARCHAR[]) AS gene_id,
+            generate_subscripts($gene_ids::VARCHAR[], 1) AS gene_order
+    ),
+    genes_from_gff AS (
+        SELECT * FROM requested_genes
+            JOIN gff ON (requested_genes.gene_id = gff.feature_id)
+    ) SELECT
+        genes_from_gff.gene_id, gene_name, description
+    FROM genes_from_gff
+        LEFT JOIN annotations ON (annotations.gene_id = genes_from_gff.gene_id)
+    ORDER BY genes_from_gff.gene_order;
+"""
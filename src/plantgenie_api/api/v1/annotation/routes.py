@@ -1,60 +1,260 @@
-from typing import List, Tuple
+from contextlib import AsyncExitStack
+from typing import Annotated, Dict, List, Optional, Tuple
 
-from duckdb import DuckDBPyRelation
-from fastapi import APIRouter
-from loguru import logger
+import duckdb
+from fastapi import (
+    APIRouter,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+)
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic_core import to_json
 
 from plantgenie_api.api.v1.annotation.models import (
+    AnnotationSearchHit,
+    AnnotationSearchResponse,
     AnnotationsRequest,
     AnnotationsResponse,
     GeneAnnotation,
 )
-from plantgenie_api.dependencies import DatabaseDep
+from plantgenie_api.api.v1.annotation.queries import ANNOTATIONS_QUERY
+from plantgenie_api.api.v1.annotation.streaming import (
+    ANNOTATION_STREAM_BATCH_ROWS,
+    NDJSON_MEDIA_TYPE,
+    ArrowStreamEncoder,
+    NdjsonEncoder,
+    SessionStreamingResponse,
+    accepts_ndjson,
+    gene_resolution_metadata,
+    stream_record_batches,
+)
+from plantgenie_api.api.v1.expression.arrow import (
+    ARROW_STREAM_MEDIA_TYPE,
+    accepts_arrow_stream,
+)
+from plantgenie_api.database import METADATA_QUERY
+from plantgenie_api.dependencies import (
+    ResponseValidatorsDep,
+    open_database_session,
+    requested_genes,
+)
+from plantgenie_api.genes import GeneResolution
+from plantgenie_api.search_index import (
+    SEARCH_MAX_TERMS,
+    search_parameters,
+    search_query,
+    search_terms,
+    term_clauses,
+)
 
 router = APIRouter(prefix="/annotations", tags=["v1", "annotations"])
 
 
-@router.post("")
+async def stream_annotations(
+    http_request: Request,
+    genes: GeneResolution,
+    encoder: NdjsonEncoder | ArrowStreamEncoder,
+    headers: Dict[str, str],
+) -> StreamingResponse:
+    session_stack = AsyncExitStack()
+    try:
+        db_connection = await session_stack.enter_async_context(
+            open_database_session(http_request)
+        )
+        reader = await db_connection.run(
+            lambda cursor: cursor.execute(
+                ANNOTATIONS_QUERY, {"gene_ids": genes.gene_ids}
+            ).fetch_record_batch(ANNOTATION_STREAM_BATCH_ROWS),
+        )
+    except BaseException:
+        await session_stack.aclose()
+        raise
+
+    schema, resolution_headers = encoder.attach(
+        reader.schema, gene_resolution_metadata(genes)
+    )
+
+    return SessionStreamingResponse(
+        stream_record_batches(
+            session_stack, db_connection, reader, encoder, schema
+        ),
+        session_stack,
+        media_type=encoder.media_type,
+        headers={**headers, **resolution_headers},
+    )
+
+
+@router.post(
+    "",
+    responses={
+        200: {
+            "content": {
+                NDJSON_MEDIA_TYPE: {},
+                ARROW_STREAM_MEDIA_TYPE: {},
+            },
+            "description": (
+                "JSON by default. With `Accept: application/x-ndjson`"
+                " the annotations are streamed as one JSON object per"
+                " line, and with"
+                f" `Accept: {ARROW_STREAM_MEDIA_TYPE}` as an Arrow IPC"
+                " stream with columns gene_id, gene_name and description,"
+                " so that large requests are not held in memory"
+            ),
+        }
+    },
+)
 async def get_annotations(
-    request: AnnotationsRequest, db_connection: DatabaseDep
+    request: AnnotationsRequest,
+    http_request: Request,
+    response_validators: ResponseValidatorsDep,
+    accept: Annotated[Optional[str], Header()] = None,
 ) -> AnnotationsResponse:
-    if len(request.gene_ids) == 0:
+    """
+    Annotations of the requested genes, given as `geneIds` or as the
+    `geneListId` of a stored gene list. Gene ids are resolved first
+    (case, isoform suffixes and aliases); the JSON response reports the
+    ids that were mapped to another gene id and those that are unknown,
+    as do the X-Resolved-Gene-Ids, X-Unresolved-Gene-Ids and
+    X-Ambiguous-Gene-Ids headers of an NDJSON stream and the schema
+    metadata of an Arrow stream.
+    """
+    if len(request.gene_ids) == 0 and request.gene_list_id is None:
         return AnnotationsResponse(results=[])
 
-    # all those \t are just for readability when printing it out for debugging
-    gene_values = "\t" + ",\n\t\t".join(
-        [
-            f"({i}, '{gene}')"
-            for i, gene in enumerate(request.gene_ids, start=1)
-        ]
+    digest, resolve_genes = await requested_genes(
+        http_request, request.gene_ids, request.gene_list_id
+    )
+
+    # the annotations only depend on the database and the gene list, so
+    # a client holding the current ETag is answered without a query
+    if accepts_ndjson(accept):
+        encoder = NdjsonEncoder()
+    elif accepts_arrow_stream(accept):
+        encoder = ArrowStreamEncoder()
+    else:
+        encoder = None
+
+    etag = response_validators.etag(
+        "annotations",
+        encoder.media_type if encoder else "application/json",
+        request.species,
+        digest,
     )
+    not_modified = response_validators.not_modified(http_request, etag)
+    if not_modified is not None:
+        return not_modified
 
-    query = f"""
-        WITH requested_genes(gene_order, gene_id) AS (
-            VALUES
-            {gene_values}
+    genes = await run_in_threadpool(resolve_genes)
+
+    if encoder is not None:
+        return await stream_annotations(
+            http_request,
+            genes,
+            encoder,
+            headers=response_validators.headers(etag),
+        )
+
+    async with open_database_session(http_request) as db_connection:
+        results: List[Tuple[int, str, str]] = await db_connection.fetchall(
+            ANNOTATIONS_QUERY,
+            params={"gene_ids": genes.gene_ids},
+        )
+
+    response = AnnotationsResponse(
+        results=[
+            GeneAnnotation(gene_id=r[0], gene_name=r[1], description=r[2])
+            for r in results
+        ],
+        resolved_gene_ids=genes.resolved,
+        unresolved_gene_ids=genes.unresolved,
+        ambiguous_gene_ids=genes.ambiguous,
+    )
+
+    return Response(
+        content=to_json(response, by_alias=True),
+        media_type="application/json",
+        headers=response_validators.headers(etag),
+    )
+
+
+@router.get("/search")
+async def search_annotations(
+    http_request: Request,
+    response_validators: ResponseValidatorsDep,
+    q: Annotated[str, Query(min_length=1, max_length=200)],
+    genome_id: Optional[int] = None,
+    prefix: Annotated[
+        bool,
+        Query(
+            description="Match the last term as a prefix, for autocomplete"
         ),
-        genes_from_gff AS (
-            SELECT * FROM requested_genes
-                JOIN gff ON (requested_genes.gene_id = gff.feature_id)
-        ) SELECT
-            genes_from_gff.gene_id, gene_name, description
-        FROM genes_from_gff
-            LEFT JOIN annotations ON (annotations.gene_id = genes_from_gff.gene_id)
-        ORDER BY genes_from_gff.gene_order;
+    ] = False,
+    limit: Annotated[int, Query(ge=1, le=100)] = 20,
+    offset: Annotated[int, Query(ge=0)] = 0,
+) -> AnnotationSearchResponse:
+    """
+    Genes whose name or description contains every term of `q`, ranked
+    by BM25.
     """
-    logger.debug(query)
-    query_relation: DuckDBPyRelation = db_connection.sql(
-        query=query,
+    terms = search_terms(q)
+    if not terms:
+        return AnnotationSearchResponse(total=0, results=[])
+    if len(terms) > SEARCH_MAX_TERMS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"At most {SEARCH_MAX_TERMS} search terms are supported",
+        )
+
+    etag = response_validators.etag(
+        "annotation-search",
+        str(genome_id),
+        str(prefix),
+        str(limit),
+        str(offset),
+        *terms,
     )
-    logger.debug("\n" + query_relation.__str__())
-    results: List[Tuple[int, str, str]] = query_relation.fetchall()
+    not_modified = response_validators.not_modified(http_request, etag)
+    if not_modified is not None:
+        return not_modified
 
-    return AnnotationsResponse(
+    clauses = term_clauses(terms, prefix)
+
+    async with open_database_session(http_request) as db_connection:
+        try:
+            results: List[
+                Tuple[str, str, str, float, int]
+            ] = await db_connection.fetchall(
+                search_query(tuple(kind for kind, _ in clauses)),
+                params={
+                    **search_parameters(clauses),
+                    "genome_id": genome_id,
+                    "limit": limit,
+                    "offset": offset,
+                },
+                timeout=METADATA_QUERY,
+            )
+        except duckdb.CatalogException:
+            raise HTTPException(
+                status_code=501,
+                detail="This database has no annotation search index",
+            )
+
+    response = AnnotationSearchResponse(
+        total=results[0][4] if results else 0,
         results=[
-            GeneAnnotation(
-                gene_id=r[0], gene_name=r[1], description=r[2]
+            AnnotationSearchHit(
+                gene_id=r[0], gene_name=r[1], description=r[2], score=r[3]
             )
             for r in results
-        ]
+        ],
+    )
+
+    return Response(
+        content=to_json(response, by_alias=True),
+        media_type="application/json",
+        headers=response_validators.headers(etag),
     )
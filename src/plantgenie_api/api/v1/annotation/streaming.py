@@ -0,0 +1,173 @@
+import io
+import json
+from contextlib import AsyncExitStack
+from typing import AsyncGenerator, Dict, Optional, Tuple
+
+import pyarrow
+import pyarrow.ipc
+from fastapi.responses import StreamingResponse
+from pydantic_core import to_json
+from starlette.types import Receive, Scope, Send
+
+from plantgenie_api.api.v1.expression.arrow import ARROW_STREAM_MEDIA_TYPE
+from plantgenie_api.database import DatabaseSession
+from plantgenie_api.genes import GeneResolution
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# rows fetched from DuckDB and written to the client at a time
+ANNOTATION_STREAM_BATCH_ROWS = 2048
+
+# the keys of the JSON response, so NDJSON lines parse into the same
+# objects as the entries of `results`
+ANNOTATION_JSON_KEYS = ["geneId", "geneName", "description"]
+
+# the gene resolution of a streamed response, as JSON, by the keys of
+# the Arrow schema metadata and the NDJSON response headers
+GENE_RESOLUTION_HEADERS = {
+    "resolved_gene_ids": "X-Resolved-Gene-Ids",
+    "unresolved_gene_ids": "X-Unresolved-Gene-Ids",
+    "ambiguous_gene_ids": "X-Ambiguous-Gene-Ids",
+}
+
+
+def gene_resolution_metadata(genes: GeneResolution) -> Dict[str, str]:
+    # json.dumps escapes non-ASCII, so the values are valid header values
+    return {
+        "resolved_gene_ids": json.dumps(genes.resolved),
+        "unresolved_gene_ids": json.dumps(genes.unresolved),
+        "ambiguous_gene_ids": json.dumps(genes.ambiguous),
+    }
+
+
+def accepts_ndjson(accept: Optional[str]) -> bool:
+    return accept is not None and NDJSON_MEDIA_TYPE in accept
+
+
+class NdjsonEncoder:
+    """One JSON object per line, shaped like a `GeneAnnotation`."""
+
+    media_type = NDJSON_MEDIA_TYPE
+
+    def attach(
+        self, schema: pyarrow.Schema, metadata: Dict[str, str]
+    ) -> Tuple[pyarrow.Schema, Dict[str, str]]:
+        """Lines only hold annotations, so metadata goes in headers."""
+        return schema, {
+            GENE_RESOLUTION_HEADERS.get(key, key): value
+            for key, value in metadata.items()
+        }
+
+    def start(self, schema: pyarrow.Schema) -> bytes:
+        return b""
+
+    def encode(self, batch: pyarrow.RecordBatch) -> bytes:
+        rows = batch.rename_columns(ANNOTATION_JSON_KEYS).to_pylist()
+        return b"".join(to_json(row) + b"\n" for row in rows)
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class ArrowStreamEncoder:
+    """
+    An Arrow IPC stream written one record batch at a time: the schema
+    first, then each batch as it arrives, then the end-of-stream marker.
+    """
+
+    media_type = ARROW_STREAM_MEDIA_TYPE
+
+    def __init__(self) -> None:
+        self.buffer = io.BytesIO()
+        self.writer: Optional[pyarrow.ipc.RecordBatchStreamWriter] = None
+
+    def attach(
+        self, schema: pyarrow.Schema, metadata: Dict[str, str]
+    ) -> Tuple[pyarrow.Schema, Dict[str, str]]:
+        """Metadata goes in the schema, as for expression streams."""
+        return schema.with_metadata(metadata), {}
+
+    def _drain(self) -> bytes:
+        data = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+    def start(self, schema: pyarrow.Schema) -> bytes:
+        self.writer = pyarrow.ipc.new_stream(self.buffer, schema)
+        return self._drain()
+
+    def encode(self, batch: pyarrow.RecordBatch) -> bytes:
+        self.writer.write_batch(batch)
+        return self._drain()
+
+    def finish(self) -> bytes:
+        self.writer.close()
+        return self._drain()
+
+
+def _read_next_batch(
+    reader: pyarrow.RecordBatchReader,
+) -> Optional[pyarrow.RecordBatch]:
+    try:
+        return reader.read_next_batch()
+    except StopIteration:
+        return None
+
+
+async def stream_record_batches(
+    session_stack: AsyncExitStack,
+    db_connection: DatabaseSession,
+    reader: pyarrow.RecordBatchReader,
+    encoder: NdjsonEncoder | ArrowStreamEncoder,
+    schema: pyarrow.Schema,
+) -> AsyncGenerator[bytes, None]:
+    """
+    The body of a streaming response: pulls record batches from DuckDB
+    on the query executor and encodes each one as soon as it arrives, so
+    only one batch is held at a time. The database session is entered by
+    the caller, so that errors before the first row still become a
+    normal error response, and is closed here when the stream ends.
+    `schema` is the reader's schema with the response metadata.
+    """
+    try:
+        yield encoder.start(schema)
+
+        while (
+            batch := await db_connection.run(
+                lambda _: _read_next_batch(reader)
+            )
+        ) is not None:
+            if batch.num_rows:
+                yield encoder.encode(batch)
+
+        yield encoder.finish()
+    finally:
+        await session_stack.aclose()
+
+
+class SessionStreamingResponse(StreamingResponse):
+    """
+    A streaming response that closes its body, and with it the database
+    session, once the response is over, also when the body never
+    started or was abandoned at a chunk because the client went away.
+    Closing either twice is harmless.
+    """
+
+    def __init__(
+        self,
+        content: AsyncGenerator[bytes, None],
+        session_stack: AsyncExitStack,
+        **kwargs,
+    ) -> None:
+        super().__init__(content, **kwargs)
+        self.session_stack = session_stack
+
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+            await self.session_stack.aclose()
@@ -9,6 +9,7 @@ from fastapi import (
     File,
     Form,
     HTTPException,
+    Request,
     UploadFile,
 )
 from fastapi.responses import StreamingResponse
@@ -16,7 +17,7 @@ from loguru import logger
 from shared.constants import BLAST_SERVICE_BUCKET_NAME
 from shared.services.openstack import SwiftClient
 from task_queue.blast.models import ExecuteBlastPipelineArgs
-from task_queue.blast.tasks import execute_blast_pipeline
+from task_queue.client import EXECUTE_BLAST_PIPELINE, enqueue, get_result
 
 from plantgenie_api.api.v1 import BACKEND_DATA_PATH
 from plantgenie_api.api.v1.blast.models import (
@@ -27,7 +28,13 @@ from plantgenie_api.api.v1.blast.models import (
     BlastSubmitResponse,
     BlastVersion,
 )
-from plantgenie_api.dependencies import BlastPathDep, DatabaseDep
+from plantgenie_api.database import METADATA_QUERY
+from plantgenie_api.dependencies import (
+    BlastPathDep,
+    DatabaseDep,
+    MetadataCacheDep,
+    open_database_session,
+)
 
 MAX_FILE_SIZE = 2**20  # 1 Megabyte
 
@@ -48,38 +55,44 @@ async def get_blast_package_version() -> BlastVersion:
 
 @router.get(path="/available-databases")
 async def get_available_databases(
-    db_connection: DatabaseDep,
+    request: Request, metadata_cache: MetadataCacheDep
 ) -> List[AvailableDatabase]:
-    query_relation = db_connection.sql(
-        """
-            SELECT
-                s.species_name,
-                g.version as genome_version,
-                bd.sequence_type,
-                bd.program,
-                bd.database_path,
-              FROM
-                blast_databases bd
-              JOIN
-                species s ON bd.species_id = s.id
-              JOIN
-                genomes g ON bd.genome_id = g.id;
-        """
+    async def build() -> List[AvailableDatabase]:
+        async with open_database_session(request) as db_connection:
+            results: List[Tuple[str, str, str, str, str]] = (
+                await db_connection.fetchall(
+                    """
+                    SELECT
+                        s.species_name,
+                        g.version as genome_version,
+                        bd.sequence_type,
+                        bd.program,
+                        bd.database_path,
+                      FROM
+                        blast_databases bd
+                      JOIN
+                        species s ON bd.species_id = s.id
+                      JOIN
+                        genomes g ON bd.genome_id = g.id;
+                """,
+                    timeout=METADATA_QUERY,
+                )
+            )
+
+        return [
+            AvailableDatabase(
+                species=result[0],
+                genome=result[1],
+                sequence_type=result[2],
+                program=result[3],
+                database_path=result[4],
+            )
+            for result in results
+        ]
+
+    return await metadata_cache.response(
+        request, "available-databases", build
     )
-    results: List[Tuple[str, str, str, str, str]] = (
-        query_relation.fetchall()
-    )
-
-    return [
-        AvailableDatabase(
-            species=result[0],
-            genome=result[1],
-            sequence_type=result[2],
-            program=result[3],
-            database_path=result[4],
-        )
-        for result in results
-    ]
 
 
 @router.post(path="/{program}/submit")
@@ -106,8 +119,9 @@ async def submit_blast(
                 sequence_type = '{database_type}'
         """
     logger.debug(query)
-    sql = db_connection.sql(query=query)
-    blast_path_result: Optional[Tuple[str]] = sql.fetchone()
+    blast_path_result: Optional[Tuple[str]] = (
+        await db_connection.fetchone(query, timeout=METADATA_QUERY)
+    )
 
     if blast_path_result is None:
         raise HTTPException(
@@ -121,7 +135,6 @@ async def submit_blast(
 
     blast_path: str = blast_path_result[0]
 
-    logger.debug(sql.fetchone())
     logger.debug(BACKEND_DATA_PATH / blast_path)
 
     if file.size and (file.size > MAX_FILE_SIZE):
@@ -144,9 +157,7 @@ async def submit_blast(
         query_path=host_file_path.as_posix(),
         database_path=(BACKEND_DATA_PATH / blast_path).as_posix(),
     )
-    execute_blast_pipeline.apply_async(
-        args=(blast_pipeline_args.model_dump(),), task_id=job_id
-    )
+    enqueue(EXECUTE_BLAST_PIPELINE, blast_pipeline_args, task_id=job_id)
 
     # delete_blast_data.s({"job_id": job_id}).apply_async(countdown=15 * 60)
 
@@ -160,7 +171,7 @@ async def submit_blast(
 
 @router.get(path="/poll/{job_id}")
 def poll_blast_job(job_id: str):
-    job_result: AsyncResult = AsyncResult(job_id)
+    job_result: AsyncResult = get_result(job_id)
 
     return BlastPollResponse(
         job_id=job_id,
@@ -185,7 +196,7 @@ def retrieve_blast_result(
     job_id: str,
     output_format: Literal["tsv", "html"],
 ) -> StreamingResponse:
-    job_result: AsyncResult = AsyncResult(job_id)
+    job_result: AsyncResult = get_result(job_id)
 
     if job_result.state == "FAILURE":
         raise HTTPException(
@@ -1,33 +1,85 @@
 import uuid
-from typing import Annotated
+from typing import Annotated, Optional
 
 import requests
 from celery.result import AsyncResult
-from fastapi import APIRouter, File, Form, HTTPException, UploadFile
+from fastapi import (
+    APIRouter,
+    File,
+    Form,
+    HTTPException,
+    Request,
+    UploadFile,
+)
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import FileResponse
-from go_enrich.methods import EnrichmentMethod
+from go_enrich.types import EnrichmentMethod
 from loguru import logger
 from shared.constants import GO_ENRICH_BUCKET_NAME
 from shared.services.openstack import SwiftClient
 from task_queue.enrichment.models import GoEnrichPipelineArgs
-from task_queue.enrichment.tasks import run_go_enrichment_pipeline
+from task_queue.client import (
+    RUN_GO_ENRICHMENT_PIPELINE,
+    enqueue,
+    get_result,
+)
 
 from plantgenie_api.api.v1.enrichment.models import (
     EnrichmentPollResponse,
     EnrichmentSubmissionResponse,
 )
-from plantgenie_api.dependencies import DatabaseDep, GoEnrichmentPathDep
+from plantgenie_api.database import METADATA_QUERY
+from plantgenie_api.dependencies import (
+    DatabaseDep,
+    GoEnrichmentPathDep,
+    requested_genes,
+)
 
 MAX_FILE_SIZE = 2**20
 
 router = APIRouter(prefix="/go-enrichment", tags=["v1", "go-enrichment"])
 
 
+async def read_gene_file(
+    http_request: Request,
+    name: str,
+    genes_file: Optional[UploadFile],
+    gene_list_id: Optional[str],
+) -> bytes:
+    """
+    The line-delimited gene list of an upload, or the resolved gene ids
+    of a stored gene list.
+    """
+    if (genes_file is None) == (gene_list_id is None):
+        raise HTTPException(
+            status_code=422,
+            detail=f"Provide either {name}_genes or {name}_gene_list_id",
+        )
+
+    if gene_list_id is not None:
+        _, resolve_genes = await requested_genes(
+            http_request, [], gene_list_id
+        )
+        genes = await run_in_threadpool(resolve_genes)
+        return "".join(
+            f"{gene_id}\n" for gene_id in genes.gene_ids
+        ).encode()
+
+    if genes_file.size and (genes_file.size > MAX_FILE_SIZE):
+        raise HTTPException(
+            status_code=413,
+            detail=f"Size of {name} genes file - {genes_file.size} > 1MB",
+        )
+
+    return await genes_file.read()
+
+
 @router.post(
     path="/submit",
     description="Provide a set of target genes and background genes to perform a GO Enrichment analysis",
 )
 async def submit_go_enrichment_job(
+    http_request: Request,
     db_connection: DatabaseDep,
     go_enrichment_output_path: GoEnrichmentPathDep,
     genome_id: Annotated[int, Form()],
@@ -43,31 +95,45 @@ async def submit_go_enrichment_job(
             description="Base false discovery rate correction, between 0 and 1"
         ),
     ] = 0.01,
-    target_genes: UploadFile = File(
-        description="Line-delimited list of target genes, maximum size of 1MB"
+    target_genes: Optional[UploadFile] = File(
+        default=None,
+        description="Line-delimited list of target genes, maximum size of 1MB",
     ),
-    background_genes: UploadFile = File(
-        description="Line-delimited list of background genes, maximum size of 1MB"
+    background_genes: Optional[UploadFile] = File(
+        default=None,
+        description="Line-delimited list of background genes, maximum size of 1MB",
     ),
+    target_gene_list_id: Annotated[
+        Optional[str],
+        Form(
+            description="Stored gene list to use instead of target_genes"
+        ),
+    ] = None,
+    background_gene_list_id: Annotated[
+        Optional[str],
+        Form(
+            description="Stored gene list to use instead of background_genes"
+        ),
+    ] = None,
 ) -> EnrichmentSubmissionResponse:
-    if target_genes.size and (target_genes.size > MAX_FILE_SIZE):
-        raise HTTPException(
-            status_code=413,
-            detail=f"Size of target genes file - {target_genes.size} > 1MB",
-        )
-
-    if background_genes.size and (background_genes.size > MAX_FILE_SIZE):
-        raise HTTPException(
-            status_code=413,
-            detail=f"Size of background genes file - {background_genes.size} > 1MB",
-        )
+    target_content = await read_gene_file(
+        http_request, "target", target_genes, target_gene_list_id
+    )
+    background_content = await read_gene_file(
+        http_request,
+        "background",
+        background_genes,
+        background_gene_list_id,
+    )
 
-    sql = db_connection.query(
-        "SELECT * FROM genomes WHERE id = ?", params=[genome_id]
+    genome = await db_connection.fetchone(
+        "SELECT id FROM genomes WHERE id = ?",
+        params=[genome_id],
+        timeout=METADATA_QUERY,
     )
-    logger.debug(sql)
+    logger.debug(genome)
 
-    if not sql.project("id").fetchone() == (genome_id,):
+    if not genome == (genome_id,):
         raise HTTPException(
             status_code=422,
             detail=(f"Genome with id = {genome_id} was not found"),
@@ -81,8 +147,8 @@ async def submit_go_enrichment_job(
         go_enrichment_output_path / f"{go_enrich_job_id}-background.txt"
     ).resolve()
 
-    target_genes_path.write_bytes(await target_genes.read())
-    background_genes_path.write_bytes(await background_genes.read())
+    target_genes_path.write_bytes(target_content)
+    background_genes_path.write_bytes(background_content)
 
     pipeline_args = GoEnrichPipelineArgs(
         target_path=target_genes_path.resolve(True).as_posix(),
@@ -92,8 +158,8 @@ async def submit_go_enrichment_job(
         base_fdr=base_fdr,
     )
 
-    run_go_enrichment_pipeline.apply_async(
-        args=(pipeline_args.model_dump(),), task_id=go_enrich_job_id
+    enqueue(
+        RUN_GO_ENRICHMENT_PIPELINE, pipeline_args, task_id=go_enrich_job_id
     )
 
     return EnrichmentSubmissionResponse(job_id=go_enrich_job_id)
@@ -104,7 +170,7 @@ async def submit_go_enrichment_job(
     description="Use the job id you received from your submission to check if your job has finished.",
 )
 def poll_go_enrichment_job(job_id: str) -> EnrichmentPollResponse:
-    job_result: AsyncResult = AsyncResult(job_id)
+    job_result: AsyncResult = get_result(job_id)
 
     return EnrichmentPollResponse(
         job_id=job_id,
@@ -125,7 +191,7 @@ def poll_go_enrichment_job(job_id: str) -> EnrichmentPollResponse:
 def retrieve_go_enrichment_result(
     go_enrichment_output_path: GoEnrichmentPathDep, job_id: str
 ) -> FileResponse:
-    job_result: AsyncResult = AsyncResult(job_id)
+    job_result: AsyncResult = get_result(job_id)
 
     if job_result.state == "FAILURE":
         raise HTTPException(
@@ -0,0 +1,181 @@
+import json
+from typing import List, Optional, Tuple
+
+import numpy
+import pyarrow
+import pyarrow.compute
+import pyarrow.ipc
+from numpy.typing import NDArray
+from shared.expression_matrix import ExpressionMatrix
+
+from plantgenie_api.api.v1.expression.models import ExpressionClustering
+from plantgenie_api.genes import GeneResolution
+
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+# long format, one row per gene and sample of the response, ordered by
+# requested gene and then by sample like the values of the JSON response,
+# with a null value where the gene has no value in the sample
+EXPRESSION_ARROW_SCHEMA = pyarrow.schema(
+    [
+        pyarrow.field("gene_id", pyarrow.string()),
+        pyarrow.field("sample_id", pyarrow.string()),
+        pyarrow.field("expression_value", pyarrow.float32()),
+    ]
+)
+
+# gene ids, sample ids and their genes x samples values, NaN where a gene
+# has no value in a sample
+DenseExpression = Tuple[List[str], List[str], NDArray[numpy.floating]]
+
+
+def accepts_arrow_stream(accept: Optional[str]) -> bool:
+    return accept is not None and ARROW_STREAM_MEDIA_TYPE in accept
+
+
+def dense_from_query(results: pyarrow.Table) -> DenseExpression:
+    """
+    The values of a long-format expression query result as a matrix,
+    with genes in the order of the results and samples in their
+    `sample_order`.
+    """
+    gene_ids = results.column("gene_id").unique()
+    samples = (
+        results.group_by("sample_id")
+        .aggregate([("sample_order", "min")])
+        .sort_by("sample_order_min")
+        .column("sample_id")
+    )
+
+    values = numpy.full(
+        (len(gene_ids), len(samples)), numpy.nan, dtype=numpy.float64
+    )
+    values[
+        pyarrow.compute.index_in(
+            results.column("gene_id"), value_set=gene_ids
+        ).to_numpy(),
+        pyarrow.compute.index_in(
+            results.column("sample_id"), value_set=samples
+        ).to_numpy(),
+    ] = results.column("expression_value").to_numpy()
+
+    return gene_ids.to_pylist(), samples.to_pylist(), values
+
+
+def dense_from_matrix(
+    matrix: ExpressionMatrix, gene_ids: List[str]
+) -> DenseExpression:
+    genes, rows, _ = matrix.lookup(gene_ids)
+    return genes, matrix.sample_ids, matrix.rows(rows)
+
+
+def drop_empty(expression: DenseExpression) -> DenseExpression:
+    """
+    Leaves out the genes and samples without any value, which a query
+    result has no rows for, so that every source gives the same response.
+    """
+    gene_ids, sample_ids, values = expression
+    present = ~numpy.isnan(values)
+    genes = present.any(axis=1)
+    samples = present.any(axis=0)
+
+    if genes.all() and samples.all():
+        return expression
+    return (
+        [gene_id for gene_id, keep in zip(gene_ids, genes) if keep],
+        [
+            sample_id
+            for sample_id, keep in zip(sample_ids, samples)
+            if keep
+        ],
+        values[genes][:, samples],
+    )
+
+
+def shortest_float32(
+    values: NDArray[numpy.floating],
+) -> NDArray[numpy.float64]:
+    """
+    `values` at the float32 precision the matrices and Arrow streams
+    have, each rounded to the fewest significant digits that read back
+    as the same float32, so JSON shows 0.1 rather than the widened
+    0.10000000149011612 whether a value came from a matrix or from the
+    database. A float32 never needs more than 9 digits. Outside about
+    1e-15 to 1e22 the powers of ten are inexact and the result can be
+    one double off the shortest decimal, but still reads back the same.
+    """
+    single = numpy.asarray(values, dtype=numpy.float32)
+    double = single.astype(numpy.float64)
+    result = double.copy()
+    pending = numpy.isfinite(single) & (single != 0)
+
+    with numpy.errstate(divide="ignore"):
+        exponents = numpy.floor(numpy.log10(numpy.abs(double)))
+
+    for digits in range(1, 10):
+        if not pending.any():
+            break
+        # integers scaled by an exact power of ten, so the division
+        # or multiplication rounds correctly
+        places = numpy.where(pending, digits - 1 - exponents, 0)
+        scale = 10.0 ** numpy.abs(places)
+        rounded = numpy.where(
+            places >= 0,
+            numpy.round(double * scale) / scale,
+            numpy.round(double / scale) * scale,
+        )
+        exact = pending & (rounded.astype(numpy.float32) == single)
+        result[exact] = rounded[exact]
+        pending &= ~exact
+
+    return result
+
+
+def expression_table(expression: DenseExpression) -> pyarrow.Table:
+    gene_ids, sample_ids, values = expression
+    gene_count, sample_count = values.shape
+    flat = values.ravel().astype(numpy.float32)
+
+    return pyarrow.table(
+        [
+            pyarrow.array(gene_ids, pyarrow.string()).take(
+                numpy.repeat(numpy.arange(gene_count), sample_count)
+            ),
+            pyarrow.array(sample_ids, pyarrow.string()).take(
+                numpy.tile(numpy.arange(sample_count), gene_count)
+            ),
+            pyarrow.array(flat, mask=numpy.isnan(flat)),
+        ],
+        schema=EXPRESSION_ARROW_SCHEMA,
+    )
+
+
+def to_arrow_stream(
+    table: pyarrow.Table,
+    genes: GeneResolution,
+    units: Optional[str],
+    clustering: Optional[ExpressionClustering] = None,
+) -> bytes:
+    """
+    Serialises an expression table to the Arrow IPC stream format. The
+    expression units, the requested gene ids that have no values, the
+    ids that were resolved to a different gene id, the ambiguous aliases
+    and any requested clustering are sent in the schema metadata.
+    """
+    metadata = {
+        "units": units or "",
+        "missing_gene_ids": json.dumps(
+            genes.missing(table.column("gene_id").unique().to_pylist())
+        ),
+        "resolved_gene_ids": json.dumps(genes.resolved),
+        "ambiguous_gene_ids": json.dumps(genes.ambiguous),
+    }
+    if clustering is not None:
+        metadata["clustering"] = clustering.model_dump_json(by_alias=True)
+    table = table.replace_schema_metadata(metadata)
+
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    return sink.getvalue().to_pybytes()
@@ -0,0 +1,86 @@
+"""
+Dendrogram orderings of the genes and samples of an expression response,
+for heatmaps.
+
+Genes (or samples) are clustered by average or complete linkage on
+correlation distance, 1 - Pearson correlation, or euclidean distance
+between their rows of the genes x samples matrix. Missing values are
+set to the gene's mean first, as for co-expression. SciPy is imported
+on first use, since it is otherwise only needed by the workers.
+"""
+
+from typing import List
+
+import numpy
+from numpy.typing import NDArray
+from shared.coexpression import standardize
+
+from plantgenie_api.api.v1.expression.models import (
+    ClusteringOptions,
+    ExpressionClustering,
+)
+
+# the distance matrix is n x n, so 5000 genes take 100 MB
+MAX_CLUSTERED_GENES = 5000
+
+
+def fill_missing(values: NDArray[numpy.float32]) -> NDArray[numpy.float32]:
+    """`values` with missing values set to the mean of their row."""
+    present = ~numpy.isnan(values)
+    counts = present.sum(axis=1, keepdims=True)
+    means = numpy.divide(
+        numpy.where(present, values, 0).sum(axis=1, keepdims=True),
+        counts,
+        out=numpy.zeros_like(counts, dtype=numpy.float32),
+        where=counts > 0,
+    )
+    return numpy.where(present, values, means).astype(numpy.float32)
+
+
+def dendrogram_order(
+    values: NDArray[numpy.float32], options: ClusteringOptions
+) -> List[int]:
+    """The rows of `values` in the leaf order of their dendrogram."""
+    if len(values) < 3:
+        return list(range(len(values)))
+
+    from scipy.cluster.hierarchy import leaves_list, linkage
+    from scipy.spatial.distance import pdist, squareform
+
+    if options.distance == "correlation":
+        # rows without variance are all zero, uncorrelated with any row
+        standardized, _ = standardize(values, "pearson")
+        distances = 1 - standardized.astype(numpy.float64) @ standardized.T
+        numpy.clip(distances, 0, 2, out=distances)
+        numpy.fill_diagonal(distances, 0)
+        condensed = squareform(distances, checks=False)
+    else:
+        condensed = pdist(values.astype(numpy.float64), "euclidean")
+
+    return leaves_list(linkage(condensed, method=options.linkage)).tolist()
+
+
+def cluster_expression(
+    values: NDArray[numpy.float32],
+    gene_ids: List[str],
+    sample_ids: List[str],
+    options: ClusteringOptions,
+) -> ExpressionClustering:
+    """Orders the genes and samples of a genes x samples matrix."""
+    filled = fill_missing(values)
+
+    return ExpressionClustering(
+        gene_order=(
+            [gene_ids[row] for row in dendrogram_order(filled, options)]
+            if "genes" in options.axes
+            else None
+        ),
+        sample_order=(
+            [
+                sample_ids[column]
+                for column in dendrogram_order(filled.T, options)
+            ]
+            if "samples" in options.axes
+            else None
+        ),
+    )
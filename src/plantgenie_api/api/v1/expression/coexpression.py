@@ -0,0 +1,86 @@
+"""
+Co-expression neighbours from standardized expression matrices.
+
+Every gene row of an experiment's matrix is centred and scaled to unit
+length once, so the Pearson correlation of two genes is the dot product
+of their rows, and the correlations of a few seed genes with every gene
+are a single matrix product. Spearman correlation is the same on the
+per-gene ranks of the values.
+
+The standardization is shared with the offline network build in
+`shared.coexpression`, whose stored top-k partners are looked up instead
+when an experiment has them. Genes with the same value in every sample
+have no correlation and are never reported.
+"""
+
+from typing import List, Tuple
+
+import numpy
+from numpy.typing import NDArray
+from shared.coexpression import CoexpressionMethod, standardize
+
+
+class StandardizedMatrix:
+    """
+    The gene rows of one experiment, centred and scaled to unit length.
+    `valid` marks the genes that vary across samples.
+    """
+
+    def __init__(
+        self,
+        gene_ids: List[str],
+        values: NDArray[numpy.float32],
+        method: CoexpressionMethod,
+    ) -> None:
+        self.values, self.valid = standardize(values, method)
+        self.gene_ids = gene_ids
+        self.gene_index = {
+            gene_id: row for row, gene_id in enumerate(gene_ids)
+        }
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes
+
+    def neighbours(
+        self, seed_rows: List[int], k: int
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        The `k` genes most correlated with each seed, highest first,
+        leaving out the seed itself. Rows are scanned in one matrix
+        product; picking the top `k` does not sort every gene.
+        """
+        if not seed_rows:
+            return []
+
+        # genes x seeds, one matrix product for all seeds
+        correlations = self.values @ self.values[seed_rows].T
+        correlations[~self.valid] = -numpy.inf
+        correlations[seed_rows, numpy.arange(len(seed_rows))] = -numpy.inf
+
+        k = min(k, int(self.valid.sum()))
+        if k <= 0:
+            return [[] for _ in seed_rows]
+
+        results: List[List[Tuple[str, float]]] = []
+        for column, seed_row in enumerate(seed_rows):
+            if not self.valid[seed_row]:
+                results.append([])
+                continue
+
+            scores = correlations[:, column]
+            top = numpy.argpartition(-scores, k - 1)[:k]
+            # equal correlations in gene order
+            top = top[numpy.lexsort((top, -scores[top]))]
+            results.append(
+                [
+                    (
+                        self.gene_ids[row],
+                        float(numpy.clip(scores[row], -1, 1)),
+                    )
+                    for row in top.tolist()
+                    if scores[row] > -numpy.inf
+                ]
+            )
+
+        return results
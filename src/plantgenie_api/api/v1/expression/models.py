@@ -1,23 +1,121 @@
 from __future__ import annotations
 
-from typing import List, Literal, Optional
+from typing import Annotated, Dict, List, Literal, Optional, Tuple
 
-from pydantic import Field
+from pydantic import Field, StringConstraints, model_validator
 
+from plantgenie_api.api.v1.expression.coexpression import (
+    CoexpressionMethod,
+)
+from plantgenie_api.api.v1.expression.queries import AggregateFunction
+from plantgenie_api.genes import MAX_GENE_IDS
 from plantgenie_api.models import PlantGenieModel
 
 
-class ExpressionRequest(PlantGenieModel):
+class ExperimentGenesRequest(PlantGenieModel):
     experiment_id: int
-    gene_ids: List[str] = Field(min_length=1)
+    gene_ids: List[str] = Field(default=[], max_length=MAX_GENE_IDS)
+    gene_list_id: Optional[str] = Field(default=None)
+
+    @model_validator(mode="after")
+    def check_genes(self) -> "ExperimentGenesRequest":
+        if (self.gene_list_id is None) == (not self.gene_ids):
+            raise ValueError("Provide either geneIds or a geneListId")
+        return self
+
+
+class ClusteringOptions(PlantGenieModel):
+    axes: List[Literal["genes", "samples"]] = Field(
+        default=["genes", "samples"], min_length=1
+    )
+    linkage: Literal["average", "complete"] = "average"
+    distance: Literal["correlation", "euclidean"] = "correlation"
+
+
+# a column of expression_metadata
+MetadataColumn = Annotated[
+    str, StringConstraints(pattern=r"^[A-Za-z_][A-Za-z0-9_]*$")
+]
+
+
+class AggregationOptions(PlantGenieModel):
+    function: AggregateFunction = "mean"
+    group_by: MetadataColumn = "condition"
+
+
+class SampleFilter(PlantGenieModel):
+    # samples have to match every given filter
+    sample_ids: List[str] = Field(default=[])
+    # accepted values per metadata column, e.g. {"condition": ["control"]}
+    metadata: Dict[MetadataColumn, List[str]] = Field(default={})
+
+    @model_validator(mode="after")
+    def check_filters(self) -> "SampleFilter":
+        if not self.sample_ids and not self.metadata:
+            raise ValueError("Provide sampleIds and/or metadata")
+        return self
+
+    def predicates(self) -> List[Tuple[str, List[str]]]:
+        """(column, accepted values), in a stable order."""
+        predicates = [
+            (column, self.metadata[column])
+            for column in sorted(self.metadata)
+        ]
+        if self.sample_ids:
+            predicates.insert(0, ("abbreviation", self.sample_ids))
+        return predicates
+
+
+class ExpressionRequest(ExperimentGenesRequest):
+    samples: Optional[SampleFilter] = Field(default=None)
+    aggregate: Optional[AggregationOptions] = Field(default=None)
+    cluster: Optional[ClusteringOptions] = Field(default=None)
+
+
+class ExpressionClustering(PlantGenieModel):
+    # the leaves of the dendrogram, left to right
+    gene_order: Optional[List[str]] = Field(default=None)
+    sample_order: Optional[List[str]] = Field(default=None)
 
 
 class ExpressionResponse(PlantGenieModel):
     gene_ids: List[str]
     samples: List[str]
-    values: List[float]
+    # genes x samples, gene by gene; null where a gene has no value in
+    # a sample
+    values: List[Optional[float]]
     units: Optional[Literal["tpm", "vst"]] = Field(default=None)
     missing_gene_ids: List[str] = Field(default=[])
+    resolved_gene_ids: Dict[str, str] = Field(default={})
+    # unknown ids that are an alias of several genes, and those genes
+    ambiguous_gene_ids: Dict[str, List[str]] = Field(default={})
+    clustering: Optional[ExpressionClustering] = Field(default=None)
+
+
+class CoexpressionRequest(ExperimentGenesRequest):
+    method: CoexpressionMethod = "pearson"
+    k: int = Field(default=50, ge=1, le=1000)
+
+
+class CoexpressionNeighbour(PlantGenieModel):
+    gene_id: str
+    correlation: float
+
+
+class CoexpressionResult(PlantGenieModel):
+    gene_id: str
+    neighbours: List[CoexpressionNeighbour]
+
+
+class CoexpressionResponse(PlantGenieModel):
+    method: CoexpressionMethod
+    # answered from the stored network, with correlations to float16
+    precomputed: bool = False
+    results: List[CoexpressionResult]
+    missing_gene_ids: List[str] = Field(default=[])
+    resolved_gene_ids: Dict[str, str] = Field(default={})
+    # unknown ids that are an alias of several genes, and those genes
+    ambiguous_gene_ids: Dict[str, List[str]] = Field(default={})
 
 
 class Experiment(PlantGenieModel):
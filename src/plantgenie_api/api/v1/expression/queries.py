@@ -0,0 +1,205 @@
+from functools import lru_cache
+from typing import Dict, List, Literal, Optional, Tuple
+
+from shared.services.database import quote_identifier
+
+from plantgenie_api.genes import keyed_table_name
+
+AggregateFunction = Literal["mean", "median", "sd"]
+
+# (expression_metadata column to group samples by, function)
+Aggregate = Tuple[str, AggregateFunction]
+
+AGGREGATE_FUNCTIONS = {
+    "mean": "avg",
+    "median": "median",
+    "sd": "stddev_samp",
+}
+
+
+def sample_group(aggregate: Optional[Aggregate]) -> str:
+    """
+    The group column of the sample collector, if any; samples without a
+    value in the group column are a group of their own.
+    """
+    if aggregate is None:
+        return ""
+    column, _ = aggregate
+    return (
+        ",\n                    coalesce("
+        f"{quote_identifier(column)}::VARCHAR, abbreviation"
+        ") AS sample_group"
+    )
+
+
+def sample_predicates(sample_filter: Tuple[str, ...]) -> str:
+    """
+    One condition per filtered metadata column, each bound to a list of
+    accepted values as `$sample_filter_<i>`.
+    """
+    return "".join(
+        f"\n                    AND list_contains("
+        f"$sample_filter_{i}::VARCHAR[], {quote_identifier(column)}::VARCHAR)"
+        for i, column in enumerate(sample_filter)
+    )
+
+
+def sample_filter_parameters(
+    sample_filter: List[Tuple[str, List[str]]],
+) -> Dict[str, List[str]]:
+    return {
+        f"sample_filter_{i}": values
+        for i, (_, values) in enumerate(sample_filter)
+    }
+
+
+def carried_group(aggregate: Optional[Aggregate], alias: str) -> str:
+    if aggregate is None:
+        return ""
+    return f"\n                    {alias}.sample_group,"
+
+
+def expression_select(aggregate: Optional[Aggregate]) -> str:
+    """
+    The final select over `expression_values`: every value, or with an
+    `aggregate` one value per gene and sample group under the group's
+    name as `sample_id`, with groups in the order of their first sample.
+    `sample_order` places samples, or groups, that some genes have no
+    value for.
+    Groups whose value is NULL, such as the standard deviation of a
+    single replicate, are left out like samples without a value.
+    """
+    if aggregate is None:
+        return """
+        SELECT
+            sample_id,
+            gene_id,
+            expression_value,
+            sample_order
+        FROM expression_values
+        ORDER BY gene_order, sample_order;
+    """
+
+    function = AGGREGATE_FUNCTIONS[aggregate[1]]
+    return f"""
+        SELECT
+            sample_group AS sample_id,
+            gene_id,
+            {function}(expression_value) AS expression_value,
+            min(sample_order) AS sample_order
+        FROM expression_values
+        GROUP BY gene_order, gene_id, sample_group
+        HAVING {function}(expression_value) IS NOT NULL
+        ORDER BY gene_order, sample_order;
+    """
+
+
+@lru_cache(maxsize=256)
+def expression_query(
+    table_name: str,
+    aggregate: Optional[Aggregate] = None,
+    sample_filter: Tuple[str, ...] = (),
+) -> str:
+    """
+    The expression query for one experiment table.
+
+    Only the table name is part of the query text; the experiment id and
+    the requested genes are bound as `$experiment_id` and `$gene_ids`
+    (a single VARCHAR[] parameter), so the text is the same for every
+    request against the table no matter how many genes are requested.
+
+    With an `aggregate`, samples are grouped by a column of the
+    expression metadata and each group is summarised inside DuckDB, so
+    only one value per gene and group leaves the database.
+
+    `sample_filter` names the metadata columns that samples are selected
+    by, see `sample_predicates`. The samples are filtered in the sample
+    collector, before the cross product with the genes and the join.
+    """
+    return f"""
+        WITH
+            sample_collector AS (
+                SELECT
+                    ROW_NUMBER() OVER () AS sample_order,
+                    abbreviation AS sample_id{sample_group(aggregate)}
+                FROM expression_metadata
+                WHERE experiment_id = $experiment_id{sample_predicates(sample_filter)}
+            ),
+            requested_genes_with_order AS (
+                SELECT
+                    UNNEST($gene_ids::VARCHAR[]) AS gene_id,
+                    generate_subscripts($gene_ids::VARCHAR[], 1)
+                        AS gene_order
+            ),
+            gene_collector AS (
+                SELECT
+                    min(gene_order) as gene_order,
+                    gene_id
+                FROM requested_genes_with_order
+                GROUP BY gene_id
+            ),
+            sample_gene_matrix AS (
+                SELECT{carried_group(aggregate, "s")}
+                    s.sample_id,
+                    s.sample_order,
+                    g.gene_id,
+                    g.gene_order
+                FROM sample_collector s
+                CROSS JOIN gene_collector g
+            ),
+            expression_values AS (
+                SELECT{carried_group(aggregate, "m")}
+                    m.sample_id,
+                    m.gene_id,
+                    e.expression_value,
+                    m.sample_order,
+                    m.gene_order
+                FROM sample_gene_matrix m
+                JOIN {quote_identifier(table_name)} e
+                    ON m.sample_id = e.sample_id
+                   AND m.gene_id = e.gene_id
+            ){expression_select(aggregate)}"""
+
+
+@lru_cache(maxsize=256)
+def keyed_expression_query(
+    table_name: str,
+    aggregate: Optional[Aggregate] = None,
+    sample_filter: Tuple[str, ...] = (),
+) -> str:
+    """
+    The expression query for one experiment of a database with gene
+    keys. The requested genes are bound as `$gene_keys` and the matching
+    `$gene_ids`, already de-duplicated and in request order, so the
+    joins are on integer keys and gene ids are only carried along for
+    the output. `aggregate` and `sample_filter` are as for
+    `expression_query`.
+    """
+    return f"""
+        WITH
+            sample_collector AS (
+                SELECT
+                    ROW_NUMBER() OVER () AS sample_order,
+                    sample_key,
+                    abbreviation AS sample_id{sample_group(aggregate)}
+                FROM expression_metadata
+                WHERE experiment_id = $experiment_id{sample_predicates(sample_filter)}
+            ),
+            gene_collector AS (
+                SELECT
+                    UNNEST($gene_keys::INTEGER[]) AS gene_key,
+                    UNNEST($gene_ids::VARCHAR[]) AS gene_id,
+                    generate_subscripts($gene_keys::INTEGER[], 1)
+                        AS gene_order
+            ),
+            expression_values AS (
+                SELECT{carried_group(aggregate, "s")}
+                    s.sample_id,
+                    s.sample_order,
+                    g.gene_id,
+                    g.gene_order,
+                    e.expression_value
+                FROM {quote_identifier(keyed_table_name(table_name))} e
+                    JOIN gene_collector g ON (g.gene_key = e.gene_key)
+                    JOIN sample_collector s ON (s.sample_key = e.sample_key)
+            ){expression_select(aggregate)}"""
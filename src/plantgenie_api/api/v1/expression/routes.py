@@ -1,170 +1,497 @@
-from typing import Dict, List, Tuple
+from typing import Annotated, Callable, List, Optional, Tuple
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Header, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.exceptions import HTTPException
-from loguru import logger
+from pydantic_core import to_json
+from shared.expression_matrix import (
+    ExpressionMatrixStore,
+    read_expression_matrix,
+)
 
+from plantgenie_api.api.v1.expression.arrow import (
+    ARROW_STREAM_MEDIA_TYPE,
+    DenseExpression,
+    accepts_arrow_stream,
+    dense_from_matrix,
+    dense_from_query,
+    drop_empty,
+    expression_table,
+    shortest_float32,
+    to_arrow_stream,
+)
+from plantgenie_api.api.v1.expression.clustering import (
+    MAX_CLUSTERED_GENES,
+    cluster_expression,
+)
+from plantgenie_api.api.v1.expression.coexpression import (
+    CoexpressionMethod,
+    StandardizedMatrix,
+)
 from plantgenie_api.api.v1.expression.models import (
     AvailableExperimentsResponse,
+    ClusteringOptions,
+    CoexpressionNeighbour,
+    CoexpressionRequest,
+    CoexpressionResponse,
+    CoexpressionResult,
     Experiment,
     ExpressionRequest,
     ExpressionResponse,
 )
-from plantgenie_api.dependencies import DatabaseDep
+from plantgenie_api.api.v1.expression.queries import (
+    expression_query,
+    keyed_expression_query,
+    sample_filter_parameters,
+)
+from plantgenie_api.database import EXPRESSION_QUERY, METADATA_QUERY
+from plantgenie_api.dependencies import (
+    CoexpressionCacheDep,
+    DatabasePoolDep,
+    ExpressionCacheDep,
+    ExpressionMatrixStoreDep,
+    GeneKeysDep,
+    MetadataCacheDep,
+    open_database_session,
+    requested_genes,
+)
+from plantgenie_api.genes import GeneKeyMap, GeneResolution
+
+# seed genes of one co-expression request
+MAX_COEXPRESSION_SEEDS = 100
 
 router = APIRouter(prefix="/expression", tags=["v1", "expression"])
 
 
-@router.post(path="")
-async def get_expression_data(
-    db_connection: DatabaseDep,
-    request: ExpressionRequest,
-) -> ExpressionResponse:
-    experiment = db_connection.sql(
-        "SELECT relation_name, expression_units FROM experiments WHERE id = ?",
-        params=[request.experiment_id],
-    ).fetchone()
+def encode_expression(
+    expression: DenseExpression,
+    genes: GeneResolution,
+    units: Optional[str],
+    cluster: Optional[ClusteringOptions],
+    as_arrow: bool,
+) -> bytes:
+    """
+    Serialises the values of a request, read from a matrix or from the
+    database, to JSON or to an Arrow stream. Both hold every gene and
+    sample of the response, gene by gene, with a null value where the
+    gene has no value in the sample.
+    """
+    expression = drop_empty(expression)
+    gene_ids, sample_ids, values = expression
+    clustering = (
+        cluster_expression(values, gene_ids, sample_ids, cluster)
+        if cluster is not None
+        else None
+    )
 
-    if experiment is None:
-        raise HTTPException(
-            status_code=422,
-            detail=f"Experiment with id={request.experiment_id} not found",
+    if as_arrow:
+        return to_arrow_stream(
+            expression_table(expression), genes, units, clustering
         )
+    # NaN is serialised as null
+    return to_json(
+        ExpressionResponse(
+            gene_ids=gene_ids,
+            samples=sample_ids,
+            values=shortest_float32(values).ravel().tolist(),
+            units=units,
+            missing_gene_ids=genes.missing(gene_ids),
+            resolved_gene_ids=genes.resolved,
+            ambiguous_gene_ids=genes.ambiguous,
+            clustering=clustering,
+        ),
+        by_alias=True,
+    )
+
 
-    try:
-        table_name, expression_units = experiment
-    except IndexError:
+async def expression_payload(
+    http_request: Request,
+    expression_matrix_store: ExpressionMatrixStore,
+    gene_keys: Optional[GeneKeyMap],
+    resolve_genes: Callable[[], GeneResolution],
+    request: ExpressionRequest,
+    as_arrow: bool,
+) -> bytes:
+    # long lists take a while to resolve, so keep them off the loop
+    genes = await run_in_threadpool(resolve_genes)
+    cluster = request.cluster
+    if (
+        cluster is not None
+        and "genes" in cluster.axes
+        and len(genes.gene_ids) > MAX_CLUSTERED_GENES
+    ):
         raise HTTPException(
             status_code=422,
-            detail=f"Either experiment table or units not found {experiment}",
+            detail=f"At most {MAX_CLUSTERED_GENES} genes can be clustered",
         )
 
-    # all those \t are just for readability when printing it out for debugging
-    gene_values = ",\n\t\t\t".join(
-        [
-            f"({i}, '{gene}')"
-            for i, gene in enumerate(request.gene_ids, start=1)
-        ]
+    aggregate = (
+        (request.aggregate.group_by, request.aggregate.function)
+        if request.aggregate is not None
+        else None
+    )
+    sample_filter = (
+        request.samples.predicates() if request.samples is not None else []
+    )
+    # the matrices have no sample metadata, so aggregates and sample
+    # filters are computed by the database
+    matrix = (
+        expression_matrix_store.get(request.experiment_id)
+        if aggregate is None and not sample_filter
+        else None
     )
 
-    query = f"""
-        WITH
-            sample_collector AS (
-                SELECT
-                    ROW_NUMBER() OVER () AS sample_order,
-                    abbreviation AS sample_id
-                FROM expression_metadata
-                WHERE experiment_id = {request.experiment_id}
-            ),
-            requested_genes_with_order(gene_order, gene_id) AS (
-                VALUES
-                    {gene_values}
+    if matrix is not None:
+        # slicing the memory map may page in data, so keep it off the loop
+        return await run_in_threadpool(
+            lambda: encode_expression(
+                dense_from_matrix(matrix, genes.gene_ids),
+                genes,
+                matrix.manifest.expression_units,
+                cluster,
+                as_arrow,
+            )
+        )
+
+    # the result may be shared with coalesced requests, so the query is
+    # not cancelled when this particular client goes away
+    async with open_database_session(
+        http_request, cancel_on_disconnect=False
+    ) as db_connection:
+        experiment = await db_connection.fetchone(
+            "SELECT relation_name, expression_units FROM experiments WHERE id = ?",
+            params=[request.experiment_id],
+            timeout=METADATA_QUERY,
+        )
+
+        if experiment is None:
+            raise HTTPException(
+                status_code=422,
+                detail=f"Experiment with id={request.experiment_id} not found",
+            )
+
+        try:
+            table_name, expression_units = experiment
+        except IndexError:
+            raise HTTPException(
+                status_code=422,
+                detail=f"Either experiment table or units not found {experiment}",
+            )
+
+        metadata_columns = {column for column, _ in sample_filter}
+        if aggregate is not None:
+            metadata_columns.add(aggregate[0])
+        if metadata_columns:
+            known_columns = await db_connection.fetchall(
+                """
+                SELECT column_name
+                FROM information_schema.columns
+                WHERE table_name = 'expression_metadata'
+                """,
+                timeout=METADATA_QUERY,
+            )
+            unknown_columns = metadata_columns - {
+                row[0] for row in known_columns
+            }
+            if unknown_columns:
+                raise HTTPException(
+                    status_code=422,
+                    detail=(
+                        "Samples have no metadata column"
+                        f" {', '.join(sorted(unknown_columns))}"
+                    ),
+                )
+
+        filtered_columns = tuple(column for column, _ in sample_filter)
+        if gene_keys is None:
+            query = expression_query(
+                table_name, aggregate, filtered_columns
+            )
+            params = {
+                "experiment_id": request.experiment_id,
+                "gene_ids": genes.gene_ids,
+                **sample_filter_parameters(sample_filter),
+            }
+        else:
+            # unknown ids are dropped here and never reach the database
+            known_gene_ids, keys = (
+                genes.keyed or gene_keys.lookup(genes.gene_ids)[:2]
+            )
+            query = keyed_expression_query(
+                table_name, aggregate, filtered_columns
+            )
+            params = {
+                "experiment_id": request.experiment_id,
+                "gene_keys": keys,
+                "gene_ids": known_gene_ids,
+                **sample_filter_parameters(sample_filter),
+            }
+
+        # DuckDB hands back Arrow buffers, so values never become
+        # Python floats on their way to an Arrow response
+        results = await db_connection.run(
+            lambda cursor: cursor.execute(
+                query, params
+            ).fetch_arrow_table(),
+            timeout=EXPRESSION_QUERY,
+        )
+
+    # serialised, and clustered, once the connection is back in the pool
+    return await run_in_threadpool(
+        lambda: encode_expression(
+            dense_from_query(results),
+            genes,
+            expression_units,
+            cluster,
+            as_arrow,
+        )
+    )
+
+
+@router.post(
+    path="",
+    responses={
+        200: {
+            "content": {ARROW_STREAM_MEDIA_TYPE: {}},
+            "description": (
+                "JSON by default, or an Arrow IPC stream with columns"
+                " gene_id, sample_id and expression_value when requested"
+                f" with `Accept: {ARROW_STREAM_MEDIA_TYPE}`"
             ),
-            gene_collector AS (
-                SELECT
-                    first(gene_order) as gene_order,
-                    gene_id
-                FROM requested_genes_with_order
-                GROUP BY gene_id
+        }
+    },
+)
+async def get_expression_data(
+    http_request: Request,
+    database_pool: DatabasePoolDep,
+    expression_matrix_store: ExpressionMatrixStoreDep,
+    expression_cache: ExpressionCacheDep,
+    gene_keys: GeneKeysDep,
+    request: ExpressionRequest,
+    accept: Annotated[Optional[str], Header()] = None,
+) -> ExpressionResponse:
+    """
+    Expression values of the requested genes, given as `geneIds` or as
+    the `geneListId` of a stored gene list. Gene ids are resolved
+    first (case, isoform suffixes and aliases): `resolvedGeneIds` maps
+    requested ids to the gene ids they were answered with, and
+    `missingGeneIds` lists the ids that are unknown or have no values in
+    the experiment.
+
+    `values` holds the genes x samples matrix gene by gene, with null
+    where a gene has no value in a sample, as does the expression_value
+    column of an Arrow stream. Samples without a value for any of the
+    genes are left out.
+
+    With `samples`, only the samples with one of the given `sampleIds`
+    and, per `metadata` column, one of the given values are returned;
+    the filter is applied before the samples are joined with the genes.
+
+    With `aggregate`, the replicates are summarised per sample group
+    (`groupBy`, a column of the expression metadata, by default the
+    condition) inside the database, and `samples` lists the groups.
+
+    With `cluster`, the response also carries the dendrogram orderings
+    of the genes and/or samples for a heatmap, in `clustering` (the
+    `clustering` schema metadata of an Arrow stream). They are cached
+    with the values.
+    """
+    as_arrow = accepts_arrow_stream(accept)
+    media_type = (
+        ARROW_STREAM_MEDIA_TYPE if as_arrow else "application/json"
+    )
+    digest, resolve_genes = await requested_genes(
+        http_request, request.gene_ids, request.gene_list_id
+    )
+
+    content = await expression_cache.get_or_build(
+        (
+            database_pool.version,
+            request.experiment_id,
+            media_type,
+            digest,
+            request.model_dump_json(
+                include={"samples", "aggregate", "cluster"}
             ),
-            sample_gene_matrix AS (
-                SELECT
-                    s.sample_id,
-                    s.sample_order,
-                    g.gene_id,
-                    g.gene_order
-                FROM sample_collector s
-                CROSS JOIN gene_collector g
+        ),
+        lambda: expression_payload(
+            http_request,
+            expression_matrix_store,
+            gene_keys,
+            resolve_genes,
+            request,
+            as_arrow,
+        ),
+    )
+
+    return Response(content=content, media_type=media_type)
+
+
+async def standardized_matrix(
+    http_request: Request,
+    expression_matrix_store: ExpressionMatrixStore,
+    experiment_id: int,
+    method: CoexpressionMethod,
+) -> StandardizedMatrix:
+    matrix = expression_matrix_store.get(experiment_id)
+
+    if matrix is not None:
+        gene_ids, values = matrix.manifest.gene_ids, matrix.values
+    else:
+        # shared by every request for the experiment, so not cancelled
+        # when the client that started it goes away
+        async with open_database_session(
+            http_request, cancel_on_disconnect=False
+        ) as db_connection:
+            try:
+                manifest, values = await db_connection.run(
+                    lambda cursor: read_expression_matrix(
+                        cursor, experiment_id
+                    ),
+                    timeout=EXPRESSION_QUERY,
+                )
+            except ValueError as error:
+                raise HTTPException(status_code=422, detail=str(error))
+        gene_ids = manifest.gene_ids
+
+    return await run_in_threadpool(
+        StandardizedMatrix, gene_ids, values, method
+    )
+
+
+@router.post(path="/coexpression")
+async def get_coexpression(
+    http_request: Request,
+    database_pool: DatabasePoolDep,
+    expression_matrix_store: ExpressionMatrixStoreDep,
+    coexpression_cache: CoexpressionCacheDep,
+    request: CoexpressionRequest,
+) -> CoexpressionResponse:
+    """
+    The `k` genes whose expression across the samples of the experiment
+    correlates most with each seed gene. An exported experiment with a
+    stored network (`plantgenie-db coexpression-network`) of at least
+    `k` partners per gene is answered from it. Otherwise the
+    standardized matrix of the experiment is built on first use and
+    cached, so a query is a single matrix product over all genes.
+    """
+    _, resolve_genes = await requested_genes(
+        http_request, request.gene_ids, request.gene_list_id
+    )
+    genes = await run_in_threadpool(resolve_genes)
+    if len(genes.gene_ids) > MAX_COEXPRESSION_SEEDS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"At most {MAX_COEXPRESSION_SEEDS} seed genes are supported",
+        )
+
+    matrix = expression_matrix_store.get(request.experiment_id)
+    network = (
+        matrix.network(request.method) if matrix is not None else None
+    )
+    precomputed = network is not None and network.k >= request.k
+
+    if precomputed:
+        # stored top-k partners, an index lookup per seed
+        gene_index = matrix.gene_index
+        seeds = [
+            gene_id for gene_id in genes.gene_ids if gene_id in gene_index
+        ]
+        neighbours = []
+        for gene_id in seeds:
+            rows, correlations = network.partners(
+                gene_index[gene_id], request.k
+            )
+            neighbours.append(
+                [
+                    (matrix.manifest.gene_ids[row], correlation)
+                    for row, correlation in zip(rows, correlations)
+                ]
+            )
+    else:
+        standardized = await coexpression_cache.get_or_build(
+            (database_pool.version, request.experiment_id, request.method),
+            lambda: standardized_matrix(
+                http_request,
+                expression_matrix_store,
+                request.experiment_id,
+                request.method,
             ),
-            expression_values AS (
-                SELECT
-                    m.sample_id,
-                    m.gene_id,
-                    e.expression_value,
-                    m.sample_order,
-                    m.gene_order
-                FROM sample_gene_matrix m
-                JOIN {table_name} e
-                    ON m.sample_id = e.sample_id
-                   AND m.gene_id = e.gene_id
+        )
+        gene_index = standardized.gene_index
+        seeds = [
+            gene_id for gene_id in genes.gene_ids if gene_id in gene_index
+        ]
+        neighbours = await run_in_threadpool(
+            standardized.neighbours,
+            [gene_index[gene_id] for gene_id in seeds],
+            request.k,
+        )
+
+    return CoexpressionResponse(
+        method=request.method,
+        precomputed=precomputed,
+        results=[
+            CoexpressionResult(
+                gene_id=gene_id,
+                neighbours=[
+                    CoexpressionNeighbour(
+                        gene_id=neighbour, correlation=correlation
+                    )
+                    for neighbour, correlation in gene_neighbours
+                ],
             )
-        SELECT
-            sample_id,
-            gene_id,
-            expression_value
-        FROM expression_values
-        ORDER BY gene_order, sample_order;
-    """
-    logger.debug(query)
-    query_relation = db_connection.sql(query=query)
-    logger.debug("\n" + query_relation.__str__())
-    results = query_relation.fetchall()
-    # ---------------------------
-    sample_order: Dict[str, int] = {}
-    gene_order: Dict[str, int] = {}
-    samples: List[str] = []
-    genes: List[str] = []
-    values: List[float] = []
-
-    for sample_id, gene_id, expression_value in results:
-        if sample_id not in sample_order:
-            sample_order[sample_id] = len(samples)
-            samples.append(sample_id)
-        if gene_id not in gene_order:
-            gene_order[gene_id] = len(genes)
-            genes.append(gene_id)
-        values.append(expression_value)
-
-    missing_genes = [
-        gene_id
-        for gene_id in request.gene_ids
-        if gene_id not in gene_order
-    ]
-    return ExpressionResponse(
-        gene_ids=genes,
-        samples=samples,
-        values=values,
-        units=expression_units,
-        missing_gene_ids=missing_genes,
+            for gene_id, gene_neighbours in zip(seeds, neighbours)
+        ],
+        missing_gene_ids=genes.unresolved
+        + [
+            gene_id
+            for gene_id in genes.gene_ids
+            if gene_id not in gene_index
+        ],
+        resolved_gene_ids=genes.resolved,
+        ambiguous_gene_ids=genes.ambiguous,
     )
 
 
 @router.get(path="/available-experiments")
 async def get_available_experiments(
-    db_connection: DatabaseDep,
+    request: Request, metadata_cache: MetadataCacheDep
 ) -> AvailableExperimentsResponse:
-    # with SafeDuckDbConnection(
-    #     f"{backend_config.get("DATA_PATH")}/{backend_config.get("DATABASE_NAME")}",
-    #     allowed_directories=[backend_config.get("DATA_PATH")],
-    #     read_only=True,
-    # ) as connection:
-    experiments: List[Tuple[int, int, int, str, str, str]] = (
-        db_connection.sql(
-            """
-                SELECT
-                    e.id AS experiment_id,
-                    s.id AS species_id,
-                    g.id AS genome_id,
-                    e.title AS experiment_title,
-                    s.species_name,
-                    g.version AS genome_version,
-                FROM experiments e
-                    JOIN genomes g ON (e.genome_id = g.id)
-                    JOIN species s ON (s.id = g.species_id);
-            """
-        ).fetchall()
-    )
-
-    return AvailableExperimentsResponse(
-        experiments=[
-            Experiment(
-                experiment_id=row[0],
-                species_id=row[1],
-                genome_id=row[2],
-                experiment_title=row[3],
-                species_name=row[4],
-                genome_version=row[5],
+    async def build() -> AvailableExperimentsResponse:
+        async with open_database_session(request) as db_connection:
+            experiments: List[Tuple[int, int, int, str, str, str]] = (
+                await db_connection.fetchall(
+                    """
+                        SELECT
+                            e.id AS experiment_id,
+                            s.id AS species_id,
+                            g.id AS genome_id,
+                            e.title AS experiment_title,
+                            s.species_name,
+                            g.version AS genome_version,
+                        FROM experiments e
+                            JOIN genomes g ON (e.genome_id = g.id)
+                            JOIN species s ON (s.id = g.species_id);
+                    """,
+                    timeout=METADATA_QUERY,
+                )
             )
-            for row in experiments
-        ]
+
+        return AvailableExperimentsResponse(
+            experiments=[
+                Experiment(
+                    experiment_id=row[0],
+                    species_id=row[1],
+                    genome_id=row[2],
+                    experiment_title=row[3],
+                    species_name=row[4],
+                    genome_version=row[5],
+                )
+                for row in experiments
+            ]
+        )
+
+    return await metadata_cache.response(
+        request, "available-experiments", build
     )
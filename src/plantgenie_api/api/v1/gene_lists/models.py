@@ -0,0 +1,30 @@
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from pydantic import Field
+
+from plantgenie_api.genes import MAX_GENE_IDS
+from plantgenie_api.models import PlantGenieModel
+
+
+class GeneListRequest(PlantGenieModel):
+    name: Optional[str] = Field(default=None, max_length=200)
+    gene_ids: List[str] = Field(min_length=1, max_length=MAX_GENE_IDS)
+
+
+class GeneListCreatedResponse(PlantGenieModel):
+    gene_list_id: str
+    name: Optional[str]
+    created_at: datetime
+    gene_count: int
+    resolved_gene_ids: Dict[str, str]
+    unresolved_gene_ids: List[str]
+    # unknown ids that are an alias of several genes, and those genes
+    ambiguous_gene_ids: Dict[str, List[str]]
+
+
+class GeneListResponse(PlantGenieModel):
+    gene_list_id: str
+    name: Optional[str]
+    created_at: datetime
+    gene_ids: List[str]
@@ -0,0 +1,62 @@
+from fastapi import APIRouter, Request
+from fastapi.concurrency import run_in_threadpool
+
+from plantgenie_api.api.v1.gene_lists.models import (
+    GeneListCreatedResponse,
+    GeneListRequest,
+    GeneListResponse,
+)
+from plantgenie_api.dependencies import (
+    GeneListStoreDep,
+    find_gene_list,
+    requested_genes,
+)
+
+router = APIRouter(prefix="/gene-lists", tags=["v1", "gene-lists"])
+
+
+@router.post("", status_code=201)
+async def create_gene_list(
+    http_request: Request,
+    gene_list_store: GeneListStoreDep,
+    request: GeneListRequest,
+) -> GeneListCreatedResponse:
+    """
+    Stores a gene list. Its id can be passed as `geneListId` to the
+    expression and annotation endpoints, and as a gene list id to GO
+    enrichment, instead of sending the ids again. The list is resolved
+    against the current release right away, so the response reports
+    the ids that were mapped to another gene id and the unknown ones.
+    """
+    gene_list = await gene_list_store.create(
+        request.name, request.gene_ids
+    )
+
+    _, resolve_genes = await requested_genes(
+        http_request, [], gene_list.list_id
+    )
+    genes = await run_in_threadpool(resolve_genes)
+
+    return GeneListCreatedResponse(
+        gene_list_id=gene_list.list_id,
+        name=gene_list.name,
+        created_at=gene_list.created_at,
+        gene_count=len(genes.gene_ids),
+        resolved_gene_ids=genes.resolved,
+        unresolved_gene_ids=genes.unresolved,
+        ambiguous_gene_ids=genes.ambiguous,
+    )
+
+
+@router.get("/{gene_list_id}")
+async def get_gene_list(
+    http_request: Request, gene_list_id: str
+) -> GeneListResponse:
+    gene_list = await find_gene_list(http_request, gene_list_id)
+
+    return GeneListResponse(
+        gene_list_id=gene_list.list_id,
+        name=gene_list.name,
+        created_at=gene_list.created_at,
+        gene_ids=gene_list.gene_ids,
+    )
@@ -0,0 +1,22 @@
+from typing import Dict, List
+
+from pydantic import Field
+
+from plantgenie_api.genes import MAX_GENE_IDS
+from plantgenie_api.models import PlantGenieModel
+
+
+class GeneCompletionResponse(PlantGenieModel):
+    gene_ids: List[str]
+
+
+class GeneResolutionRequest(PlantGenieModel):
+    gene_ids: List[str] = Field(max_length=MAX_GENE_IDS)
+
+
+class GeneResolutionResponse(PlantGenieModel):
+    gene_ids: List[str]
+    resolved_gene_ids: Dict[str, str]
+    unresolved_gene_ids: List[str]
+    # unknown ids that are an alias of several genes, and those genes
+    ambiguous_gene_ids: Dict[str, List[str]]
@@ -0,0 +1,53 @@
+from typing import Annotated, Optional
+
+from fastapi import APIRouter, Query
+from fastapi.concurrency import run_in_threadpool
+
+from plantgenie_api.api.v1.genes.models import (
+    GeneCompletionResponse,
+    GeneResolutionRequest,
+    GeneResolutionResponse,
+)
+from plantgenie_api.dependencies import GeneIdsDep, GeneResolverDep
+
+router = APIRouter(prefix="/genes", tags=["v1", "genes"])
+
+
+@router.get("/complete")
+async def complete_gene_ids(
+    gene_ids: GeneIdsDep,
+    prefix: Annotated[str, Query(min_length=1, max_length=100)],
+    genome_id: Optional[int] = None,
+    limit: Annotated[int, Query(ge=1, le=100)] = 20,
+) -> GeneCompletionResponse:
+    """
+    Gene ids starting with `prefix`, ignoring case, for suggestions
+    while a gene list is typed. Served from the in-memory index of the
+    current release, without a database query.
+    """
+    return GeneCompletionResponse(
+        gene_ids=gene_ids.complete(prefix, genome_id, limit)
+    )
+
+
+@router.post("/resolve")
+async def resolve_gene_ids(
+    gene_resolver: GeneResolverDep, request: GeneResolutionRequest
+) -> GeneResolutionResponse:
+    """
+    Maps a pasted gene list to the gene ids of the current release,
+    ignoring case and isoform suffixes and following aliases and ids of
+    older genome versions. `geneIds` are the gene ids found, once each
+    and in request order.
+    """
+    # long lists take a while to resolve, so keep them off the loop
+    genes = await run_in_threadpool(
+        gene_resolver.resolve, request.gene_ids
+    )
+
+    return GeneResolutionResponse(
+        gene_ids=genes.gene_ids,
+        resolved_gene_ids=genes.resolved,
+        unresolved_gene_ids=genes.unresolved,
+        ambiguous_gene_ids=genes.ambiguous,
+    )
@@ -1,32 +1,55 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 
 from plantgenie_api.api.v1.genome.models import (
     AvailableGenome,
     AvailableGenomesResponse,
 )
-from plantgenie_api.dependencies import DatabaseDep
+from plantgenie_api.database import METADATA_QUERY
+from plantgenie_api.dependencies import (
+    MetadataCacheDep,
+    open_database_session,
+)
+
 
 router = APIRouter(prefix="/genome")
 
 
 @router.get(path="/available-genomes", tags=["v1", "genome"])
 async def get_available_genomes(
-    db_connection: DatabaseDep,
+    request: Request, metadata_cache: MetadataCacheDep
 ) -> AvailableGenomesResponse:
-    query_relation = db_connection.sql(
-        "SELECT * FROM genomes JOIN species ON (genomes.species_id = species.id);"
-    ).project(
-        "id", "species_id", "species_name", "version", "publication_date", "doi"
-    )
-
-    return AvailableGenomesResponse(
-        genomes=[
-            AvailableGenome(
-                **{
-                    k: v
-                    for k, v in zip(AvailableGenome.model_fields.keys(), result)
-                }
+    async def build() -> AvailableGenomesResponse:
+        async with open_database_session(request) as db_connection:
+            results = await db_connection.run(
+                lambda cursor: cursor.sql(
+                    "SELECT * FROM genomes JOIN species ON (genomes.species_id = species.id);"
+                )
+                .project(
+                    "id",
+                    "species_id",
+                    "species_name",
+                    "version",
+                    "publication_date",
+                    "doi",
+                )
+                .fetchall(),
+                timeout=METADATA_QUERY,
             )
-            for result in query_relation.fetchall()
-        ]
+
+        return AvailableGenomesResponse(
+            genomes=[
+                AvailableGenome(
+                    **{
+                        k: v
+                        for k, v in zip(
+                            AvailableGenome.model_fields.keys(), result
+                        )
+                    }
+                )
+                for result in results
+            ]
+        )
+
+    return await metadata_cache.response(
+        request, "available-genomes", build
     )
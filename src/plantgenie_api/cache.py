@@ -0,0 +1,278 @@
+import asyncio
+import functools
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Generic,
+    Hashable,
+    Iterable,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+from fastapi import Request, Response
+from pydantic_core import to_json
+
+from plantgenie_api.models import MetadataCacheStats, ResultCacheStats
+
+T = TypeVar("T")
+
+
+def database_version(database_path: str | Path) -> str:
+    """
+    Identifies one database file by inode, size and modification time.
+    Deploying a new file, either by replacing it or by writing to it,
+    changes the version.
+    """
+    stat = os.stat(database_path)
+    return f"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+
+def gene_list_digest(gene_ids: Iterable[str]) -> str:
+    """
+    A key for a requested gene list. Responses keep the request order
+    and ignore repeated genes, so the digest does too.
+    """
+    digest = hashlib.sha256()
+    for gene_id in dict.fromkeys(gene_ids):
+        digest.update(gene_id.encode())
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class ResponseValidators:
+    """
+    Strong ETags for responses that only depend on the database and the
+    request, and the matching `If-None-Match` handling.
+
+    The ETag is computed from the database version and a request key
+    before any work is done, so a client that already has the current
+    representation gets `304 Not Modified` without a query being run.
+    """
+
+    def __init__(self, version: Callable[[], str], max_age: int) -> None:
+        self.version = version
+        self.max_age = max_age
+
+    def etag(self, *parts: str) -> str:
+        digest = hashlib.sha256(self.version().encode())
+        for part in parts:
+            digest.update(b"\x00")
+            digest.update(part.encode())
+        return f'"{digest.hexdigest()[:32]}"'
+
+    def headers(self, etag: str) -> Dict[str, str]:
+        return {
+            "ETag": etag,
+            "Cache-Control": f"public, max-age={self.max_age}",
+        }
+
+    def not_modified(
+        self, request: Request, etag: str
+    ) -> Optional[Response]:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is None:
+            return None
+
+        # If-None-Match uses the weak comparison
+        candidates = {
+            candidate.strip().removeprefix("W/")
+            for candidate in if_none_match.split(",")
+        }
+        if "*" in candidates or etag in candidates:
+            return Response(status_code=304, headers=self.headers(etag))
+
+        return None
+
+
+class MetadataCache:
+    """
+    In-process cache of serialised responses of the metadata endpoints.
+
+    Entries are stored together with the version of the database they
+    were built from and are rebuilt on first use after the version
+    returned by `version` changes. Responses are kept as JSON bytes, so
+    a hit neither queries the database nor goes through pydantic.
+    """
+
+    def __init__(self, validators: ResponseValidators) -> None:
+        self.validators = validators
+        self.version = validators.version
+        self._entries: Dict[str, Tuple[str, bytes]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._hits = 0
+        self._misses = 0
+        self._not_modified = 0
+
+    async def get_or_build(
+        self, key: str, build: Callable[[], Awaitable[Any]]
+    ) -> bytes:
+        version = self.version()
+        entry = self._entries.get(key)
+
+        if entry is not None and entry[0] == version:
+            self._hits += 1
+            return entry[1]
+
+        # concurrent misses on the same key wait for a single build
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._hits += 1
+                return entry[1]
+
+            self._misses += 1
+            content = to_json(await build(), by_alias=True)
+            self._entries[key] = (version, content)
+            return content
+
+    async def response(
+        self,
+        request: Request,
+        key: str,
+        build: Callable[[], Awaitable[Any]],
+    ) -> Response:
+        etag = self.validators.etag(key)
+        not_modified = self.validators.not_modified(request, etag)
+        if not_modified is not None:
+            self._not_modified += 1
+            return not_modified
+
+        return Response(
+            content=await self.get_or_build(key, build),
+            media_type="application/json",
+            headers=self.validators.headers(etag),
+        )
+
+    def stats(self) -> MetadataCacheStats:
+        return MetadataCacheStats(
+            version=self.version(),
+            entries=len(self._entries),
+            hits=self._hits,
+            misses=self._misses,
+            not_modified=self._not_modified,
+        )
+
+
+class ResultCache(Generic[T]):
+    """
+    Bounded LRU cache of serialised responses with a time to live. It
+    can hold other values, such as arrays, given a `size` in bytes for
+    them.
+
+    Entries are evicted least recently used first once either
+    `max_entries` or `max_bytes` is exceeded. Concurrent misses on the
+    same key are coalesced: the first request starts the build and the
+    others wait for it, so N identical requests run the query once. A
+    failed build is not cached and the error is raised to every waiter.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        max_bytes: int = 256 * 2**20,
+        ttl: float = 3600.0,
+        clock: Callable[[], float] = time.monotonic,
+        size: Callable[[T], int] = len,
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.size = size
+
+        self._entries: OrderedDict[Hashable, Tuple[float, T]] = (
+            OrderedDict()
+        )
+        self._in_flight: Dict[Hashable, asyncio.Future[T]] = {}
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def _get(self, key: Hashable) -> Optional[T]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires, content = entry
+        if self.clock() >= expires:
+            self._remove(key)
+            self._expirations += 1
+            return None
+
+        self._entries.move_to_end(key)
+        return content
+
+    def _remove(self, key: Hashable) -> None:
+        _, content = self._entries.pop(key)
+        self._bytes -= self.size(content)
+
+    def _put(self, key: Hashable, content: T) -> None:
+        size = self.size(content)
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = (self.clock() + self.ttl, content)
+        self._bytes += size
+
+        while (
+            len(self._entries) > self.max_entries
+            or self._bytes > self.max_bytes
+        ):
+            self._remove(next(iter(self._entries)))
+            self._evictions += 1
+
+    async def get_or_build(
+        self, key: Hashable, build: Callable[[], Awaitable[T]]
+    ) -> T:
+        content = self._get(key)
+        if content is not None:
+            self._hits += 1
+            return content
+
+        task = self._in_flight.get(key)
+        if task is None:
+            self._misses += 1
+            task = asyncio.ensure_future(build())
+            self._in_flight[key] = task
+            task.add_done_callback(functools.partial(self._finish, key))
+        else:
+            self._coalesced += 1
+
+        # the build runs as its own task and is shielded, so a client
+        # going away does not cancel it for the other waiters
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Future[T]) -> None:
+        del self._in_flight[key]
+
+        if not task.cancelled() and task.exception() is None:
+            self._put(key, task.result())
+
+    def stats(self) -> ResultCacheStats:
+        return ResultCacheStats(
+            entries=len(self._entries),
+            bytes=self._bytes,
+            max_entries=self.max_entries,
+            max_bytes=self.max_bytes,
+            hits=self._hits,
+            misses=self._misses,
+            coalesced=self._coalesced,
+            evictions=self._evictions,
+            expirations=self._expirations,
+        )
@@ -0,0 +1,373 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    List,
+    Literal,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+
+import duckdb
+from duckdb import DuckDBPyConnection
+from fastapi import HTTPException, Request
+from loguru import logger
+
+from plantgenie_api.cache import database_version
+from plantgenie_api.models import DatabasePoolStats, QueryExecutorStats
+
+T = TypeVar("T")
+
+# what a query is, for its timeout: `DATABASE_METADATA_QUERY_TIMEOUT`,
+# `DATABASE_EXPRESSION_QUERY_TIMEOUT` or `DATABASE_QUERY_TIMEOUT`
+QueryKind = Literal["default", "metadata", "expression"]
+
+METADATA_QUERY: QueryKind = "metadata"
+EXPRESSION_QUERY: QueryKind = "expression"
+
+
+class DatabasePoolTimeout(Exception):
+    pass
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class DatabasePool:
+    """
+    A process-wide, read-only DuckDB connection.
+
+    The database file is opened once and every request checks out a
+    cursor, which is a lightweight child connection sharing the catalog
+    and buffer manager of the parent. The number of cursors that can be
+    checked out at the same time is bounded by `pool_size`.
+    """
+
+    def __init__(
+        self,
+        database_path: str | Path,
+        pool_size: int = 8,
+        threads: Optional[int] = None,
+        memory_limit: Optional[str] = None,
+        checkout_timeout: float = 30.0,
+        slow_checkout_seconds: float = 0.05,
+        allowed_directories: Optional[List[str]] = None,
+        version: Optional[str] = None,
+    ) -> None:
+        if pool_size < 1:
+            raise ValueError(
+                f"pool_size must be at least 1, got {pool_size}"
+            )
+
+        self.database_path = Path(database_path).as_posix()
+        # the version of the file as opened; the connection keeps reading
+        # it even if the path is later replaced by a new deployment. A
+        # copy of a file is opened with the version of the original.
+        self.version = version or database_version(self.database_path)
+        self.pool_size = pool_size
+        self.checkout_timeout = checkout_timeout
+        self.slow_checkout_seconds = slow_checkout_seconds
+
+        config: Dict[str, Any] = {}
+        if threads:
+            config["threads"] = threads
+        if memory_limit:
+            config["memory_limit"] = memory_limit
+
+        self.connection: DuckDBPyConnection = duckdb.connect(
+            self.database_path, read_only=True, config=config
+        )
+
+        if allowed_directories is not None:
+            dir_list_str = ", ".join(
+                [f"'{d}'" for d in allowed_directories]
+            )
+            self.connection.execute(
+                f"SET allowed_directories = [{dir_list_str}];"
+            )
+
+        self.connection.execute("SET enable_external_access = false")
+        self.connection.execute("SET lock_configuration = true")
+
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def acquire(self) -> DuckDBPyConnection:
+        start = time.perf_counter()
+
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            with self._lock:
+                self._timeouts += 1
+            raise DatabasePoolTimeout(
+                f"No database cursor became available within {self.checkout_timeout}s"
+            )
+
+        waited = time.perf_counter() - start
+
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+
+        if waited > self.slow_checkout_seconds:
+            logger.warning(
+                f"Waited {waited * 1000:.1f}ms for a database cursor"
+                f" ({self.pool_size} in pool)"
+            )
+
+        try:
+            return self.connection.cursor()
+        except BaseException:
+            self._release_slot()
+            raise
+
+    def release(self, cursor: DuckDBPyConnection) -> None:
+        try:
+            cursor.close()
+        finally:
+            self._release_slot()
+
+    def _release_slot(self) -> None:
+        with self._lock:
+            self._in_use -= 1
+        self._slots.release()
+
+    @contextmanager
+    def checkout(self) -> Generator[DuckDBPyConnection, None, None]:
+        cursor = self.acquire()
+        try:
+            yield cursor
+        finally:
+            self.release(cursor)
+
+    def stats(self) -> DatabasePoolStats:
+        with self._lock:
+            return DatabasePoolStats(
+                database_path=self.database_path,
+                database_version=self.version,
+                pool_size=self.pool_size,
+                in_use=self._in_use,
+                checkouts=self._checkouts,
+                timeouts=self._timeouts,
+                total_wait_seconds=self._total_wait,
+                max_wait_seconds=self._max_wait,
+                mean_wait_seconds=(
+                    self._total_wait / self._checkouts
+                    if self._checkouts
+                    else 0.0
+                ),
+            )
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class QueryExecutor:
+    """
+    Runs blocking DuckDB work on a dedicated thread pool so that the
+    event loop keeps serving other requests while a query is running.
+
+    At most `max_workers` queries run at the same time; further queries
+    wait on a semaphore and the time spent waiting is recorded. A query
+    that exceeds its timeout, or whose client goes away, is cancelled
+    with `interrupt()` on its cursor.
+
+    A timeout is given in seconds or as a `QueryKind`, whose timeout is
+    looked up in `timeouts`; kinds without one use `default_timeout`.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 8,
+        default_timeout: float = 30.0,
+        timeouts: Optional[Dict[QueryKind, float]] = None,
+        slow_wait_seconds: float = 0.05,
+        disconnect_poll_interval: float = 0.25,
+    ) -> None:
+        self.max_workers = max_workers
+        self.default_timeout = default_timeout
+        self.timeouts = timeouts or {}
+        self.slow_wait_seconds = slow_wait_seconds
+        self.disconnect_poll_interval = disconnect_poll_interval
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="duckdb-query"
+        )
+        self._semaphore = asyncio.Semaphore(max_workers)
+        self._waiting = 0
+        self._running = 0
+        self._executed = 0
+        self._timeouts = 0
+        self._interrupted = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    async def run(
+        self,
+        cursor: DuckDBPyConnection,
+        work: Callable[[DuckDBPyConnection], T],
+        timeout: Optional[float | QueryKind] = None,
+        request: Optional[Request] = None,
+    ) -> T:
+        timeout = self.timeout(timeout)
+        loop = asyncio.get_running_loop()
+
+        start = time.perf_counter()
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+
+        waited = time.perf_counter() - start
+        self._total_wait += waited
+        self._max_wait = max(self._max_wait, waited)
+
+        if waited > self.slow_wait_seconds:
+            logger.warning(
+                f"Query waited {waited * 1000:.1f}ms for a worker thread"
+            )
+
+        self._running += 1
+        future: Optional[asyncio.Future[T]] = None
+        deadline = loop.time() + timeout
+
+        try:
+            future = loop.run_in_executor(self._executor, work, cursor)
+
+            while True:
+                remaining = deadline - loop.time()
+
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise QueryTimeout(
+                        f"Query did not finish within {timeout}s"
+                    )
+
+                done, _ = await asyncio.wait(
+                    {future},
+                    timeout=min(remaining, self.disconnect_poll_interval),
+                )
+
+                if done:
+                    return future.result()
+
+                if request is not None and await request.is_disconnected():
+                    raise ClientDisconnected(
+                        "Client disconnected before the query finished"
+                    )
+        except BaseException:
+            if future is not None and not future.done():
+                self._interrupted += 1
+                cursor.interrupt()
+                # the cursor may only be released once the worker thread
+                # has let go of it, so wait for the interrupted query
+                await asyncio.wait({future})
+                future.exception()
+            raise
+        finally:
+            self._running -= 1
+            self._executed += 1
+            self._semaphore.release()
+
+    def timeout(self, timeout: Optional[float | QueryKind]) -> float:
+        if timeout is None:
+            return self.default_timeout
+        if isinstance(timeout, str):
+            return self.timeouts.get(timeout, self.default_timeout)
+        return timeout
+
+    def stats(self) -> QueryExecutorStats:
+        return QueryExecutorStats(
+            max_workers=self.max_workers,
+            waiting=self._waiting,
+            running=self._running,
+            executed=self._executed,
+            timeouts=self._timeouts,
+            interrupted=self._interrupted,
+            total_wait_seconds=self._total_wait,
+            max_wait_seconds=self._max_wait,
+            mean_wait_seconds=(
+                self._total_wait / self._executed
+                if self._executed
+                else 0.0
+            ),
+        )
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+class DatabaseSession:
+    """
+    The per-request handle on the database given to route handlers.
+
+    All work on the checked-out cursor goes through the query executor,
+    so handlers only ever `await` database results.
+    """
+
+    def __init__(
+        self,
+        cursor: DuckDBPyConnection,
+        executor: QueryExecutor,
+        request: Optional[Request] = None,
+    ) -> None:
+        self.cursor = cursor
+        self.executor = executor
+        self.request = request
+
+    async def run(
+        self,
+        work: Callable[[DuckDBPyConnection], T],
+        timeout: Optional[float | QueryKind] = None,
+    ) -> T:
+        try:
+            return await self.executor.run(
+                self.cursor, work, timeout=timeout, request=self.request
+            )
+        except QueryTimeout as error:
+            raise HTTPException(status_code=504, detail=str(error))
+        except ClientDisconnected as error:
+            raise HTTPException(status_code=499, detail=str(error))
+
+    async def fetchall(
+        self,
+        query: str,
+        params: Optional[Sequence[Any] | Dict[str, Any]] = None,
+        timeout: Optional[float | QueryKind] = None,
+    ) -> List[Tuple[Any, ...]]:
+        return await self.run(
+            lambda cursor: cursor.execute(query, params).fetchall(),
+            timeout=timeout,
+        )
+
+    async def fetchone(
+        self,
+        query: str,
+        params: Optional[Sequence[Any] | Dict[str, Any]] = None,
+        timeout: Optional[float | QueryKind] = None,
+    ) -> Optional[Tuple[Any, ...]]:
+        return await self.run(
+            lambda cursor: cursor.execute(query, params).fetchone(),
+            timeout=timeout,
+        )
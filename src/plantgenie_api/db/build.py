@@ -0,0 +1,756 @@
+"""
+Builds the PlantGenIE database from source files.
+
+The sources are listed in a TOML manifest; relative paths are resolved
+against the directory of the manifest:
+
+    [tables]
+    species = "species.tsv"
+    genomes = "genomes.tsv"
+    gff = "gff.parquet"
+    annotations = "annotations.tsv"
+    gene_aliases = "aliases.tsv"         # optional: alias, gene_id
+
+    [[experiments]]
+    id = 1
+    genome_id = 1
+    title = "Norway spruce atlas"
+    relation_name = "expression_atlas"
+    expression_units = "tpm"
+    samples = "atlas/samples.tsv"        # abbreviation, condition
+    expression = "atlas/values.parquet"  # sample_id, gene_id, expression_value
+
+Tables are written sorted by the key the API looks them up by, so the
+min/max statistics DuckDB keeps per row group prune a lookup of a few
+genes down to the row groups that hold them, and the lookup keys get
+ART indexes. Genes and samples are numbered and the expression and GO
+mapping tables store the integer keys (see `plantgenie_api.genes`).
+"""
+
+import os
+import tomllib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Generator, List, Optional
+
+import duckdb
+from duckdb import DuckDBPyConnection
+from pydantic import BaseModel, Field
+from shared.services.database import quote_identifier
+
+from plantgenie_api.genes import (
+    GENE_ALIAS_TABLE,
+    GENE_TABLE,
+    has_gene_keys,
+    keyed_table_name,
+)
+from plantgenie_api.local_storage import clone_or_copy
+from plantgenie_api.search_index import (
+    SEARCH_DICTIONARY_TABLE,
+    SEARCH_DOCUMENTS_TABLE,
+    SEARCH_TERMS_TABLE,
+    create_search_index,
+)
+
+REQUIRED_TABLES = ["species", "genomes", "gff", "annotations"]
+EXPERIMENT_TABLES = ["experiments", "expression_metadata"]
+
+# the column each table is sorted and indexed by
+TABLE_KEYS: Dict[str, str] = {
+    "gff": "feature_id",
+    "annotations": "gene_id",
+    "go_terms_per_gene": "gene_id",
+    GENE_ALIAS_TABLE: "alias",
+    SEARCH_DOCUMENTS_TABLE: "doc_id",
+    SEARCH_TERMS_TABLE: "term",
+    SEARCH_DICTIONARY_TABLE: "term",
+}
+EXPRESSION_KEY = "gene_id"
+GENE_KEY = "gene_key"
+
+# tables with one row per gene and something else that are stored with
+# integer gene keys
+GENE_KEYED_TABLES = ["go_terms_per_gene"]
+
+# how many offending ids are shown when validation fails
+REPORTED_IDS = 10
+
+
+class ExperimentSource(BaseModel):
+    id: int
+    genome_id: int
+    title: str
+    relation_name: str
+    expression_units: Optional[str] = Field(default=None)
+    samples: Path
+    expression: Path
+
+
+class BuildManifest(BaseModel):
+    tables: Dict[str, Path] = Field(default={})
+    experiments: List[ExperimentSource] = Field(default=[])
+
+
+class TableLayout(BaseModel):
+    table: str
+    key: str
+    rows: int
+    row_groups: int
+    # the most row groups whose min/max range contains a single key,
+    # i.e. how many row groups a lookup of one gene has to read
+    max_row_groups_per_key: int
+    indexes: List[str]
+
+
+def load_manifest(manifest_path: Path) -> BuildManifest:
+    with manifest_path.open("rb") as file:
+        manifest = BuildManifest.model_validate(tomllib.load(file))
+
+    base = manifest_path.parent
+    manifest.tables = {
+        name: base / path for name, path in manifest.tables.items()
+    }
+    for experiment in manifest.experiments:
+        experiment.samples = base / experiment.samples
+        experiment.expression = base / experiment.expression
+
+    return manifest
+
+
+def source_relation(path: Path) -> str:
+    """
+    The table function reading one source file, selected by suffix:
+    parquet, or delimited text with a header (tab separated for .tsv).
+    The file name may be a glob, e.g. `values/*.parquet`, in which case
+    DuckDB reads the matching files in parallel.
+    """
+    quoted_path = "'" + path.as_posix().replace("'", "''") + "'"
+
+    if not (path.is_file() or any(path.parent.glob(path.name))):
+        raise FileNotFoundError(f"Source file {path} not found")
+
+    if path.suffix == ".parquet":
+        return f"read_parquet({quoted_path})"
+    if path.suffix == ".tsv":
+        return f"read_csv({quoted_path}, header = true, delim = '\t')"
+    return f"read_csv({quoted_path}, header = true)"
+
+
+def load_table(
+    connection: DuckDBPyConnection, table_name: str, source: Path
+) -> None:
+    order_by = (
+        f"ORDER BY {quote_identifier(TABLE_KEYS[table_name])}"
+        if table_name in TABLE_KEYS
+        else ""
+    )
+    connection.execute(
+        f"""
+        CREATE TABLE {quote_identifier(table_name)} AS
+        SELECT * FROM {source_relation(source)}
+        {order_by}
+        """
+    )
+
+
+def create_experiment_tables(connection: DuckDBPyConnection) -> None:
+    connection.execute(
+        """
+        CREATE TABLE experiments (
+            id INTEGER,
+            genome_id INTEGER,
+            title VARCHAR,
+            relation_name VARCHAR,
+            expression_units VARCHAR
+        );
+        CREATE TABLE expression_metadata (
+            experiment_id INTEGER,
+            abbreviation VARCHAR,
+            condition VARCHAR,
+            sample_key INTEGER
+        );
+        """
+    )
+
+
+def create_gene_keys(connection: DuckDBPyConnection) -> None:
+    """
+    Numbers the genes of the `gff` densely in gene id order, so sorting
+    by key is the same as sorting by id.
+    """
+    connection.execute(
+        f"""
+        CREATE TABLE {GENE_TABLE} AS
+        SELECT
+            (row_number() OVER (ORDER BY feature_id) - 1)::INTEGER
+                AS gene_key,
+            feature_id AS gene_id,
+            genome_id
+        FROM (
+            SELECT feature_id::VARCHAR AS feature_id, min(genome_id) AS genome_id
+            FROM gff
+            GROUP BY feature_id
+        )
+        ORDER BY gene_key
+        """
+    )
+
+
+def assign_sample_keys(connection: DuckDBPyConnection) -> None:
+    # rowids are unique and follow the insertion order that the API
+    # numbers samples by
+    connection.execute(
+        """
+        ALTER TABLE expression_metadata
+            ADD COLUMN IF NOT EXISTS sample_key INTEGER;
+        UPDATE expression_metadata
+            SET sample_key = rowid::INTEGER
+            WHERE sample_key IS NULL;
+        """
+    )
+
+
+def _row_count(connection: DuckDBPyConnection, table: str) -> int:
+    return connection.execute(
+        f"SELECT count(*) FROM {quote_identifier(table)}"
+    ).fetchone()[0]
+
+
+def encode_gene_table(connection: DuckDBPyConnection, table: str) -> None:
+    """
+    Replaces a table that has a `gene_id` column by one with `gene_key`
+    instead and a view with the original name that translates back.
+    """
+    keyed = keyed_table_name(table)
+    connection.execute(
+        f"""
+        CREATE TABLE {quote_identifier(keyed)} AS
+        SELECT g.gene_key, t.* EXCLUDE (gene_id)
+        FROM {quote_identifier(table)} t
+        JOIN {GENE_TABLE} g ON (g.gene_id = t.gene_id::VARCHAR)
+        ORDER BY g.gene_key
+        """
+    )
+
+    lost = _row_count(connection, table) - _row_count(connection, keyed)
+    if lost:
+        raise ValueError(
+            f"{lost} rows of {table} have gene ids that are not in the gff"
+        )
+
+    connection.execute(
+        f"""
+        DROP TABLE {quote_identifier(table)};
+        CREATE VIEW {quote_identifier(table)} AS
+        SELECT g.gene_id, t.* EXCLUDE (gene_key)
+        FROM {quote_identifier(keyed)} t
+        JOIN {GENE_TABLE} g USING (gene_key);
+        """
+    )
+
+
+def create_expression_table(
+    connection: DuckDBPyConnection,
+    experiment_id: int,
+    relation_name: str,
+    source: str,
+) -> None:
+    """
+    Writes the expression values of one experiment from `source`, any
+    relation with sample_id, gene_id and expression_value columns,
+    sorted by gene. With gene keys, the values are stored by key in
+    `<relation_name>_keys` and `relation_name` is a view.
+    """
+    if not has_gene_keys(connection):
+        connection.execute(
+            f"""
+            CREATE TABLE {quote_identifier(relation_name)} AS
+            SELECT
+                sample_id::VARCHAR AS sample_id,
+                gene_id::VARCHAR AS gene_id,
+                expression_value::DOUBLE AS expression_value
+            FROM {source}
+            ORDER BY gene_id, sample_id
+            """
+        )
+        return
+
+    keyed = keyed_table_name(relation_name)
+    connection.execute(
+        f"""
+        CREATE TABLE {quote_identifier(keyed)} AS
+        SELECT
+            m.sample_key,
+            g.gene_key,
+            e.expression_value::DOUBLE AS expression_value
+        FROM {source} e
+        JOIN {GENE_TABLE} g ON (g.gene_id = e.gene_id::VARCHAR)
+        JOIN (
+            SELECT sample_key, abbreviation
+            FROM expression_metadata
+            WHERE experiment_id = $experiment_id
+        ) m ON (m.abbreviation = e.sample_id::VARCHAR)
+        ORDER BY g.gene_key, m.sample_key
+        """,
+        {"experiment_id": experiment_id},
+    )
+    connection.execute(
+        f"""
+        CREATE VIEW {quote_identifier(relation_name)} AS
+        SELECT
+            m.abbreviation AS sample_id,
+            g.gene_id,
+            e.expression_value
+        FROM {quote_identifier(keyed)} e
+        JOIN {GENE_TABLE} g USING (gene_key)
+        JOIN expression_metadata m USING (sample_key)
+        """
+    )
+
+
+def relation_exists(connection: DuckDBPyConnection, name: str) -> bool:
+    return bool(
+        connection.execute(
+            """
+            SELECT count(*) FROM (
+                SELECT table_name AS name FROM duckdb_tables()
+                UNION ALL
+                SELECT view_name AS name FROM duckdb_views()
+            )
+            WHERE name = ?
+            """,
+            [name],
+        ).fetchone()[0]
+    )
+
+
+def validate_experiment(
+    connection: DuckDBPyConnection, experiment: ExperimentSource
+) -> None:
+    """
+    Checks an experiment against the database before anything is
+    loaded: its id and relation are new, its genome exists, every gene
+    is a `gff` feature of that genome and every sample is listed in its
+    samples file.
+    """
+    existing = connection.execute(
+        """
+        SELECT id, relation_name FROM experiments
+        WHERE id = ? OR relation_name = ?
+        """,
+        [experiment.id, experiment.relation_name],
+    ).fetchone()
+    if existing is not None:
+        raise ValueError(
+            f"Experiment {experiment.id} ({experiment.relation_name})"
+            f" conflicts with existing experiment {existing[0]}"
+            f" ({existing[1]})"
+        )
+
+    for name in [
+        experiment.relation_name,
+        keyed_table_name(experiment.relation_name),
+    ]:
+        if relation_exists(connection, name):
+            raise ValueError(f"Table {name} already exists")
+
+    genome_exists = connection.execute(
+        "SELECT count(*) FROM genomes WHERE id = ?",
+        [experiment.genome_id],
+    ).fetchone()[0]
+    if not genome_exists:
+        raise ValueError(f"Genome {experiment.genome_id} not found")
+
+    expression = source_relation(experiment.expression)
+
+    unknown_genes = connection.execute(
+        f"""
+        SELECT DISTINCT e.gene_id::VARCHAR AS gene_id
+        FROM {expression} e
+        ANTI JOIN (
+            SELECT feature_id FROM gff WHERE genome_id = $genome_id
+        ) g ON (g.feature_id = e.gene_id::VARCHAR)
+        ORDER BY gene_id
+        """,
+        {"genome_id": experiment.genome_id},
+    ).fetchall()
+    if unknown_genes:
+        raise ValueError(
+            f"{len(unknown_genes)} gene ids of experiment {experiment.id}"
+            f" are not in the gff of genome {experiment.genome_id}, e.g."
+            f" {[row[0] for row in unknown_genes[:REPORTED_IDS]]}"
+        )
+
+    unknown_samples = connection.execute(
+        f"""
+        SELECT DISTINCT e.sample_id::VARCHAR AS sample_id
+        FROM {expression} e
+        ANTI JOIN {source_relation(experiment.samples)} s
+            ON (s.abbreviation::VARCHAR = e.sample_id::VARCHAR)
+        ORDER BY sample_id
+        """
+    ).fetchall()
+    if unknown_samples:
+        raise ValueError(
+            f"{len(unknown_samples)} samples of experiment {experiment.id}"
+            f" are not in {experiment.samples.name}, e.g."
+            f" {[row[0] for row in unknown_samples[:REPORTED_IDS]]}"
+        )
+
+
+def sample_columns(connection: DuckDBPyConnection, samples: str) -> str:
+    """
+    The columns of the samples relation that `expression_metadata` has,
+    as a select list continuing after the experiment id; any other
+    column of the samples file is not loaded.
+    """
+    stored = set(connection.table("expression_metadata").columns) - {
+        "experiment_id",
+        "sample_key",
+    }
+    return "".join(
+        f", {quote_identifier(column)}"
+        for column in connection.sql(f"SELECT * FROM {samples}").columns
+        if column in stored
+    )
+
+
+def load_experiment(
+    connection: DuckDBPyConnection, experiment: ExperimentSource
+) -> None:
+    """
+    Adds one experiment: its `experiments` row, its samples in the order
+    of the samples file and its expression table sorted by gene. The
+    experiment is expected to have passed `validate_experiment`.
+    """
+    connection.execute(
+        "INSERT INTO experiments VALUES (?, ?, ?, ?, ?)",
+        [
+            experiment.id,
+            experiment.genome_id,
+            experiment.title,
+            experiment.relation_name,
+            experiment.expression_units,
+        ],
+    )
+    # the API numbers samples in insertion order, so the file order is
+    # kept
+    samples = source_relation(experiment.samples)
+    connection.execute(
+        f"""
+        INSERT INTO expression_metadata BY NAME
+        SELECT $experiment_id AS experiment_id{sample_columns(connection, samples)}
+        FROM {samples}
+        """,
+        {"experiment_id": experiment.id},
+    )
+    if has_gene_keys(connection):
+        assign_sample_keys(connection)
+
+    create_expression_table(
+        connection,
+        experiment.id,
+        experiment.relation_name,
+        source_relation(experiment.expression),
+    )
+
+
+def drop_indexes(connection: DuckDBPyConnection, table: str) -> None:
+    for (index_name,) in connection.execute(
+        "SELECT index_name FROM duckdb_indexes() WHERE table_name = ?",
+        [table],
+    ).fetchall():
+        connection.execute(f"DROP INDEX {quote_identifier(index_name)}")
+
+
+def encode_database(connection: DuckDBPyConnection) -> None:
+    """
+    Converts a database without gene keys in place: numbers the genes
+    and samples and rewrites the expression and GO mapping tables to
+    integer keys, leaving views under the original names. Fails if a
+    row would be lost because its gene or sample is unknown.
+    """
+    if has_gene_keys(connection):
+        raise ValueError("Database already has gene keys")
+
+    create_gene_keys(connection)
+    assign_sample_keys(connection)
+
+    tables = {
+        row[0]
+        for row in connection.execute(
+            "SELECT table_name FROM duckdb_tables()"
+        ).fetchall()
+    }
+    for table in GENE_KEYED_TABLES:
+        if table in tables:
+            encode_gene_table(connection, table)
+
+    for experiment_id, relation_name in connection.execute(
+        "SELECT id, relation_name FROM experiments ORDER BY id"
+    ).fetchall():
+        original = f"{relation_name}_varchar"
+        # a table with indexes, e.g. from `optimize_database`, cannot be
+        # renamed; the keyed table is indexed afresh
+        drop_indexes(connection, relation_name)
+        connection.execute(
+            f"""
+            ALTER TABLE {quote_identifier(relation_name)}
+                RENAME TO {quote_identifier(original)}
+            """
+        )
+        create_expression_table(
+            connection,
+            experiment_id,
+            relation_name,
+            quote_identifier(original),
+        )
+
+        lost = _row_count(connection, original) - _row_count(
+            connection, keyed_table_name(relation_name)
+        )
+        if lost:
+            raise ValueError(
+                f"{lost} rows of {relation_name} have a gene or sample"
+                " that is not in the gff or expression_metadata"
+            )
+        connection.execute(f"DROP TABLE {quote_identifier(original)}")
+
+
+def table_keys(connection: DuckDBPyConnection) -> Dict[str, str]:
+    """
+    The lookup key of every table that is sorted and indexed by the
+    build: the known tables that exist and every expression table.
+    """
+    existing = {
+        row[0]
+        for row in connection.execute(
+            "SELECT table_name FROM duckdb_tables()"
+        ).fetchall()
+    }
+    keys: Dict[str, str] = {}
+
+    def add(table: str, key: str) -> None:
+        # a table stored with gene keys is looked up by key
+        if keyed_table_name(table) in existing:
+            keys[keyed_table_name(table)] = GENE_KEY
+        elif table in existing:
+            keys[table] = key
+
+    for table, key in TABLE_KEYS.items():
+        add(table, key)
+    if GENE_TABLE in existing:
+        keys[GENE_TABLE] = "gene_id"
+    if "expression_metadata" in existing:
+        keys["expression_metadata"] = "experiment_id"
+    if "experiments" in existing:
+        for (relation_name,) in connection.execute(
+            "SELECT relation_name FROM experiments ORDER BY id"
+        ).fetchall():
+            add(relation_name, EXPRESSION_KEY)
+
+    return keys
+
+
+def create_indexes(
+    connection: DuckDBPyConnection, keys: Dict[str, str]
+) -> None:
+    for table, key in keys.items():
+        connection.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS {quote_identifier(f"{table}_{key}_idx")}
+            ON {quote_identifier(table)} ({quote_identifier(key)})
+            """
+        )
+
+
+def table_layout(
+    connection: DuckDBPyConnection, table: str, key: str
+) -> TableLayout:
+    quoted_table = quote_identifier(table)
+    quoted_key = quote_identifier(key)
+
+    # the row groups as stored, with the first and last row of each; a
+    # table written once numbers its rows in storage order
+    rows, row_groups, max_row_groups_per_key = connection.execute(
+        f"""
+        WITH
+            stored_row_groups AS (
+                SELECT row_group_id, sum(count) AS row_count
+                FROM pragma_storage_info($table)
+                WHERE column_name = $key AND segment_type <> 'VALIDITY'
+                GROUP BY row_group_id
+            ),
+            row_group_bounds AS (
+                SELECT
+                    row_group_id,
+                    sum(row_count) OVER (ORDER BY row_group_id)
+                        - row_count AS first_row,
+                    sum(row_count) OVER (ORDER BY row_group_id) AS end_row
+                FROM stored_row_groups
+            ),
+            row_groups AS (
+                SELECT
+                    b.row_group_id AS row_group,
+                    min(t.{quoted_key}) AS low,
+                    max(t.{quoted_key}) AS high
+                FROM {quoted_table} t
+                JOIN row_group_bounds b
+                    ON t.rowid >= b.first_row AND t.rowid < b.end_row
+                GROUP BY b.row_group_id
+            ),
+            row_groups_per_key AS (
+                SELECT k.key, count(*) AS row_groups
+                FROM (
+                    SELECT DISTINCT {quoted_key} AS key FROM {quoted_table}
+                ) k
+                JOIN row_groups r ON k.key BETWEEN r.low AND r.high
+                GROUP BY k.key
+            )
+        SELECT
+            (SELECT count(*) FROM {quoted_table}),
+            (SELECT count(*) FROM stored_row_groups),
+            (SELECT coalesce(max(row_groups), 0) FROM row_groups_per_key)
+        """,
+        {"table": table, "key": key},
+    ).fetchone()
+
+    indexes = [
+        row[0]
+        for row in connection.execute(
+            """
+            SELECT index_name FROM duckdb_indexes()
+            WHERE table_name = ?
+            ORDER BY index_name
+            """,
+            [table],
+        ).fetchall()
+    ]
+
+    return TableLayout(
+        table=table,
+        key=key,
+        rows=rows,
+        row_groups=row_groups,
+        max_row_groups_per_key=max_row_groups_per_key,
+        indexes=indexes,
+    )
+
+
+def layout_report(connection: DuckDBPyConnection) -> List[TableLayout]:
+    return [
+        table_layout(connection, table, key)
+        for table, key in table_keys(connection).items()
+    ]
+
+
+def optimize_database(connection: DuckDBPyConnection) -> None:
+    create_indexes(connection, table_keys(connection))
+    connection.execute("ANALYZE")
+    connection.execute("CHECKPOINT")
+
+
+def connect_for_build(
+    database_path: Path,
+    threads: Optional[int] = None,
+    memory_limit: Optional[str] = None,
+) -> DuckDBPyConnection:
+    config: Dict[str, str | int] = {}
+    if threads:
+        config["threads"] = threads
+    if memory_limit:
+        config["memory_limit"] = memory_limit
+
+    return duckdb.connect(database_path.as_posix(), config=config)
+
+
+@contextmanager
+def staged_database(output: Path) -> Generator[Path, None, None]:
+    """
+    Yields a path next to `output` to write a database to, which is
+    moved to `output` if the block succeeds and removed otherwise, so
+    `output` is never left half written.
+    """
+    output.parent.mkdir(parents=True, exist_ok=True)
+    staging = output.with_name(f".{output.name}.tmp")
+    staging.unlink(missing_ok=True)
+
+    try:
+        yield staging
+    except BaseException:
+        staging.unlink(missing_ok=True)
+        staging.with_name(staging.name + ".wal").unlink(missing_ok=True)
+        raise
+
+    os.replace(staging, output)
+
+
+def build_database(
+    manifest: BuildManifest,
+    output: Path,
+    threads: Optional[int] = None,
+    memory_limit: Optional[str] = None,
+) -> List[TableLayout]:
+    """
+    Builds a complete database, with gene keys, at `output`.
+    """
+    missing = [
+        table for table in REQUIRED_TABLES if table not in manifest.tables
+    ]
+    if missing:
+        raise ValueError(f"Manifest has no source for tables {missing}")
+
+    reserved = [
+        table for table in EXPERIMENT_TABLES if table in manifest.tables
+    ]
+    if reserved:
+        raise ValueError(
+            f"Tables {reserved} are built from the [[experiments]] entries"
+        )
+
+    with (
+        staged_database(output) as staging,
+        connect_for_build(staging, threads, memory_limit) as connection,
+    ):
+        for table_name, source in manifest.tables.items():
+            load_table(connection, table_name, source)
+
+        create_gene_keys(connection)
+        for table in GENE_KEYED_TABLES:
+            if table in manifest.tables:
+                encode_gene_table(connection, table)
+
+        create_experiment_tables(connection)
+        for experiment in manifest.experiments:
+            validate_experiment(connection, experiment)
+            load_experiment(connection, experiment)
+
+        create_search_index(connection)
+        optimize_database(connection)
+        report = layout_report(connection)
+
+    return report
+
+
+def encode_existing_database(
+    source: Path,
+    output: Path,
+    threads: Optional[int] = None,
+    memory_limit: Optional[str] = None,
+) -> List[TableLayout]:
+    """
+    Writes a copy of the database at `source` converted to gene keys,
+    and with the annotation search index, to `output`.
+    """
+    with staged_database(output) as staging:
+        clone_or_copy(source, staging)
+
+        with connect_for_build(
+            staging, threads, memory_limit
+        ) as connection:
+            encode_database(connection)
+            create_search_index(connection)
+            optimize_database(connection)
+            report = layout_report(connection)
+
+    return report
@@ -0,0 +1,391 @@
+import shutil
+import time
+from pathlib import Path
+from typing import Annotated, List, Optional
+
+import duckdb
+import typer
+from shared.coexpression import (
+    DEFAULT_BLOCK_BYTES,
+    build_coexpression_network,
+)
+from shared.constants import DATABASE_FILENAME
+from shared.expression_matrix import (
+    EXPRESSION_MATRIX_DIRECTORY_NAME,
+    ExpressionMatrixStore,
+    export_expression_matrix,
+)
+from shared.releases import (
+    current_release,
+    list_releases,
+    publish_release,
+)
+
+from plantgenie_api.db.build import (
+    TableLayout,
+    build_database,
+    encode_existing_database,
+    load_manifest,
+)
+from plantgenie_api.db.ingest import (
+    ingest_experiments,
+    link_expression_matrices,
+)
+
+app = typer.Typer(
+    help="Tools for building and maintaining the PlantGenIE database",
+    no_args_is_help=True,
+)
+
+
+def echo_layout_report(report: List[TableLayout]) -> None:
+    typer.echo(
+        f"{'table':<32} {'key':<14} {'rows':>12} {'row groups':>10}"
+        f" {'per key':>8}  indexes"
+    )
+    for layout in report:
+        typer.echo(
+            f"{layout.table:<32} {layout.key:<14} {layout.rows:>12}"
+            f" {layout.row_groups:>10} {layout.max_row_groups_per_key:>8}"
+            f"  {', '.join(layout.indexes) or '-'}"
+        )
+
+
+@app.command("build")
+def build(
+    manifest: Annotated[
+        Path,
+        typer.Argument(help="TOML manifest listing the source files"),
+    ],
+    output: Annotated[
+        Path,
+        typer.Argument(help="Path of the database file to build"),
+    ],
+    threads: Annotated[
+        Optional[int], typer.Option(help="DuckDB threads to build with")
+    ] = None,
+    memory_limit: Annotated[
+        Optional[str],
+        typer.Option(help="DuckDB memory limit, e.g. 16GB"),
+    ] = None,
+):
+    """
+    Build the database from source files: tables sorted by their lookup
+    key, ART indexes on the keys and fresh statistics. Prints how many
+    row groups a lookup of a single key has to read in each table.
+    """
+    start = time.perf_counter()
+
+    try:
+        report = build_database(
+            load_manifest(manifest), output, threads, memory_limit
+        )
+    except (FileNotFoundError, ValueError, duckdb.Error) as error:
+        typer.echo(f"Not built: {error}", err=True)
+        raise typer.Exit(code=1)
+
+    echo_layout_report(report)
+    typer.echo(f"built {output} ({time.perf_counter() - start:.1f}s)")
+
+
+@app.command("encode")
+def encode(
+    database: Annotated[
+        Path,
+        typer.Argument(help="Database without gene keys to convert"),
+    ],
+    output: Annotated[
+        Path,
+        typer.Argument(help="Path of the converted database file"),
+    ],
+    threads: Annotated[
+        Optional[int], typer.Option(help="DuckDB threads to use")
+    ] = None,
+    memory_limit: Annotated[
+        Optional[str],
+        typer.Option(help="DuckDB memory limit, e.g. 16GB"),
+    ] = None,
+):
+    """
+    Convert a database built before gene keys: number the genes and
+    samples and store the expression and GO mapping tables by integer
+    key, with views under the old names, and index the annotations for
+    search. `build` does this already.
+    """
+    start = time.perf_counter()
+
+    try:
+        report = encode_existing_database(
+            database, output, threads, memory_limit
+        )
+    except (FileNotFoundError, ValueError, duckdb.Error) as error:
+        typer.echo(f"Not encoded: {error}", err=True)
+        raise typer.Exit(code=1)
+
+    echo_layout_report(report)
+    typer.echo(f"encoded {output} ({time.perf_counter() - start:.1f}s)")
+
+
+@app.command("ingest")
+def ingest(
+    manifest: Annotated[
+        Path,
+        typer.Argument(
+            help="TOML manifest with the [[experiments]] to add"
+        ),
+    ],
+    releases_path: Annotated[
+        Path,
+        typer.Argument(help="Directory holding the release directories"),
+    ],
+    release: Annotated[
+        str,
+        typer.Argument(help="Name of the release directory to create"),
+    ],
+    base: Annotated[
+        Optional[str],
+        typer.Option(
+            help="Release to add to, defaults to the current one"
+        ),
+    ] = None,
+    database_name: Annotated[
+        str, typer.Option(help="Database file name inside the release")
+    ] = DATABASE_FILENAME,
+    export_matrices: Annotated[
+        bool,
+        typer.Option(
+            help="Carry over the base release's expression matrices and export the new experiments"
+        ),
+    ] = True,
+    publish: Annotated[
+        bool, typer.Option(help="Publish the new release when done")
+    ] = False,
+    threads: Annotated[
+        Optional[int], typer.Option(help="DuckDB threads to load with")
+    ] = None,
+    memory_limit: Annotated[
+        Optional[str],
+        typer.Option(help="DuckDB memory limit, e.g. 16GB"),
+    ] = None,
+):
+    """
+    Create a new release from an existing one with experiments added,
+    without rebuilding the database. Gene ids are validated against the
+    gff of the experiment's genome before anything is written.
+    """
+    start = time.perf_counter()
+    base_release = base or current_release(releases_path)
+
+    if base_release is None:
+        typer.echo(
+            f"Not ingested: {releases_path} has no current release",
+            err=True,
+        )
+        raise typer.Exit(code=1)
+
+    experiments = load_manifest(manifest).experiments
+    output = releases_path / release / database_name
+
+    try:
+        report = ingest_experiments(
+            releases_path / base_release / database_name,
+            output,
+            experiments,
+            threads,
+            memory_limit,
+        )
+    except (FileNotFoundError, ValueError, duckdb.Error) as error:
+        typer.echo(f"Not ingested: {error}", err=True)
+        raise typer.Exit(code=1)
+
+    echo_layout_report(report)
+
+    if export_matrices:
+        matrix_path = output.parent / EXPRESSION_MATRIX_DIRECTORY_NAME
+        try:
+            link_expression_matrices(
+                releases_path
+                / base_release
+                / EXPRESSION_MATRIX_DIRECTORY_NAME,
+                matrix_path,
+            )
+            with duckdb.connect(
+                output.as_posix(), read_only=True
+            ) as connection:
+                for experiment in experiments:
+                    export_expression_matrix(
+                        connection, experiment.id, matrix_path
+                    )
+        except (OSError, ValueError, duckdb.Error) as error:
+            # a release without its matrices must not be published
+            shutil.rmtree(matrix_path, ignore_errors=True)
+            typer.echo(f"Not ingested: {error}", err=True)
+            raise typer.Exit(code=1)
+
+    typer.echo(
+        f"{base_release} + {len(experiments)} experiments -> {release}"
+        f" ({time.perf_counter() - start:.1f}s)"
+    )
+
+    if publish:
+        publish_release(releases_path, release, database_name)
+        typer.echo(f"current: {base_release} -> {release}")
+
+
+@app.command("export-matrices")
+def export_matrices(
+    database: Annotated[
+        Path,
+        typer.Argument(help="Path to the DuckDB database file"),
+    ],
+    output: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="Directory to write the matrices to, defaults to expression-matrices next to the database"
+        ),
+    ] = None,
+    experiment_id: Annotated[
+        Optional[List[int]],
+        typer.Option(
+            help="Experiment to export, can be repeated, defaults to all experiments"
+        ),
+    ] = None,
+):
+    """
+    Export each experiment into a dense float32 gene x sample matrix that
+    the API memory-maps at startup.
+    """
+    output_path = output or (
+        database.parent / EXPRESSION_MATRIX_DIRECTORY_NAME
+    )
+
+    with duckdb.connect(database.as_posix(), read_only=True) as connection:
+        experiment_ids = experiment_id or [
+            row[0]
+            for row in connection.execute(
+                "SELECT id FROM experiments ORDER BY id"
+            ).fetchall()
+        ]
+
+        for current_id in experiment_ids:
+            start = time.perf_counter()
+            directory = export_expression_matrix(
+                connection, current_id, output_path
+            )
+            typer.echo(
+                f"experiment {current_id} -> {directory}"
+                f" ({time.perf_counter() - start:.1f}s)"
+            )
+
+
+@app.command("coexpression-network")
+def coexpression_network(
+    matrix_path: Annotated[
+        Path,
+        typer.Argument(
+            help="Directory holding the exported expression matrices"
+        ),
+    ],
+    experiment_id: Annotated[
+        Optional[List[int]],
+        typer.Option(
+            help="Experiment to compute, can be repeated, defaults to all exported experiments"
+        ),
+    ] = None,
+    method: Annotated[
+        str, typer.Option(help="pearson or spearman")
+    ] = "pearson",
+    k: Annotated[
+        int, typer.Option(help="Partners to keep per gene", min=1)
+    ] = 100,
+    processes: Annotated[
+        int, typer.Option(help="Worker processes", min=1)
+    ] = 1,
+    block_memory_mb: Annotated[
+        int,
+        typer.Option(
+            help="Memory for the correlations of one block, per process",
+            min=1,
+        ),
+    ] = DEFAULT_BLOCK_BYTES // 2**20,
+):
+    """
+    Store the top-k co-expressed partners of every gene next to each
+    exported matrix, which the API then looks up instead of computing
+    correlations per request.
+    """
+    if method not in ("pearson", "spearman"):
+        raise typer.BadParameter(
+            "must be pearson or spearman", param_hint="--method"
+        )
+
+    store = ExpressionMatrixStore(matrix_path)
+    for current_id in experiment_id or sorted(store.matrices):
+        matrix = store.get(current_id)
+        if matrix is None:
+            raise typer.BadParameter(
+                f"experiment {current_id} is not exported to {matrix_path}",
+                param_hint="--experiment-id",
+            )
+
+        start = time.perf_counter()
+        directory = build_coexpression_network(
+            matrix.directory,
+            method=method,
+            k=k,
+            processes=processes,
+            block_bytes=block_memory_mb * 2**20,
+        )
+        typer.echo(
+            f"experiment {current_id} -> {directory}"
+            f" ({time.perf_counter() - start:.1f}s)"
+        )
+
+
+@app.command("releases")
+def show_releases(
+    releases_path: Annotated[
+        Path,
+        typer.Argument(help="Directory holding the release directories"),
+    ],
+):
+    """
+    List the database releases, marking the current one.
+    """
+    current = current_release(releases_path)
+
+    for release in list_releases(releases_path):
+        typer.echo(f"{'*' if release == current else ' '} {release}")
+
+
+@app.command("publish")
+def publish(
+    releases_path: Annotated[
+        Path,
+        typer.Argument(help="Directory holding the release directories"),
+    ],
+    release: Annotated[
+        str,
+        typer.Argument(help="Name of the release directory to publish"),
+    ],
+    database_name: Annotated[
+        str, typer.Option(help="Database file name inside the release")
+    ] = DATABASE_FILENAME,
+):
+    """
+    Atomically point `current` at a complete release. Running APIs
+    switch to it without a restart and new worker tasks open it.
+    """
+    previous = current_release(releases_path)
+
+    try:
+        publish_release(releases_path, release, database_name)
+    except (FileNotFoundError, ValueError) as error:
+        typer.echo(f"Not published: {error}", err=True)
+        raise typer.Exit(code=1)
+
+    typer.echo(f"current: {previous} -> {release}")
+
+
+if __name__ == "__main__":
+    app()
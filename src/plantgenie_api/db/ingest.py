@@ -0,0 +1,119 @@
+"""
+Adds experiments to a published database without rebuilding it.
+
+The database of the base release is cloned (a reflink where the file
+system supports it), the new experiments are loaded into the clone the
+same way `build` loads them, and the result is written as a new release
+that can then be published. The base release is never modified.
+"""
+
+import os
+import shutil
+from pathlib import Path
+from typing import List, Optional
+
+from shared.services.database import quote_identifier
+
+from plantgenie_api.db.build import (
+    ExperimentSource,
+    TableLayout,
+    connect_for_build,
+    create_indexes,
+    load_experiment,
+    staged_database,
+    table_keys,
+    table_layout,
+    validate_experiment,
+)
+from plantgenie_api.genes import keyed_table_name
+from plantgenie_api.local_storage import clone_or_copy
+
+
+def ingest_experiments(
+    source: Path,
+    output: Path,
+    experiments: List[ExperimentSource],
+    threads: Optional[int] = None,
+    memory_limit: Optional[str] = None,
+) -> List[TableLayout]:
+    """
+    Writes a copy of the database at `source` with `experiments` added
+    to `output`. As with `build_database`, the copy is staged next to
+    `output` and only moved into place once it is complete.
+    """
+    if not experiments:
+        raise ValueError("Manifest has no experiments to ingest")
+
+    if output.exists():
+        raise ValueError(f"{output} already exists")
+
+    try:
+        with staged_database(output) as staging:
+            clone_or_copy(source, staging)
+
+            with connect_for_build(
+                staging, threads, memory_limit
+            ) as connection:
+                for experiment in experiments:
+                    validate_experiment(connection, experiment)
+                    load_experiment(connection, experiment)
+
+                new_tables = {"expression_metadata"} | {
+                    name
+                    for experiment in experiments
+                    for name in [
+                        experiment.relation_name,
+                        keyed_table_name(experiment.relation_name),
+                    ]
+                }
+                keys = {
+                    table: key
+                    for table, key in table_keys(connection).items()
+                    if table in new_tables
+                }
+                create_indexes(connection, keys)
+                for table in keys:
+                    connection.execute(
+                        f"ANALYZE {quote_identifier(table)}"
+                    )
+                connection.execute("CHECKPOINT")
+
+                report = [
+                    table_layout(connection, table, key)
+                    for table, key in keys.items()
+                    if table != "expression_metadata"
+                ]
+    except BaseException:
+        # leaves no empty release directory behind
+        try:
+            output.parent.rmdir()
+        except OSError:
+            pass
+        raise
+
+    return report
+
+
+def _link_or_copy(source: str, destination: str) -> None:
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def link_expression_matrices(source_path: Path, output_path: Path) -> None:
+    """
+    Makes the matrices of the base release available to the new one.
+    The matrix files are never written once exported, so they are hard
+    linked rather than copied where possible.
+    """
+    if not source_path.is_dir():
+        return
+
+    shutil.copytree(
+        source_path,
+        output_path,
+        copy_function=_link_or_copy,
+        ignore=shutil.ignore_patterns(".*"),
+        dirs_exist_ok=True,
+    )
@@ -1,11 +1,103 @@
+import asyncio
+import functools
 import os
 from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Annotated, Dict, Generator, List
+from typing import (
+    Annotated,
+    AsyncGenerator,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
 
-import duckdb
-from duckdb import DuckDBPyConnection
-from fastapi import Depends, FastAPI, Request
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from loguru import logger
+from shared.expression_matrix import (
+    ExpressionMatrixStore,
+    release_matrix_path,
+)
+from shared.releases import releases_path_for, resolve_database_path
+
+from plantgenie_api.cache import (
+    MetadataCache,
+    ResponseValidators,
+    ResultCache,
+    database_version,
+    gene_list_digest,
+)
+from plantgenie_api.database import (
+    EXPRESSION_QUERY,
+    METADATA_QUERY,
+    DatabasePool,
+    DatabasePoolTimeout,
+    DatabaseSession,
+    QueryExecutor,
+)
+from plantgenie_api.gene_lists import (
+    GENE_LIST_STORE_FILENAME,
+    GeneListStore,
+    StoredGeneList,
+)
+from plantgenie_api.genes import (
+    GeneIdIndex,
+    GeneIdResolver,
+    GeneKeyMap,
+    GeneResolution,
+)
+from plantgenie_api.local_storage import copy_to_local_storage
+from plantgenie_api.releases import DatabaseRelease, DatabaseReleaseManager
+from plantgenie_api.warmup import WARMUP_STEPS, Warmup
+
+OPTIONAL_ENVIRONMENTAL_VARIABLES: Dict[str, str] = {
+    "DATABASE_POOL_SIZE": "8",
+    "DATABASE_THREADS": "",
+    "DATABASE_MEMORY_LIMIT": "",
+    "DATABASE_CHECKOUT_TIMEOUT": "30",
+    "DATABASE_SLOW_CHECKOUT_SECONDS": "0.05",
+    "DATABASE_QUERY_WORKERS": "8",
+    "DATABASE_QUERY_TIMEOUT": "30",
+    "DATABASE_METADATA_QUERY_TIMEOUT": "10",
+    "DATABASE_EXPRESSION_QUERY_TIMEOUT": "60",
+    "EXPRESSION_MATRIX_PATH": "",
+    "DATABASE_RELEASES_PATH": "",
+    "DATABASE_RELEASE_POLL_SECONDS": "10",
+    "DATABASE_DRAIN_TIMEOUT": "60",
+    "DATABASE_LOCAL_COPY_PATH": "",
+    "HTTP_CACHE_MAX_AGE": "300",
+    "EXPRESSION_CACHE_ENTRIES": "256",
+    "EXPRESSION_CACHE_MAX_BYTES": str(256 * 2**20),
+    "EXPRESSION_CACHE_TTL": "3600",
+    "WARMUP_STEPS": ",".join(WARMUP_STEPS),
+    "WARMUP_EXPERIMENTS": "",
+    "WARMUP_LARGEST_EXPERIMENTS": "3",
+    "GENE_LIST_STORE_PATH": "",
+    "COEXPRESSION_CACHE_ENTRIES": "8",
+    "COEXPRESSION_CACHE_MAX_BYTES": str(2**30),
+    "COEXPRESSION_CACHE_TTL": "86400",
+}
+
+
+def gene_list_store_path(environment: Dict[str, str]) -> str:
+    """
+    GENE_LIST_STORE_PATH, or the store in DATABASE_LOCAL_COPY_PATH; the
+    store is not put in DATA_PATH, a network mount, see
+    `plantgenie_api.gene_lists`.
+    """
+    if environment["GENE_LIST_STORE_PATH"]:
+        return environment["GENE_LIST_STORE_PATH"]
+    if environment["DATABASE_LOCAL_COPY_PATH"]:
+        return (
+            Path(environment["DATABASE_LOCAL_COPY_PATH"])
+            / GENE_LIST_STORE_FILENAME
+        ).as_posix()
+    raise RuntimeError(
+        "GENE_LIST_STORE_PATH or DATABASE_LOCAL_COPY_PATH must be set to"
+        " a local directory for the gene list store"
+    )
 
 
 @asynccontextmanager
@@ -38,28 +130,190 @@ async def lifespan(app: FastAPI):
         var: os.environ[var] for var in required_environmental_variables
     }
 
-    db_path = (
-        Path(APP_ENVIRONMENT["DATA_PATH"])
-        / APP_ENVIRONMENT["DATABASE_NAME"]
+    APP_ENVIRONMENT.update(
+        {
+            var: os.environ.get(var, default)
+            for var, default in OPTIONAL_ENVIRONMENTAL_VARIABLES.items()
+        }
+    )
+
+    # fails before anything is opened
+    gene_list_path = gene_list_store_path(APP_ENVIRONMENT)
+
+    releases_path = releases_path_for(
+        APP_ENVIRONMENT["DATA_PATH"],
+        APP_ENVIRONMENT["DATABASE_RELEASES_PATH"] or None,
     )
 
-    APP_ENVIRONMENT["DATABASE_PATH"] = db_path.resolve(
-        strict=True
-    ).as_posix()
+    def locate_database() -> Path:
+        return resolve_database_path(
+            APP_ENVIRONMENT["DATA_PATH"],
+            APP_ENVIRONMENT["DATABASE_NAME"],
+            releases_path,
+        )
+
+    def open_release(database_path: Path) -> DatabaseRelease:
+        release_path = database_path.parent
+        is_release = release_path.parent == releases_path.resolve()
+        name = release_path.name if is_release else "unversioned"
+
+        # DATA_PATH is a network mount; random reads of a local copy are
+        # much cheaper, so use one when configured and there is room
+        local_copy = (
+            copy_to_local_storage(
+                database_path,
+                Path(APP_ENVIRONMENT["DATABASE_LOCAL_COPY_PATH"]),
+                name,
+            )
+            if APP_ENVIRONMENT["DATABASE_LOCAL_COPY_PATH"]
+            else None
+        )
+
+        database_pool = DatabasePool(
+            local_copy or database_path,
+            pool_size=int(APP_ENVIRONMENT["DATABASE_POOL_SIZE"]),
+            threads=int(APP_ENVIRONMENT["DATABASE_THREADS"] or 0) or None,
+            memory_limit=APP_ENVIRONMENT["DATABASE_MEMORY_LIMIT"] or None,
+            checkout_timeout=float(
+                APP_ENVIRONMENT["DATABASE_CHECKOUT_TIMEOUT"]
+            ),
+            slow_checkout_seconds=float(
+                APP_ENVIRONMENT["DATABASE_SLOW_CHECKOUT_SECONDS"]
+            ),
+            allowed_directories=list(
+                dict.fromkeys(
+                    [APP_ENVIRONMENT["DATA_PATH"], release_path.as_posix()]
+                )
+            ),
+            version=database_version(database_path),
+        )
 
-    # connection = duckdb.connect(APP_ENVIRONMENT["DATABASE_PATH"])
+        expression_matrix_store = ExpressionMatrixStore(
+            release_matrix_path(
+                release_path,
+                releases_path,
+                APP_ENVIRONMENT["EXPRESSION_MATRIX_PATH"] or None,
+            )
+        )
+        with database_pool.checkout() as cursor:
+            gene_keys = GeneKeyMap.load(cursor)
+            gene_ids = GeneIdIndex.load(cursor)
+            gene_resolver = GeneIdResolver.load(cursor)
 
-    with duckdb.connect(APP_ENVIRONMENT["DATABASE_PATH"]) as connection:
-        connection.execute(
-            f"SET allowed_directories = ['{APP_ENVIRONMENT["DATA_PATH"]}'];"
+        logger.info(
+            f"Opened {local_copy or database_path}"
+            f" ({len(gene_ids)} gene ids, {len(gene_keys or ())} gene keys),"
+            " memory-mapped"
+            f" {len(expression_matrix_store)} expression matrices"
+            f" from {expression_matrix_store.matrix_path}"
         )
 
-        connection.execute("SET enable_external_access = false;")
-        connection.execute("SET lock_configuration = true")
+        return DatabaseRelease(
+            name=name,
+            database_path=database_path,
+            pool=database_pool,
+            expression_matrix_store=expression_matrix_store,
+            local_copy=local_copy,
+            gene_keys=gene_keys,
+            gene_ids=gene_ids,
+            gene_resolver=gene_resolver,
+        )
+
+    database_releases = DatabaseReleaseManager(
+        locate=locate_database,
+        open_release=open_release,
+        drain_timeout=float(APP_ENVIRONMENT["DATABASE_DRAIN_TIMEOUT"]),
+    )
+    APP_ENVIRONMENT["DATABASE_PATH"] = (
+        database_releases.current.database_path.as_posix()
+    )
+
+    query_executor = QueryExecutor(
+        max_workers=int(APP_ENVIRONMENT["DATABASE_QUERY_WORKERS"]),
+        default_timeout=float(APP_ENVIRONMENT["DATABASE_QUERY_TIMEOUT"]),
+        timeouts={
+            METADATA_QUERY: float(
+                APP_ENVIRONMENT["DATABASE_METADATA_QUERY_TIMEOUT"]
+            ),
+            EXPRESSION_QUERY: float(
+                APP_ENVIRONMENT["DATABASE_EXPRESSION_QUERY_TIMEOUT"]
+            ),
+        },
+        slow_wait_seconds=float(
+            APP_ENVIRONMENT["DATABASE_SLOW_CHECKOUT_SECONDS"]
+        ),
+    )
+
+    response_validators = ResponseValidators(
+        version=lambda: database_releases.current.pool.version,
+        max_age=int(APP_ENVIRONMENT["HTTP_CACHE_MAX_AGE"]),
+    )
+    metadata_cache = MetadataCache(response_validators)
+    expression_cache = ResultCache(
+        max_entries=int(APP_ENVIRONMENT["EXPRESSION_CACHE_ENTRIES"]),
+        max_bytes=int(APP_ENVIRONMENT["EXPRESSION_CACHE_MAX_BYTES"]),
+        ttl=float(APP_ENVIRONMENT["EXPRESSION_CACHE_TTL"]),
+    )
 
     app.state.APP_ENVIRONMENT = APP_ENVIRONMENT
+    app.state.database_releases = database_releases
+    app.state.response_validators = response_validators
+    app.state.metadata_cache = metadata_cache
+    app.state.expression_cache = expression_cache
+    # standardized matrices are built once per experiment and method
+    app.state.coexpression_cache = ResultCache(
+        max_entries=int(APP_ENVIRONMENT["COEXPRESSION_CACHE_ENTRIES"]),
+        max_bytes=int(APP_ENVIRONMENT["COEXPRESSION_CACHE_MAX_BYTES"]),
+        ttl=float(APP_ENVIRONMENT["COEXPRESSION_CACHE_TTL"]),
+        size=lambda matrix: matrix.nbytes,
+    )
+    app.state.query_executor = query_executor
 
-    yield
+    gene_list_store = GeneListStore(gene_list_path)
+    await gene_list_store.open()
+    app.state.gene_list_store = gene_list_store
+
+    warmup = Warmup(
+        app,
+        [
+            step.strip()
+            for step in APP_ENVIRONMENT["WARMUP_STEPS"].split(",")
+            if step.strip()
+        ],
+        experiments=[
+            int(experiment_id)
+            for experiment_id in APP_ENVIRONMENT[
+                "WARMUP_EXPERIMENTS"
+            ].split(",")
+            if experiment_id.strip()
+        ],
+        largest_experiments=int(
+            APP_ENVIRONMENT["WARMUP_LARGEST_EXPERIMENTS"]
+        ),
+    )
+    app.state.warmup = warmup
+    warmup_task = asyncio.create_task(warmup.run())
+
+    poll_seconds = float(APP_ENVIRONMENT["DATABASE_RELEASE_POLL_SECONDS"])
+    release_watcher = (
+        asyncio.create_task(database_releases.watch(poll_seconds))
+        if poll_seconds > 0
+        else None
+    )
+
+    try:
+        yield
+    finally:
+        warmup_task.cancel()
+        if release_watcher is not None:
+            release_watcher.cancel()
+        logger.info(f"Closing query executor: {query_executor.stats()}")
+        query_executor.shutdown()
+        await gene_list_store.close()
+        logger.info(
+            f"Closing database pool: {database_releases.current.pool.stats()}"
+        )
+        await database_releases.close()
 
 
 def get_environment(request: Request) -> dict[str, str]:
@@ -80,21 +334,160 @@ def get_go_enrichment_path(request: Request) -> Path:
     )
 
 
-def get_db_connection(
-    request: Request,
-) -> Generator[DuckDBPyConnection, None, None]:
+def get_database_releases(request: Request) -> DatabaseReleaseManager:
+    return request.app.state.database_releases
+
+
+def get_database_pool(request: Request) -> DatabasePool:
+    return get_database_releases(request).current.pool
+
+
+def get_query_executor(request: Request) -> QueryExecutor:
+    return request.app.state.query_executor
+
+
+def get_expression_matrix_store(request: Request) -> ExpressionMatrixStore:
+    return get_database_releases(request).current.expression_matrix_store
+
+
+def get_gene_keys(request: Request) -> Optional[GeneKeyMap]:
+    return request.app.state.database_releases.current.gene_keys
+
+
+def get_gene_ids(request: Request) -> GeneIdIndex:
+    return request.app.state.database_releases.current.gene_ids
+
+
+def get_gene_resolver(request: Request) -> GeneIdResolver:
+    return request.app.state.database_releases.current.gene_resolver
+
+
+def get_coexpression_cache(request: Request) -> ResultCache:
+    return request.app.state.coexpression_cache
+
+
+def get_gene_list_store(request: Request) -> GeneListStore:
+    return request.app.state.gene_list_store
+
+
+async def find_gene_list(request: Request, list_id: str) -> StoredGeneList:
+    gene_list = await get_gene_list_store(request).get(list_id)
+    if gene_list is None:
+        raise HTTPException(
+            status_code=404, detail=f"Gene list {list_id} not found"
+        )
+    return gene_list
+
+
+async def requested_genes(
+    request: Request, gene_ids: List[str], gene_list_id: Optional[str]
+) -> Tuple[str, Callable[[], GeneResolution]]:
     """
-    Creates a SafeDuckDbConnection context for dependency injection.
-    Yields the active connection and ensures it closes after the request.
+    The genes of a request, given either as ids or as a stored gene
+    list: a digest of the list for cache keys, and a function that
+    resolves it against the current release. Stored lists are resolved
+    once per release; the function may take a while for long lists, so
+    call it off the event loop.
     """
+    release = get_database_releases(request).current
+
+    if gene_list_id is None:
+        return gene_list_digest(gene_ids), functools.partial(
+            release.gene_resolver.resolve, gene_ids
+        )
+
+    gene_list = await find_gene_list(request, gene_list_id)
+    return gene_list.digest, functools.partial(
+        get_gene_list_store(request).resolve,
+        gene_list,
+        release.pool.version,
+        release.gene_resolver,
+        release.gene_keys,
+    )
 
-    with duckdb.connect(
-        request.app.state.APP_ENVIRONMENT["DATABASE_PATH"], read_only=True
-    ) as connection:
-        yield connection
+
+def get_response_validators(request: Request) -> ResponseValidators:
+    return request.app.state.response_validators
+
+
+def get_warmup(request: Request) -> Warmup:
+    return request.app.state.warmup
+
+
+def get_metadata_cache(request: Request) -> MetadataCache:
+    return request.app.state.metadata_cache
+
+
+def get_expression_cache(request: Request) -> ResultCache:
+    return request.app.state.expression_cache
+
+
+@asynccontextmanager
+async def open_database_session(
+    request: Request, cancel_on_disconnect: bool = True
+) -> AsyncGenerator[DatabaseSession, None]:
+    """
+    Checks out a cursor on the process-wide read-only connection of the
+    current release and wraps it in a DatabaseSession, which runs
+    queries on the query executor. The cursor is closed and its slot
+    returned to the pool on exit. The release is held from before the
+    checkout, so a release swap while waiting for a slot does not close
+    the pool underneath.
+
+    Work shared between requests should not be cancelled when the
+    request that started it disconnects; pass
+    `cancel_on_disconnect=False` for that.
+    """
+    with get_database_releases(request).use() as release:
+        try:
+            # waiting for a free slot blocks, so do it off the event loop
+            cursor = await run_in_threadpool(release.pool.acquire)
+        except DatabasePoolTimeout as error:
+            raise HTTPException(status_code=503, detail=str(error))
+
+        try:
+            yield DatabaseSession(
+                cursor,
+                get_query_executor(request),
+                request=request if cancel_on_disconnect else None,
+            )
+        finally:
+            release.pool.release(cursor)
+
+
+async def get_db_connection(
+    request: Request,
+) -> AsyncGenerator[DatabaseSession, None]:
+    """
+    A database session for dependency injection, held for the duration
+    of the request.
+    """
+    async with open_database_session(request) as session:
+        yield session
 
 
-DatabaseDep = Annotated[DuckDBPyConnection, Depends(get_db_connection)]
+DatabaseDep = Annotated[DatabaseSession, Depends(get_db_connection)]
+DatabaseReleasesDep = Annotated[
+    DatabaseReleaseManager, Depends(get_database_releases)
+]
+DatabasePoolDep = Annotated[DatabasePool, Depends(get_database_pool)]
+QueryExecutorDep = Annotated[QueryExecutor, Depends(get_query_executor)]
+ResponseValidatorsDep = Annotated[
+    ResponseValidators, Depends(get_response_validators)
+]
+ExpressionCacheDep = Annotated[ResultCache, Depends(get_expression_cache)]
+CoexpressionCacheDep = Annotated[
+    ResultCache, Depends(get_coexpression_cache)
+]
+WarmupDep = Annotated[Warmup, Depends(get_warmup)]
+MetadataCacheDep = Annotated[MetadataCache, Depends(get_metadata_cache)]
+GeneKeysDep = Annotated[Optional[GeneKeyMap], Depends(get_gene_keys)]
+GeneIdsDep = Annotated[GeneIdIndex, Depends(get_gene_ids)]
+GeneResolverDep = Annotated[GeneIdResolver, Depends(get_gene_resolver)]
+GeneListStoreDep = Annotated[GeneListStore, Depends(get_gene_list_store)]
+ExpressionMatrixStoreDep = Annotated[
+    ExpressionMatrixStore, Depends(get_expression_matrix_store)
+]
 EnvironmentDep = Annotated[Dict[str, str], Depends(get_environment)]
 BlastPathDep = Annotated[Path, Depends(get_blast_path)]
 GoEnrichmentPathDep = Annotated[Path, Depends(get_go_enrichment_path)]
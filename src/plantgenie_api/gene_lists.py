@@ -0,0 +1,183 @@
+"""
+Gene lists stored on the server.
+
+A client uploads a gene list once and refers to it by id in the
+expression, annotation and GO enrichment requests that follow. Lists
+never change once stored, so each one is resolved against a database
+release (see `GeneIdResolver`) at most once and the result, with the
+integer gene keys, is kept in memory.
+
+The lists are kept in a small SQLite database on local storage, so
+that they outlive restarts and release swaps: GENE_LIST_STORE_PATH, or
+`gene-lists.sqlite` in DATABASE_LOCAL_COPY_PATH; the API does not start
+without one of them. `:memory:` keeps the lists in memory until the API
+stops.
+
+The workers of one server share the file, which SQLite's locking
+allows, in WAL mode so that readers do not wait for a writer. WAL needs
+memory mapped shared files and locks that network file systems do not
+reliably provide, so a store on a network mount, such as DATA_PATH,
+uses the rollback journal instead and concurrent workers can still see
+`database is locked` errors or corrupt it; keep the store on a local
+disk. Servers do not share stores: a list is only known to the server
+it was uploaded to.
+"""
+
+import json
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Hashable, List, Optional
+
+import aiosqlite
+from loguru import logger
+
+from plantgenie_api.cache import gene_list_digest
+from plantgenie_api.genes import GeneIdResolver, GeneKeyMap, GeneResolution
+from plantgenie_api.local_storage import on_network_filesystem
+
+IN_MEMORY_STORE = ":memory:"
+GENE_LIST_STORE_FILENAME = "gene-lists.sqlite"
+
+
+class StoredGeneList:
+    def __init__(
+        self,
+        list_id: str,
+        name: Optional[str],
+        gene_ids: List[str],
+        digest: str,
+        created_at: datetime,
+    ) -> None:
+        self.list_id = list_id
+        self.name = name
+        self.gene_ids = gene_ids
+        self.digest = digest
+        self.created_at = created_at
+
+
+class GeneListStore:
+    """
+    Stores gene lists by id and caches the resolution of the most
+    recently used `max_resolutions` lists per release.
+    """
+
+    def __init__(
+        self, path: str = IN_MEMORY_STORE, max_resolutions: int = 256
+    ) -> None:
+        self.path = path
+        self.max_resolutions = max_resolutions
+        self.connection: Optional[aiosqlite.Connection] = None
+        self._resolutions: OrderedDict[Hashable, GeneResolution] = (
+            OrderedDict()
+        )
+        # resolutions are looked up from the thread pool
+        self._lock = threading.Lock()
+
+    async def open(self) -> None:
+        journal_mode = "WAL"
+        if self.path != IN_MEMORY_STORE:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            if on_network_filesystem(Path(self.path)):
+                logger.warning(
+                    f"Gene list store {self.path} is on a network file"
+                    " system; not using WAL, keep it on a local disk"
+                )
+                journal_mode = "DELETE"
+
+        self.connection = await aiosqlite.connect(self.path)
+        await self.connection.execute(
+            f"PRAGMA journal_mode={journal_mode}"
+        )
+        await self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS gene_lists (
+                id TEXT PRIMARY KEY,
+                name TEXT,
+                gene_ids TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            )
+            """
+        )
+        await self.connection.commit()
+
+    async def close(self) -> None:
+        if self.connection is not None:
+            await self.connection.close()
+            self.connection = None
+
+    async def create(
+        self, name: Optional[str], gene_ids: List[str]
+    ) -> StoredGeneList:
+        gene_list = StoredGeneList(
+            list_id=uuid.uuid4().hex,
+            name=name,
+            gene_ids=gene_ids,
+            digest=gene_list_digest(gene_ids),
+            created_at=datetime.now(timezone.utc),
+        )
+        await self.connection.execute(
+            "INSERT INTO gene_lists VALUES (?, ?, ?, ?, ?)",
+            (
+                gene_list.list_id,
+                gene_list.name,
+                json.dumps(gene_list.gene_ids),
+                gene_list.digest,
+                gene_list.created_at.isoformat(),
+            ),
+        )
+        await self.connection.commit()
+        return gene_list
+
+    async def get(self, list_id: str) -> Optional[StoredGeneList]:
+        async with self.connection.execute(
+            "SELECT name, gene_ids, digest, created_at"
+            " FROM gene_lists WHERE id = ?",
+            (list_id,),
+        ) as cursor:
+            row = await cursor.fetchone()
+
+        if row is None:
+            return None
+
+        name, gene_ids, digest, created_at = row
+        return StoredGeneList(
+            list_id=list_id,
+            name=name,
+            gene_ids=json.loads(gene_ids),
+            digest=digest,
+            created_at=datetime.fromisoformat(created_at),
+        )
+
+    def resolve(
+        self,
+        gene_list: StoredGeneList,
+        version: str,
+        gene_resolver: GeneIdResolver,
+        gene_keys: Optional[GeneKeyMap],
+    ) -> GeneResolution:
+        """
+        The resolution of `gene_list` against the database `version`,
+        with the gene keys looked up for a database that has them. Runs
+        the resolver on a miss, so call it off the event loop.
+        """
+        key = (version, gene_list.list_id)
+        with self._lock:
+            genes = self._resolutions.get(key)
+            if genes is not None:
+                self._resolutions.move_to_end(key)
+                return genes
+
+        genes = gene_resolver.resolve(gene_list.gene_ids)
+        if gene_keys is not None:
+            genes.keyed = gene_keys.lookup(genes.gene_ids)[:2]
+
+        with self._lock:
+            self._resolutions[key] = genes
+            while len(self._resolutions) > self.max_resolutions:
+                self._resolutions.popitem(last=False)
+
+        return genes
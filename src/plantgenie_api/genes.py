@@ -0,0 +1,351 @@
+"""
+Integer gene keys.
+
+A database built by `plantgenie-db build` (or converted with
+`plantgenie-db encode`) numbers every gene of the `gff` in a `genes`
+table and stores tables that hold a row per gene and sample with integer
+`gene_key` / `sample_key` columns:
+
+    genes                       gene_key, gene_id, genome_id
+    expression_metadata         ..., sample_key
+    <relation_name>_keys        sample_key, gene_key, expression_value
+    <relation_name>             view with sample_id, gene_id and value
+
+The views keep the original column names, so everything that reads the
+VARCHAR tables keeps working, while the API translates gene ids to keys
+once per request with `GeneKeyMap` and joins on integers.
+
+`GeneIdIndex` holds the `gff` feature ids of a release sorted in memory,
+for completing gene ids without a query, and `GeneIdResolver` maps the
+ids users paste (any case, with isoform suffixes, aliases or ids of an
+older genome version listed in the optional `gene_aliases` table) to
+`gff` feature ids:
+
+    gene_aliases                alias, gene_id
+"""
+
+import re
+from bisect import bisect_left
+from typing import Dict, List, Optional, Set, Tuple
+
+from duckdb import DuckDBPyConnection
+
+GENE_TABLE = "genes"
+GENE_ALIAS_TABLE = "gene_aliases"
+KEYED_TABLE_SUFFIX = "_keys"
+
+
+def keyed_table_name(table_name: str) -> str:
+    return f"{table_name}{KEYED_TABLE_SUFFIX}"
+
+
+# gene lists resolved in one request
+MAX_GENE_IDS = 100_000
+
+# a trailing transcript number, as in "Potri.001G000100.1"
+ISOFORM_SUFFIX = re.compile(r"\.\d+$")
+
+
+def has_table(connection: DuckDBPyConnection, table_name: str) -> bool:
+    return bool(
+        connection.execute(
+            """
+            SELECT count(*) FROM duckdb_tables()
+            WHERE table_name = ? AND schema_name = 'main'
+            """,
+            [table_name],
+        ).fetchone()[0]
+    )
+
+
+def has_gene_keys(connection: DuckDBPyConnection) -> bool:
+    return has_table(connection, GENE_TABLE)
+
+
+class GeneKeyMap:
+    """
+    The gene id -> gene key map of one database release, held in memory
+    so that requested ids are translated without a query.
+    """
+
+    def __init__(self, keys: Dict[str, int]) -> None:
+        self.keys = keys
+
+    @classmethod
+    def load(
+        cls, connection: DuckDBPyConnection
+    ) -> Optional["GeneKeyMap"]:
+        """
+        Reads the `genes` table, or returns None for a database without
+        gene keys.
+        """
+        if not has_gene_keys(connection):
+            return None
+
+        columns = connection.execute(
+            f"SELECT gene_id, gene_key FROM {GENE_TABLE}"
+        ).fetchnumpy()
+
+        return cls(
+            dict(
+                zip(
+                    columns["gene_id"].tolist(),
+                    columns["gene_key"].tolist(),
+                )
+            )
+        )
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def lookup(
+        self, gene_ids: List[str]
+    ) -> Tuple[List[str], List[int], List[str]]:
+        """
+        Maps requested gene ids to keys, keeping the request order and
+        the first occurrence of duplicates. Returns the known gene ids,
+        their keys and the ids that are not in the database.
+        """
+        found: List[str] = []
+        keys: List[int] = []
+        missing: List[str] = []
+
+        for gene_id in dict.fromkeys(gene_ids):
+            key = self.keys.get(gene_id)
+            if key is None:
+                missing.append(gene_id)
+            else:
+                found.append(gene_id)
+                keys.append(key)
+
+        return found, keys, missing
+
+
+class GeneIdIndex:
+    """
+    The `gff` feature ids of one database release, sorted case-folded
+    per genome and for all genomes, so that the ids starting with a
+    prefix are found by binary search.
+    """
+
+    def __init__(self, genomes: Dict[int, List[str]]) -> None:
+        self.genomes = {
+            genome_id: self._sorted(gene_ids)
+            for genome_id, gene_ids in genomes.items()
+        }
+        self.all = self._sorted(
+            [
+                gene_id
+                for gene_ids in genomes.values()
+                for gene_id in gene_ids
+            ]
+        )
+
+    @staticmethod
+    def _sorted(gene_ids: List[str]) -> Tuple[List[str], List[str]]:
+        pairs = sorted(
+            {(gene_id.casefold(), gene_id) for gene_id in gene_ids}
+        )
+        return [key for key, _ in pairs], [gene_id for _, gene_id in pairs]
+
+    @classmethod
+    def load(cls, connection: DuckDBPyConnection) -> "GeneIdIndex":
+        columns = connection.execute(
+            "SELECT genome_id, feature_id FROM gff"
+            " WHERE feature_id IS NOT NULL"
+        ).fetchnumpy()
+
+        genomes: Dict[int, List[str]] = {}
+        for genome_id, gene_id in zip(
+            columns["genome_id"].tolist(), columns["feature_id"].tolist()
+        ):
+            genomes.setdefault(genome_id, []).append(gene_id)
+
+        return cls(genomes)
+
+    def __len__(self) -> int:
+        return len(self.all[0])
+
+    def complete(
+        self, prefix: str, genome_id: Optional[int] = None, limit: int = 20
+    ) -> List[str]:
+        """
+        Up to `limit` ids that start with `prefix`, ignoring case, in
+        sorted order.
+        """
+        keys, gene_ids = (
+            self.all
+            if genome_id is None
+            else self.genomes.get(genome_id, ([], []))
+        )
+        prefix = prefix.casefold()
+
+        start = bisect_left(keys, prefix)
+        stop = start
+        end = min(start + limit, len(keys))
+        while stop < end and keys[stop].startswith(prefix):
+            stop += 1
+
+        return gene_ids[start:stop]
+
+
+class GeneResolution:
+    """
+    The outcome of resolving a gene list: the `gff` feature ids found,
+    each once and in request order, the requested ids that were mapped
+    to a different feature id, and the requested ids that are unknown.
+    `ambiguous` maps the unknown ids that are an alias of several genes
+    to those genes, none of which is picked. `keyed` holds the known
+    gene ids and their gene keys once they have been looked up, for
+    resolutions that are cached.
+    """
+
+    def __init__(
+        self,
+        gene_ids: List[str],
+        resolved: Dict[str, str],
+        unresolved: List[str],
+        ambiguous: Optional[Dict[str, List[str]]] = None,
+    ) -> None:
+        self.gene_ids = gene_ids
+        self.resolved = resolved
+        self.unresolved = unresolved
+        self.ambiguous = ambiguous or {}
+        self.keyed: Optional[Tuple[List[str], List[int]]] = None
+
+    def missing(self, found: List[str]) -> List[str]:
+        """The requested ids that are unknown or not among `found`."""
+        found_ids = set(found)
+        return self.unresolved + [
+            gene_id
+            for gene_id in self.gene_ids
+            if gene_id not in found_ids
+        ]
+
+
+class GeneIdResolver:
+    """
+    Maps requested gene ids to the `gff` feature ids of one release
+    through a single hash index. Its keys are the feature ids, their
+    case-folded form and the aliases, as given and case-folded; a
+    feature id always wins over an alias that happens to look the same.
+    An alias of several genes, such as a gene that was split in a newer
+    genome version, is kept apart in `ambiguous` and resolves to none.
+    """
+
+    def __init__(
+        self, gene_ids: List[str], aliases: Dict[str, List[str]]
+    ) -> None:
+        index: Dict[str, str] = {gene_id: gene_id for gene_id in gene_ids}
+        for gene_id in gene_ids:
+            index.setdefault(gene_id.casefold(), gene_id)
+
+        alias_genes: Dict[str, Set[str]] = {}
+        for alias, alias_gene_ids in aliases.items():
+            for key in (alias, alias.casefold()):
+                alias_genes.setdefault(key, set()).update(alias_gene_ids)
+
+        ambiguous: Dict[str, List[str]] = {}
+        for key, genes in alias_genes.items():
+            if key in index:
+                continue
+            if len(genes) == 1:
+                index[key] = next(iter(genes))
+            else:
+                ambiguous[key] = sorted(genes)
+
+        self.index = index
+        self.ambiguous = ambiguous
+
+    @classmethod
+    def load(cls, connection: DuckDBPyConnection) -> "GeneIdResolver":
+        gene_ids = (
+            connection.execute(
+                "SELECT DISTINCT feature_id FROM gff"
+                " WHERE feature_id IS NOT NULL ORDER BY feature_id"
+            )
+            .fetchnumpy()["feature_id"]
+            .tolist()
+        )
+
+        aliases: Dict[str, List[str]] = {}
+        if has_table(connection, GENE_ALIAS_TABLE):
+            columns = connection.execute(
+                f"""
+                SELECT a.alias, a.gene_id
+                FROM {GENE_ALIAS_TABLE} a
+                    SEMI JOIN gff g ON (g.feature_id = a.gene_id)
+                ORDER BY a.alias, a.gene_id
+                """
+            ).fetchnumpy()
+            for alias, gene_id in zip(
+                columns["alias"].tolist(), columns["gene_id"].tolist()
+            ):
+                aliases.setdefault(alias, []).append(gene_id)
+
+        return cls(gene_ids, aliases)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def resolve(self, gene_ids: List[str]) -> GeneResolution:
+        """
+        Resolves requested ids in request order, dropping duplicates.
+        Each step is a single pass over the ids that are still
+        unresolved: exact ids, then trimmed and case-folded ids, then
+        the same without an isoform suffix.
+        """
+        requested = list(dict.fromkeys(gene_ids))
+        index = self.index
+
+        matches = list(map(index.get, requested))
+        retry = [i for i, match in enumerate(matches) if match is None]
+        if retry:
+            keys = [requested[i].strip().casefold() for i in retry]
+            for i, match in zip(retry, map(index.get, keys)):
+                matches[i] = match
+
+            retry = [i for i in retry if matches[i] is None]
+            keys = [
+                ISOFORM_SUFFIX.sub("", requested[i].strip()) for i in retry
+            ]
+            for i, key in zip(retry, keys):
+                matches[i] = index.get(key) or index.get(key.casefold())
+
+        resolved: Dict[str, str] = {}
+        unresolved: List[str] = []
+        ambiguous: Dict[str, List[str]] = {}
+        for gene_id, match in zip(requested, matches):
+            if match is None:
+                unresolved.append(gene_id)
+                candidates = self.ambiguous_candidates(gene_id)
+                if candidates:
+                    ambiguous[gene_id] = candidates
+            elif match != gene_id:
+                resolved[gene_id] = match
+
+        return GeneResolution(
+            list(dict.fromkeys(match for match in matches if match)),
+            resolved,
+            unresolved,
+            ambiguous,
+        )
+
+    def ambiguous_candidates(self, gene_id: str) -> Optional[List[str]]:
+        """
+        The genes an unresolved id is an alias of, tried in the order of
+        `resolve`, if it is an ambiguous alias.
+        """
+        if not self.ambiguous:
+            return None
+        trimmed = gene_id.strip()
+        without_isoform = ISOFORM_SUFFIX.sub("", trimmed)
+        for key in (
+            gene_id,
+            trimmed.casefold(),
+            without_isoform,
+            without_isoform.casefold(),
+        ):
+            if key in self.ambiguous:
+                return self.ambiguous[key]
+        return None
@@ -0,0 +1,203 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+from loguru import logger
+
+from plantgenie_api.cache import database_version
+
+# ioctl that makes dst share the extents of src on btrfs/xfs
+FICLONE = 0x40049409
+CHECKSUM_CHUNK_SIZE = 2**24
+COPY_MANIFEST_SUFFIX = ".copy.json"
+
+# file systems whose locking and shared memory mappings SQLite and
+# flock cannot rely on
+NETWORK_FILESYSTEMS = {
+    "nfs",
+    "nfs4",
+    "cifs",
+    "smb3",
+    "smbfs",
+    "ceph",
+    "glusterfs",
+    "lustre",
+    "9p",
+    "fuse.sshfs",
+}
+
+
+def file_checksum(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as file:
+        while chunk := file.read(CHECKSUM_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def clone_or_copy(source: Path, destination: Path) -> str:
+    with source.open("rb") as src, destination.open("wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return "reflink"
+        except OSError:
+            pass
+
+    shutil.copyfile(source, destination)
+    return "copy"
+
+
+def on_network_filesystem(
+    path: Path, mounts: Path = Path("/proc/mounts")
+) -> bool:
+    """
+    Whether `path`, which need not exist yet, is on a network file
+    system, going by the longest mount point containing it. Without a
+    mount table, as outside Linux, paths count as local.
+    """
+    try:
+        mount_table = mounts.read_text().splitlines()
+    except OSError:
+        return False
+
+    resolved = path.resolve()
+    fstype = None
+    longest = -1
+    for line in mount_table:
+        fields = line.split()
+        if len(fields) < 3:
+            continue
+        # spaces in mount points are escaped as \040
+        mount_point = Path(fields[1].replace("\\040", " "))
+        if resolved.is_relative_to(mount_point):
+            if len(mount_point.parts) > longest:
+                longest = len(mount_point.parts)
+                fstype = fields[2]
+
+    return fstype in NETWORK_FILESYSTEMS
+
+
+def lock_path(destination: Path) -> Path:
+    return destination.with_name(f".{destination.name}.lock")
+
+
+@contextmanager
+def copy_lock(destination: Path) -> Iterator[None]:
+    """
+    Holds an exclusive lock on `destination` across processes, such as
+    the workers of one server starting together, so only one of them
+    copies the file and the others wait and reuse that copy.
+    """
+    with lock_path(destination).open("a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def copy_to_local_storage(
+    source: Path,
+    local_root: Path,
+    release_name: str,
+    headroom: float = 0.1,
+) -> Optional[Path]:
+    """
+    Copies a read-only database file to fast local storage and verifies
+    the copy against the source checksum. Returns the path of the copy,
+    or None when there is not enough space or the copy does not verify,
+    in which case the caller keeps using `source`.
+
+    A copy made by an earlier start of the same source file, or by
+    another process in the meantime, is reused after verifying it,
+    without reading the source again. The copy is staged next to the
+    destination and moved over it, so processes that have the previous
+    file open keep reading it.
+    """
+    destination = local_root / release_name / source.name
+    destination.parent.mkdir(parents=True, exist_ok=True)
+
+    with copy_lock(destination):
+        return _copy_to_local_storage(
+            source, local_root, destination, headroom
+        )
+
+
+def _copy_to_local_storage(
+    source: Path, local_root: Path, destination: Path, headroom: float
+) -> Optional[Path]:
+    manifest_path = destination.with_name(
+        destination.name + COPY_MANIFEST_SUFFIX
+    )
+    source_version = database_version(source)
+
+    if destination.exists() and manifest_path.exists():
+        manifest = json.loads(manifest_path.read_text())
+        same_source = manifest.get("source_version") == source_version
+        if same_source and (
+            file_checksum(destination) == manifest.get("checksum")
+        ):
+            logger.info(f"Reusing verified local copy {destination}")
+            return destination
+        logger.warning(f"Discarding stale local copy {destination}")
+
+    # the manifest goes first, so a copy is never trusted without one
+    manifest_path.unlink(missing_ok=True)
+
+    required = int(source.stat().st_size * (1 + headroom))
+    free = shutil.disk_usage(destination.parent).free
+    if free < required:
+        logger.warning(
+            f"Not copying {source} to {local_root}: {free} bytes free,"
+            f" {required} needed"
+        )
+        return None
+
+    start = time.perf_counter()
+    staging = destination.with_name(f".{destination.name}.tmp")
+    try:
+        method = clone_or_copy(source, staging)
+        source_checksum = file_checksum(source)
+        if file_checksum(staging) != source_checksum:
+            logger.error(f"Local copy of {source} failed verification")
+            staging.unlink(missing_ok=True)
+            return None
+    except OSError as error:
+        logger.error(f"Could not copy {source} to {local_root}: {error}")
+        staging.unlink(missing_ok=True)
+        return None
+
+    os.replace(staging, destination)
+    manifest_path.write_text(
+        json.dumps(
+            {
+                "source": source.as_posix(),
+                "source_version": source_version,
+                "checksum": source_checksum,
+            }
+        )
+    )
+    logger.info(
+        f"Copied {source} to {destination} ({method},"
+        f" {time.perf_counter() - start:.1f}s)"
+    )
+
+    return destination
+
+
+def remove_local_copy(path: Path) -> None:
+    path.unlink(missing_ok=True)
+    path.with_name(path.name + COPY_MANIFEST_SUFFIX).unlink(
+        missing_ok=True
+    )
+    lock_path(path).unlink(missing_ok=True)
+    try:
+        path.parent.rmdir()
+    except OSError:
+        pass
@@ -1,9 +1,12 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 
 from plantgenie_api.api.v1.annotation.routes import (
     router as annotation_router,
 )
+from plantgenie_api.api.v1.annotation.streaming import (
+    GENE_RESOLUTION_HEADERS,
+)
 from plantgenie_api.api.v1.blast.routes import router as blast_router
 from plantgenie_api.api.v1.expression.routes import (
     router as expression_router,
@@ -11,11 +14,28 @@ from plantgenie_api.api.v1.expression.routes import (
 from plantgenie_api.api.v1.enrichment.routes import (
     router as enrichment_router,
 )
+from plantgenie_api.api.v1.gene_lists.routes import (
+    router as gene_lists_router,
+)
+from plantgenie_api.api.v1.genes.routes import router as genes_router
 from plantgenie_api.api.v1.genome.routes import router as genome_router
-from plantgenie_api.dependencies import DatabaseDep, lifespan
+from plantgenie_api.database import METADATA_QUERY
+from plantgenie_api.dependencies import (
+    CoexpressionCacheDep,
+    DatabasePoolDep,
+    DatabaseReleasesDep,
+    ExpressionCacheDep,
+    MetadataCacheDep,
+    QueryExecutorDep,
+    WarmupDep,
+    lifespan,
+    open_database_session,
+)
 from plantgenie_api.models import (
     AvailableSpecies,
     AvailableSpeciesResponse,
+    ReadinessResponse,
+    StatusResponse,
 )
 
 app = FastAPI(
@@ -35,9 +55,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # so that browsers let clients read the resolution of NDJSON streams
+    expose_headers=list(GENE_RESOLUTION_HEADERS.values()),
 )
 app.include_router(router=blast_router, prefix="/v1")
 app.include_router(router=genome_router, prefix="/v1")
+app.include_router(router=genes_router, prefix="/v1")
+app.include_router(router=gene_lists_router, prefix="/v1")
 app.include_router(router=expression_router, prefix="/v1")
 app.include_router(router=annotation_router, prefix="/v1")
 app.include_router(router=enrichment_router, prefix="/v1")
@@ -48,22 +72,62 @@ async def root():
     return {"message": "Welcome to the PlantGenIE API!"}
 
 
+@app.get("/status")
+async def get_status(
+    database_releases: DatabaseReleasesDep,
+    database_pool: DatabasePoolDep,
+    query_executor: QueryExecutorDep,
+    metadata_cache: MetadataCacheDep,
+    expression_cache: ExpressionCacheDep,
+    coexpression_cache: CoexpressionCacheDep,
+) -> StatusResponse:
+    return StatusResponse(
+        release=database_releases.stats(),
+        database=database_pool.stats(),
+        queries=query_executor.stats(),
+        metadata_cache=metadata_cache.stats(),
+        expression_cache=expression_cache.stats(),
+        coexpression_cache=coexpression_cache.stats(),
+    )
+
+
+@app.get(
+    "/ready",
+    responses={503: {"model": ReadinessResponse}},
+    description="Succeeds once the startup warm-up has finished.",
+)
+async def get_readiness(
+    warmup: WarmupDep, response: Response
+) -> ReadinessResponse:
+    if not warmup.ready:
+        response.status_code = 503
+    return warmup.status()
+
+
 @app.get("/available-species")
 async def get_available_species(
-    db_connection: DatabaseDep,
+    request: Request, metadata_cache: MetadataCacheDep
 ) -> AvailableSpeciesResponse:
-    return AvailableSpeciesResponse(
-        species=[
-            AvailableSpecies(
-                **{
-                    k: v
-                    for k, v in zip(
-                        AvailableSpecies.model_fields.keys(), result
-                    )
-                }
+    async def build() -> AvailableSpeciesResponse:
+        async with open_database_session(request) as db_connection:
+            results = await db_connection.fetchall(
+                "SELECT * FROM species;", timeout=METADATA_QUERY
             )
-            for result in db_connection.sql(
-                "SELECT * FROM species;"
-            ).fetchall()
-        ]
+
+        return AvailableSpeciesResponse(
+            species=[
+                AvailableSpecies(
+                    **{
+                        k: v
+                        for k, v in zip(
+                            AvailableSpecies.model_fields.keys(), result
+                        )
+                    }
+                )
+                for result in results
+            ]
+        )
+
+    return await metadata_cache.response(
+        request, "available-species", build
     )
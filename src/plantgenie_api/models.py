@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import List, Optional
+from typing import List, Literal, Optional
 
 from pydantic import BaseModel, Field, ConfigDict
 from datetime import date
@@ -147,3 +147,76 @@ class AvailableGenome(PlantGenieModel):
 
 class AvailableGenomesResponse(PlantGenieModel):
     genomes: List[AvailableGenome]
+
+
+class DatabasePoolStats(PlantGenieModel):
+    database_path: str
+    database_version: str
+    pool_size: int
+    in_use: int
+    checkouts: int
+    timeouts: int
+    total_wait_seconds: float
+    max_wait_seconds: float
+    mean_wait_seconds: float = Field(default=0.0)
+
+
+class QueryExecutorStats(PlantGenieModel):
+    max_workers: int
+    waiting: int
+    running: int
+    executed: int
+    timeouts: int
+    interrupted: int
+    total_wait_seconds: float
+    max_wait_seconds: float
+    mean_wait_seconds: float = Field(default=0.0)
+
+
+class DatabaseReleaseStats(PlantGenieModel):
+    name: str
+    database_path: str
+    storage: Literal["shared", "local"]
+    opened_path: str
+    swaps: int
+    draining: List[str]
+
+
+class MetadataCacheStats(PlantGenieModel):
+    version: str
+    entries: int
+    hits: int
+    misses: int
+    not_modified: int
+
+
+class ResultCacheStats(PlantGenieModel):
+    entries: int
+    bytes: int
+    max_entries: int
+    max_bytes: int
+    hits: int
+    misses: int
+    coalesced: int
+    evictions: int
+    expirations: int
+
+
+class WarmupStep(PlantGenieModel):
+    name: str
+    seconds: float
+    error: Optional[str] = Field(default=None)
+
+
+class ReadinessResponse(PlantGenieModel):
+    ready: bool
+    steps: List[WarmupStep]
+
+
+class StatusResponse(PlantGenieModel):
+    release: DatabaseReleaseStats
+    database: DatabasePoolStats
+    queries: QueryExecutorStats
+    metadata_cache: MetadataCacheStats
+    expression_cache: ResultCacheStats
+    coexpression_cache: ResultCacheStats
@@ -0,0 +1,191 @@
+import asyncio
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from loguru import logger
+from shared.expression_matrix import ExpressionMatrixStore
+
+from plantgenie_api.database import DatabasePool
+from plantgenie_api.genes import GeneIdIndex, GeneIdResolver, GeneKeyMap
+from plantgenie_api.local_storage import remove_local_copy
+from plantgenie_api.models import DatabaseReleaseStats
+
+
+class DatabaseRelease:
+    """
+    Everything that is opened from one database release: the connection
+    pool and the memory-mapped expression matrices. `database_path` is
+    the published file; the pool may have opened a copy of it on local
+    storage instead, in which case `local_copy` is set. `gene_keys` is
+    None for a database without integer gene keys; `gene_ids` completes
+    the gene ids of the release and `gene_resolver` maps requested ids to
+    them.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        database_path: Path,
+        pool: DatabasePool,
+        expression_matrix_store: ExpressionMatrixStore,
+        local_copy: Optional[Path] = None,
+        gene_keys: Optional[GeneKeyMap] = None,
+        gene_ids: Optional[GeneIdIndex] = None,
+        gene_resolver: Optional[GeneIdResolver] = None,
+    ) -> None:
+        self.name = name
+        self.database_path = database_path
+        self.pool = pool
+        self.expression_matrix_store = expression_matrix_store
+        self.local_copy = local_copy
+        self.gene_keys = gene_keys
+        self.gene_ids = gene_ids or GeneIdIndex({})
+        self.gene_resolver = gene_resolver or GeneIdResolver([], {})
+        # sessions using the release, see `DatabaseReleaseManager.use`
+        self.users = 0
+
+    def close(self) -> None:
+        self.pool.close()
+
+    def discard(self) -> None:
+        """
+        Closes a release that has been replaced and removes its local
+        copy. The local copy of a release that is still current is kept
+        on shutdown, so the next start can reuse it.
+        """
+        self.close()
+        if self.local_copy is not None:
+            remove_local_copy(self.local_copy)
+
+
+class DatabaseReleaseManager:
+    """
+    Holds the release that new requests are served from and switches to
+    a newly published release without a restart.
+
+    `locate` returns the resolved database path of the current release
+    and `open_release` opens it. When the path changes, the new release
+    is opened first and then swapped in; requests that already checked
+    out a cursor, or are waiting for one, finish on the old pool, which
+    is closed once it has drained or after `drain_timeout` seconds.
+    """
+
+    def __init__(
+        self,
+        locate: Callable[[], Path],
+        open_release: Callable[[Path], DatabaseRelease],
+        drain_timeout: float = 60.0,
+        drain_poll_interval: float = 0.1,
+    ) -> None:
+        self.locate = locate
+        self.open_release = open_release
+        self.drain_timeout = drain_timeout
+        self.drain_poll_interval = drain_poll_interval
+
+        self.current: DatabaseRelease = open_release(locate())
+        self._retired: List[DatabaseRelease] = []
+        self._swaps = 0
+        self._swap_lock = asyncio.Lock()
+        self._drain_tasks: set[asyncio.Task] = set()
+
+    async def refresh(self) -> bool:
+        """
+        Switches to the current release if it has changed. Returns
+        whether a switch happened.
+        """
+        async with self._swap_lock:
+            try:
+                database_path = await run_in_threadpool(self.locate)
+            except FileNotFoundError as error:
+                logger.error(
+                    f"Current database release not found: {error}"
+                )
+                return False
+
+            if database_path == self.current.database_path:
+                return False
+
+            release = await run_in_threadpool(
+                self.open_release, database_path
+            )
+            retired, self.current = self.current, release
+            self._swaps += 1
+
+            logger.info(
+                f"Switched database release {retired.name} -> {release.name}"
+            )
+
+            self._retired.append(retired)
+            task = asyncio.create_task(self._drain(retired))
+            self._drain_tasks.add(task)
+            task.add_done_callback(self._drain_tasks.discard)
+
+            return True
+
+    @contextmanager
+    def use(self) -> Iterator[DatabaseRelease]:
+        """
+        The current release, kept open until the block exits even if a
+        newer release is swapped in meanwhile. Enter it on the event
+        loop, before the first await, so no swap can come in between.
+        """
+        release = self.current
+        release.users += 1
+        try:
+            yield release
+        finally:
+            release.users -= 1
+
+    async def _drain(self, release: DatabaseRelease) -> None:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.drain_timeout
+
+        while release.users > 0 or release.pool.stats().in_use > 0:
+            if loop.time() >= deadline:
+                logger.warning(
+                    f"Release {release.name} still had {release.users}"
+                    f" sessions and {release.pool.stats().in_use} cursors"
+                    f" in use after {self.drain_timeout}s, closing it"
+                    " anyway"
+                )
+                break
+            await asyncio.sleep(self.drain_poll_interval)
+
+        release.discard()
+        self._retired.remove(release)
+        logger.info(f"Closed drained database release {release.name}")
+
+    async def wait_drained(self) -> None:
+        await asyncio.gather(*self._drain_tasks)
+
+    async def watch(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh()
+            except Exception as error:
+                # keep serving the release that is open
+                logger.exception(
+                    f"Database release refresh failed: {error}"
+                )
+
+    async def close(self) -> None:
+        for task in list(self._drain_tasks):
+            task.cancel()
+        for release in [*self._retired, self.current]:
+            release.close()
+        self._retired.clear()
+
+    def stats(self) -> DatabaseReleaseStats:
+        return DatabaseReleaseStats(
+            name=self.current.name,
+            database_path=self.current.database_path.as_posix(),
+            storage="shared"
+            if self.current.local_copy is None
+            else "local",
+            opened_path=self.current.pool.database_path,
+            swaps=self._swaps,
+            draining=[release.name for release in self._retired],
+        )
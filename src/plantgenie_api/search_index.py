@@ -0,0 +1,206 @@
+"""
+Keyword search over gene names and descriptions.
+
+`plantgenie-db build` writes an inverted index of the annotations into
+plain tables, the same structure DuckDB's FTS extension generates, so
+the API's locked-down read-only connection can query it without loading
+an extension:
+
+    annotation_search_documents   doc_id, gene_id, genome_id, gene_name,
+                                  description, length (in terms)
+    annotation_search_terms       term, doc_id, frequency; sorted by
+                                  term and indexed
+    annotation_search_dictionary  term, idf
+    annotation_search_statistics  documents, average_length
+
+Searches are ranked by BM25. Every query term has to match; in prefix
+mode the last term matches every indexed term that starts with it, for
+autocomplete while typing.
+"""
+
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+
+from duckdb import DuckDBPyConnection
+
+SEARCH_DOCUMENTS_TABLE = "annotation_search_documents"
+SEARCH_TERMS_TABLE = "annotation_search_terms"
+SEARCH_DICTIONARY_TABLE = "annotation_search_dictionary"
+SEARCH_STATISTICS_TABLE = "annotation_search_statistics"
+
+# terms are runs of lower-case letters and digits, the same in the
+# index and in queries
+TERM_PATTERN = "[a-z0-9]+"
+SEARCH_MAX_TERMS = 8
+
+# the usual BM25 parameters, as used by DuckDB's FTS extension
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def search_terms(query: str) -> List[str]:
+    return re.findall(TERM_PATTERN, query.lower())
+
+
+def create_search_index(connection: DuckDBPyConnection) -> None:
+    """
+    Indexes `annotations.gene_name` and `description`. The genome of an
+    annotation is taken from the gff feature with the same id.
+    """
+    connection.execute(
+        f"""
+        CREATE OR REPLACE TABLE {SEARCH_DOCUMENTS_TABLE} AS
+        WITH annotated AS (
+            SELECT
+                a.gene_id,
+                min(g.genome_id) AS genome_id,
+                first(a.gene_name ORDER BY a.gene_name) AS gene_name,
+                first(a.description ORDER BY a.description) AS description
+            FROM annotations a
+                JOIN gff g ON (g.feature_id = a.gene_id)
+            GROUP BY a.gene_id
+        )
+        SELECT
+            (row_number() OVER (ORDER BY gene_id) - 1)::INTEGER AS doc_id,
+            gene_id,
+            genome_id,
+            gene_name,
+            description,
+            len(
+                regexp_extract_all(
+                    lower(concat_ws(' ', gene_name, description)),
+                    '{TERM_PATTERN}'
+                )
+            )::INTEGER AS length
+        FROM annotated
+        ORDER BY doc_id;
+
+        CREATE OR REPLACE TABLE {SEARCH_TERMS_TABLE} AS
+        SELECT term, doc_id, count(*)::INTEGER AS frequency
+        FROM (
+            SELECT
+                doc_id,
+                UNNEST(
+                    regexp_extract_all(
+                        lower(concat_ws(' ', gene_name, description)),
+                        '{TERM_PATTERN}'
+                    )
+                ) AS term
+            FROM {SEARCH_DOCUMENTS_TABLE}
+        )
+        GROUP BY term, doc_id
+        ORDER BY term, doc_id;
+
+        CREATE OR REPLACE TABLE {SEARCH_STATISTICS_TABLE} AS
+        SELECT
+            count(*) AS documents,
+            coalesce(avg(length), 0)::DOUBLE AS average_length
+        FROM {SEARCH_DOCUMENTS_TABLE};
+
+        CREATE OR REPLACE TABLE {SEARCH_DICTIONARY_TABLE} AS
+        SELECT
+            t.term,
+            ln(
+                (s.documents - count(*) + 0.5) / (count(*) + 0.5) + 1
+            ) AS idf
+        FROM {SEARCH_TERMS_TABLE} t, {SEARCH_STATISTICS_TABLE} s
+        GROUP BY t.term, s.documents
+        ORDER BY t.term;
+        """
+    )
+
+
+def term_clauses(
+    terms: List[str], prefix: bool
+) -> List[Tuple[str, str | Tuple[str, str]]]:
+    """
+    One clause per query term: ("term", term) for an exact match, or
+    ("prefix", (low, high)) for the terms in [low, high).
+    """
+    clauses: List[Tuple[str, str | Tuple[str, str]]] = [
+        ("term", term) for term in dict.fromkeys(terms)
+    ]
+
+    if prefix and terms:
+        last = terms[-1]
+        # terms only contain [a-z0-9], so bumping the last character
+        # gives the first string after every term starting with `last`
+        high = last[:-1] + chr(ord(last[-1]) + 1)
+        clauses = [clause for clause in clauses if clause[1] != last] + [
+            ("prefix", (last, high))
+        ]
+
+    return clauses
+
+
+@lru_cache(maxsize=64)
+def search_query(clause_kinds: Tuple[str, ...]) -> str:
+    """
+    The search query for a sequence of clause kinds. Each clause looks
+    up the terms table with its own constant filter, an ART index scan
+    for an exact term and a zone-map pruned range scan for a prefix, so
+    only the matching terms are read.
+    """
+    lookups = "\n            UNION ALL\n".join(
+        f"""
+            SELECT {i} AS clause, term, doc_id, frequency
+            FROM {SEARCH_TERMS_TABLE}
+            WHERE term = $term_{i}"""
+        if kind == "term"
+        else f"""
+            SELECT {i} AS clause, term, doc_id, frequency
+            FROM {SEARCH_TERMS_TABLE}
+            WHERE term >= $low_{i} AND term < $high_{i}"""
+        for i, kind in enumerate(clause_kinds)
+    )
+
+    return f"""
+        WITH
+            matches AS ({lookups}
+            ),
+            scored AS (
+                SELECT
+                    m.doc_id,
+                    sum(
+                        d.idf * m.frequency * ({BM25_K1} + 1)
+                        / (
+                            m.frequency
+                            + {BM25_K1} * (
+                                1 - {BM25_B}
+                                + {BM25_B} * doc.length
+                                    / greatest(s.average_length, 1)
+                            )
+                        )
+                    ) AS score
+                FROM matches m
+                    JOIN {SEARCH_DICTIONARY_TABLE} d ON (d.term = m.term)
+                    JOIN {SEARCH_DOCUMENTS_TABLE} doc ON (doc.doc_id = m.doc_id)
+                    CROSS JOIN {SEARCH_STATISTICS_TABLE} s
+                WHERE $genome_id IS NULL OR doc.genome_id = $genome_id
+                GROUP BY m.doc_id
+                HAVING count(DISTINCT m.clause) = {len(clause_kinds)}
+            )
+        SELECT
+            doc.gene_id,
+            doc.gene_name,
+            doc.description,
+            scored.score,
+            count(*) OVER () AS total
+        FROM scored
+            JOIN {SEARCH_DOCUMENTS_TABLE} doc ON (doc.doc_id = scored.doc_id)
+        ORDER BY scored.score DESC, doc.gene_id
+        LIMIT $limit OFFSET $offset;
+    """
+
+
+def search_parameters(
+    clauses: List[Tuple[str, str | Tuple[str, str]]],
+) -> Dict[str, Any]:
+    params: Dict[str, Any] = {}
+    for i, (kind, value) in enumerate(clauses):
+        if kind == "term":
+            params[f"term_{i}"] = value
+        else:
+            params[f"low_{i}"], params[f"high_{i}"] = value
+    return params
@@ -0,0 +1,291 @@
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+import numpy
+from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
+from loguru import logger
+from shared.services.database import quote_identifier
+
+from plantgenie_api.database import DatabaseSession
+from plantgenie_api.genes import keyed_table_name
+from plantgenie_api.models import ReadinessResponse, WarmupStep
+from plantgenie_api.releases import DatabaseRelease
+
+WARMUP_STEPS = ["metadata", "expression", "annotations", "models"]
+WARMUP_QUERY_TIMEOUT = 300.0
+WARMUP_SAMPLE_GENES = 10
+# the expression tables and matrices are only read at a few evenly
+# spaced ranges of genes, which pulls in their row groups and pages
+# without a pass over the whole table
+WARMUP_KEY_RANGES = 8
+WARMUP_RANGE_GENES = 64
+
+METADATA_PATHS = [
+    "/available-species",
+    "/v1/genome/available-genomes",
+    "/v1/expression/available-experiments",
+    "/v1/blast/available-databases",
+]
+
+
+class Warmup:
+    """
+    Prepares a freshly started API before it reports ready: fills the
+    metadata cache, pulls the annotation and gff tables into DuckDB's
+    buffers, reads a few ranges of genes of the hottest experiments, as
+    stored and as matrices, and builds the OpenAPI schema and response
+    models. The hottest experiments are `experiments`, or if none are
+    given the `largest_experiments` largest expression tables.
+
+    Requests are served while the warm-up runs; it only decides when
+    `/ready` starts to succeed. A failing step is logged and skipped,
+    since warm-up only makes the first requests faster.
+    """
+
+    def __init__(
+        self,
+        app: FastAPI,
+        steps: List[str],
+        experiments: Optional[List[int]] = None,
+        largest_experiments: int = 3,
+    ) -> None:
+        unknown = set(steps) - set(WARMUP_STEPS)
+        if unknown:
+            raise ValueError(f"Unknown warm-up steps: {sorted(unknown)}")
+
+        self.app = app
+        self.steps = steps
+        self.experiments = experiments or []
+        self.largest_experiments = largest_experiments
+        self.ready = False
+        self.results: List[WarmupStep] = []
+
+    async def run(self) -> None:
+        step_functions: Dict[str, Callable[[], Awaitable[None]]] = {
+            "metadata": self.warm_metadata,
+            "expression": self.warm_expression,
+            "annotations": self.warm_annotations,
+            "models": self.warm_models,
+        }
+        total_start = time.perf_counter()
+
+        for step in self.steps:
+            start = time.perf_counter()
+            error = None
+            try:
+                await step_functions[step]()
+            except Exception as exception:
+                error = f"{type(exception).__name__}: {exception}"
+                logger.exception(f"Warm-up step {step} failed")
+
+            seconds = time.perf_counter() - start
+            self.results.append(
+                WarmupStep(name=step, seconds=seconds, error=error)
+            )
+            logger.info(f"Warm-up step {step} took {seconds * 1000:.1f}ms")
+
+        self.ready = True
+        logger.info(
+            f"Warm-up finished in {time.perf_counter() - total_start:.2f}s"
+        )
+
+    def status(self) -> ReadinessResponse:
+        return ReadinessResponse(ready=self.ready, steps=self.results)
+
+    def client(self) -> httpx.AsyncClient:
+        # requests go through the whole application in-process, which
+        # also warms routing, validation and serialisation
+        return httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=self.app),
+            base_url="http://warmup",
+        )
+
+    async def fetchall(
+        self, release: DatabaseRelease, query: str, params=None
+    ) -> List[tuple]:
+        # `release` is held by the caller, see `DatabaseReleaseManager.use`
+        cursor = await run_in_threadpool(release.pool.acquire)
+        try:
+            return await DatabaseSession(
+                cursor, self.app.state.query_executor
+            ).fetchall(query, params=params, timeout=WARMUP_QUERY_TIMEOUT)
+        finally:
+            release.pool.release(cursor)
+
+    async def warm_metadata(self) -> None:
+        async with self.client() as client:
+            for path in METADATA_PATHS:
+                (await client.get(path)).raise_for_status()
+
+    async def hottest_experiments(
+        self, release: DatabaseRelease
+    ) -> List[Tuple[int, str]]:
+        """The experiments to warm, with the name of their stored table."""
+        experiments = {
+            experiment_id: (
+                relation_name
+                if release.gene_keys is None
+                else keyed_table_name(relation_name)
+            )
+            for experiment_id, relation_name in await self.fetchall(
+                release, "SELECT id, relation_name FROM experiments"
+            )
+        }
+        if self.experiments:
+            return [
+                (experiment_id, experiments[experiment_id])
+                for experiment_id in self.experiments
+                if experiment_id in experiments
+            ]
+
+        # estimated from the storage metadata, without reading the tables
+        sizes = dict(
+            await self.fetchall(
+                release,
+                "SELECT table_name, estimated_size FROM duckdb_tables()",
+            )
+        )
+        return sorted(
+            experiments.items(),
+            key=lambda experiment: -sizes.get(experiment[1], 0),
+        )[: self.largest_experiments]
+
+    @staticmethod
+    def gene_ranges(
+        release: DatabaseRelease,
+    ) -> List[Tuple[Any, Any, str]]:
+        """
+        Evenly spaced ranges of `WARMUP_RANGE_GENES` genes: the first and
+        last key the expression tables are sorted by, and the first gene
+        id.
+        """
+        genes = (
+            [
+                (gene_id, gene_id)
+                for gene_id in sorted(release.gene_ids.all[1])
+            ]
+            if release.gene_keys is None
+            else sorted(
+                (gene_key, gene_id)
+                for gene_id, gene_key in release.gene_keys.keys.items()
+            )
+        )
+        starts = (
+            sorted(
+                {
+                    i * len(genes) // WARMUP_KEY_RANGES
+                    for i in range(WARMUP_KEY_RANGES)
+                }
+            )
+            if genes
+            else []
+        )
+
+        return [
+            (
+                genes[start][0],
+                genes[min(start + WARMUP_RANGE_GENES, len(genes)) - 1][0],
+                genes[start][1],
+            )
+            for start in starts
+        ]
+
+    async def warm_expression(self) -> None:
+        with self.app.state.database_releases.use() as release:
+            experiments = await self.hottest_experiments(release)
+            gene_ranges = self.gene_ranges(release)
+            gene_column = (
+                "gene_id" if release.gene_keys is None else "gene_key"
+            )
+
+            for experiment_id, table_name in experiments:
+                for low, high, _ in gene_ranges:
+                    await self.fetchall(
+                        release,
+                        f"""
+                        SELECT count(*), sum(expression_value)
+                        FROM {quote_identifier(table_name)}
+                        WHERE {gene_column} BETWEEN $low AND $high
+                        """,
+                        {"low": low, "high": high},
+                    )
+
+                matrix = release.expression_matrix_store.get(experiment_id)
+                if matrix is not None:
+                    await run_in_threadpool(
+                        self.touch_matrix, matrix.values
+                    )
+
+        if not experiments:
+            return
+
+        # a request through the whole application for the first gene of
+        # each range
+        experiment_id = experiments[0][0]
+        gene_ids = [gene_id for _, _, gene_id in gene_ranges]
+        if gene_ids:
+            async with self.client() as client:
+                (
+                    await client.post(
+                        "/v1/expression",
+                        json={
+                            "experimentId": experiment_id,
+                            "geneIds": gene_ids,
+                        },
+                    )
+                ).raise_for_status()
+
+    @staticmethod
+    def touch_matrix(values: numpy.ndarray) -> None:
+        """Reads evenly spaced ranges of rows of a memory-mapped matrix."""
+        genes = len(values)
+        for start in {
+            i * genes // WARMUP_KEY_RANGES
+            for i in range(WARMUP_KEY_RANGES)
+        }:
+            numpy.nansum(values[start : start + WARMUP_RANGE_GENES])
+
+    async def warm_annotations(self) -> None:
+        with self.app.state.database_releases.use() as release:
+            await self.fetchall(
+                release, "SELECT count(DISTINCT feature_id) FROM gff"
+            )
+            await self.fetchall(
+                release,
+                """
+                SELECT
+                    count(DISTINCT gene_id),
+                    count(gene_name),
+                    count(description)
+                FROM annotations
+                """,
+            )
+
+            gene_ids = [
+                row[0]
+                for row in await self.fetchall(
+                    release,
+                    f"SELECT feature_id FROM gff LIMIT {WARMUP_SAMPLE_GENES}",
+                )
+            ]
+            species = await self.fetchall(
+                release, "SELECT species_name FROM species"
+            )
+
+        if gene_ids and species:
+            async with self.client() as client:
+                (
+                    await client.post(
+                        "/v1/annotations",
+                        json={
+                            "species": species[0][0],
+                            "geneIds": gene_ids,
+                        },
+                    )
+                ).raise_for_status()
+
+    async def warm_models(self) -> None:
+        # builds the JSON schema of every request and response model
+        await run_in_threadpool(self.app.openapi)
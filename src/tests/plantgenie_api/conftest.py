@@ -0,0 +1,230 @@
+from pathlib import Path
+
+import duckdb
+import pytest
+from fastapi.testclient import TestClient
+from typer.testing import CliRunner
+
+from plantgenie_api.db.cli import app as db_app
+from plantgenie_api.gene_lists import GENE_LIST_STORE_FILENAME
+from plantgenie_api.main import app
+
+EXAMPLE_GENE_IDS = [f"PA_chr01_G{i:06d}" for i in range(1, 21)]
+EXAMPLE_SAMPLE_IDS = [f"S{i}" for i in range(1, 7)]
+
+
+def build_example_database(database_path: Path) -> Path:
+    with duckdb.connect(database_path.as_posix()) as connection:
+        connection.execute(
+            """
+            CREATE TABLE species (
+                id INTEGER,
+                species_name VARCHAR,
+                species_abbreviation VARCHAR,
+                avatar_path VARCHAR
+            );
+            INSERT INTO species VALUES
+                (1, 'Picea abies', 'Pab', 'avatars/picea-abies.png');
+
+            CREATE TABLE genomes (
+                id INTEGER,
+                species_id INTEGER,
+                version VARCHAR,
+                publication_date DATE,
+                doi VARCHAR
+            );
+            INSERT INTO genomes VALUES
+                (1, 1, 'v2.0', DATE '2023-09-26', NULL);
+
+            CREATE TABLE experiments (
+                id INTEGER,
+                genome_id INTEGER,
+                title VARCHAR,
+                relation_name VARCHAR,
+                expression_units VARCHAR
+            );
+            INSERT INTO experiments VALUES
+                (1, 1, 'Example atlas', 'expression_example', 'tpm');
+
+            CREATE TABLE expression_metadata (
+                experiment_id INTEGER,
+                abbreviation VARCHAR,
+                condition VARCHAR
+            );
+
+            CREATE TABLE expression_example (
+                sample_id VARCHAR,
+                gene_id VARCHAR,
+                expression_value DOUBLE
+            );
+
+            CREATE TABLE gff (
+                feature_id VARCHAR,
+                genome_id INTEGER
+            );
+
+            CREATE TABLE annotations (
+                gene_id VARCHAR,
+                gene_name VARCHAR,
+                description VARCHAR
+            );
+
+            CREATE TABLE blast_databases (
+                species_id INTEGER,
+                genome_id INTEGER,
+                sequence_type VARCHAR,
+                program VARCHAR,
+                database_path VARCHAR
+            );
+            INSERT INTO blast_databases VALUES
+                (1, 1, 'cds', 'blastn', 'blast/Pab02_cds.fa');
+            """
+        )
+
+        connection.executemany(
+            "INSERT INTO expression_metadata VALUES (1, ?, ?)",
+            [
+                [sample_id, "control" if i < 3 else "treated"]
+                for i, sample_id in enumerate(EXAMPLE_SAMPLE_IDS)
+            ],
+        )
+        connection.executemany(
+            "INSERT INTO expression_example VALUES (?, ?, ?)",
+            [
+                [sample_id, gene_id, float(g * 10 + s)]
+                for g, gene_id in enumerate(EXAMPLE_GENE_IDS)
+                for s, sample_id in enumerate(EXAMPLE_SAMPLE_IDS)
+            ],
+        )
+        connection.executemany(
+            "INSERT INTO gff VALUES (?, 1)",
+            [[gene_id] for gene_id in EXAMPLE_GENE_IDS],
+        )
+        connection.executemany(
+            "INSERT INTO annotations VALUES (?, ?, ?)",
+            [
+                [gene_id, f"GENE{i}", f"Example protein {i}"]
+                for i, gene_id in enumerate(EXAMPLE_GENE_IDS)
+            ],
+        )
+
+    return database_path
+
+
+def write_example_sources(source_path: Path) -> Path:
+    """
+    Writes the tables of the example database as the source files of
+    `plantgenie-db build` and returns the manifest. The expression values
+    are written out of gene order.
+    """
+    source_path.mkdir(parents=True, exist_ok=True)
+    database_path = build_example_database(source_path / "example.db")
+
+    with duckdb.connect(database_path.as_posix()) as connection:
+        for table in ["species", "genomes", "gff", "annotations"]:
+            connection.execute(
+                f"COPY {table} TO '{source_path / table}.tsv'"
+                " (HEADER, DELIMITER '\t')"
+            )
+        connection.execute(
+            f"""
+            COPY (
+                SELECT abbreviation, condition FROM expression_metadata
+            ) TO '{source_path}/samples.tsv' (HEADER, DELIMITER '\t')
+            """
+        )
+        connection.execute(
+            f"""
+            COPY (
+                SELECT * FROM expression_example
+                ORDER BY sample_id DESC, gene_id DESC
+            ) TO '{source_path}/expression.parquet' (FORMAT parquet)
+            """
+        )
+
+    database_path.unlink()
+
+    manifest_path = source_path / "manifest.toml"
+    manifest_path.write_text(
+        """
+        [tables]
+        species = "species.tsv"
+        genomes = "genomes.tsv"
+        gff = "gff.tsv"
+        annotations = "annotations.tsv"
+
+        [[experiments]]
+        id = 1
+        genome_id = 1
+        title = "Example atlas"
+        relation_name = "expression_example"
+        expression_units = "tpm"
+        samples = "samples.tsv"
+        expression = "expression.parquet"
+        """
+    )
+
+    return manifest_path
+
+
+@pytest.fixture
+def example_data_path(tmp_path: Path) -> Path:
+    build_example_database(tmp_path / "plantgenie-backend.db")
+    return tmp_path
+
+
+@pytest.fixture
+def api_environment(
+    example_data_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> Path:
+    monkeypatch.setenv("DATA_PATH", example_data_path.as_posix())
+    monkeypatch.setenv("DATABASE_NAME", "plantgenie-backend.db")
+    # keeps the request counters of the tests deterministic
+    monkeypatch.setenv("WARMUP_STEPS", "")
+    monkeypatch.setenv(
+        "GENE_LIST_STORE_PATH",
+        (
+            example_data_path / "local" / GENE_LIST_STORE_FILENAME
+        ).as_posix(),
+    )
+
+    for var in [
+        "OS_AUTH_TYPE",
+        "OS_AUTH_URL",
+        "OS_IDENTITY_API_VERSION",
+        "OS_REGION_NAME",
+        "OS_INTERFACE",
+        "OS_APPLICATION_CREDENTIAL_ID",
+        "OS_APPLICATION_CREDENTIAL_SECRET",
+    ]:
+        monkeypatch.setenv(var, "testing")
+
+    return example_data_path
+
+
+@pytest.fixture
+def api_client(api_environment: Path):
+    with TestClient(app, root_path="") as client:
+        yield client
+
+
+@pytest.fixture(params=["varchar", "gene-keys"])
+def client(
+    request: pytest.FixtureRequest,
+    tmp_path: Path,
+    api_environment: Path,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    """An API client on the example data, with and without gene keys."""
+    if request.param == "gene-keys":
+        manifest_path = write_example_sources(tmp_path / "sources")
+        database_path = tmp_path / "built" / "plantgenie-backend.db"
+        result = CliRunner().invoke(
+            db_app,
+            ["build", manifest_path.as_posix(), database_path.as_posix()],
+        )
+        assert result.exit_code == 0, result.output
+        monkeypatch.setenv("DATA_PATH", database_path.parent.as_posix())
+
+    with TestClient(app, root_path="") as client:
+        yield client
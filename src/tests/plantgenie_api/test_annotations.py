@@ -0,0 +1,176 @@
+import json
+from typing import Optional
+
+import pyarrow.ipc
+import pytest
+from fastapi.testclient import TestClient
+from starlette.requests import ClientDisconnect
+
+from plantgenie_api.api.v1.annotation import routes, streaming
+from plantgenie_api.api.v1.annotation.streaming import (
+    GENE_RESOLUTION_HEADERS,
+    NDJSON_MEDIA_TYPE,
+)
+from plantgenie_api.api.v1.expression.arrow import ARROW_STREAM_MEDIA_TYPE
+from plantgenie_api.main import app
+from tests.plantgenie_api.conftest import EXAMPLE_GENE_IDS
+
+
+def test_annotations_keep_request_order(api_client: TestClient):
+    response = api_client.post(
+        "/v1/annotations",
+        json={
+            "species": "Picea abies",
+            "geneIds": [EXAMPLE_GENE_IDS[3], EXAMPLE_GENE_IDS[1]],
+        },
+    )
+
+    assert response.status_code == 200
+    assert [r["geneId"] for r in response.json()["results"]] == [
+        EXAMPLE_GENE_IDS[3],
+        EXAMPLE_GENE_IDS[1],
+    ]
+
+
+def test_annotations_stream_as_ndjson_and_arrow(
+    api_client: TestClient, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(
+        "plantgenie_api.api.v1.annotation.routes.ANNOTATION_STREAM_BATCH_ROWS",
+        3,
+    )
+    request = {
+        "species": "Picea abies",
+        "geneIds": [
+            *reversed(EXAMPLE_GENE_IDS[1:]),
+            EXAMPLE_GENE_IDS[0].lower(),
+            "PA_chr01_G999999",
+        ],
+    }
+    body = api_client.post("/v1/annotations", json=request).json()
+    expected = body["results"]
+    resolution = {
+        "resolved_gene_ids": body["resolvedGeneIds"],
+        "unresolved_gene_ids": ["PA_chr01_G999999"],
+        "ambiguous_gene_ids": {},
+    }
+
+    ndjson = api_client.post(
+        "/v1/annotations",
+        json=request,
+        headers={"Accept": NDJSON_MEDIA_TYPE},
+    )
+    arrow = api_client.post(
+        "/v1/annotations",
+        json=request,
+        headers={"Accept": ARROW_STREAM_MEDIA_TYPE},
+    )
+
+    assert ndjson.headers["content-type"] == NDJSON_MEDIA_TYPE
+    assert [
+        json.loads(line) for line in ndjson.text.splitlines()
+    ] == expected
+
+    table = pyarrow.ipc.open_stream(arrow.content).read_all()
+    assert table.column_names == ["gene_id", "gene_name", "description"]
+    assert table.column("gene_id").to_pylist() == [
+        result["geneId"] for result in expected
+    ]
+    assert ndjson.headers["etag"] != arrow.headers["etag"]
+
+    # the gene resolution of the JSON response
+    assert body["resolvedGeneIds"] == {
+        EXAMPLE_GENE_IDS[0].lower(): EXAMPLE_GENE_IDS[0]
+    }
+    assert {
+        key: json.loads(ndjson.headers[header])
+        for key, header in GENE_RESOLUTION_HEADERS.items()
+    } == resolution
+    assert {
+        key.decode(): json.loads(value)
+        for key, value in table.schema.metadata.items()
+    } == resolution
+
+    status = api_client.get("/status").json()["database"]
+    assert status["inUse"] == 0
+
+
+def stream_until(client: TestClient, disconnect_at: Optional[str]):
+    """
+    Streams annotations as NDJSON straight through the ASGI app, with a
+    client that goes away when the response sends a `disconnect_at`
+    message, and returns the message types sent.
+    """
+    body = json.dumps(
+        {"species": "Picea abies", "geneIds": EXAMPLE_GENE_IDS}
+    ).encode()
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.4"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/v1/annotations",
+        "raw_path": b"/v1/annotations",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"accept", NDJSON_MEDIA_TYPE.encode()),
+        ],
+        "client": ("testclient", 50000),
+        "server": ("testserver", 80),
+        "app": app,
+    }
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        if message["type"] == disconnect_at:
+            raise OSError("client went away")
+        sent.append(message["type"])
+
+    async def call():
+        try:
+            await app(scope, receive, send)
+        except ClientDisconnect:
+            pass
+
+    client.portal.call(call)
+    return sent
+
+
+@pytest.mark.parametrize(
+    "disconnect_at",
+    [None, "http.response.start", "http.response.body"],
+)
+def test_annotation_stream_releases_its_slot(
+    api_client: TestClient,
+    monkeypatch: pytest.MonkeyPatch,
+    disconnect_at: Optional[str],
+):
+    monkeypatch.setattr(routes, "ANNOTATION_STREAM_BATCH_ROWS", 2)
+    releases = api_client.app.state.database_releases
+    read_next = streaming._read_next_batch
+    read = []
+
+    def read_next_batch(reader):
+        read.append(releases.current.pool.stats().in_use)
+        return read_next(reader)
+
+    monkeypatch.setattr(streaming, "_read_next_batch", read_next_batch)
+    sent = stream_until(api_client, disconnect_at)
+
+    if disconnect_at is None:
+        assert sent[-1] == "http.response.body"
+        assert len(read) > 2
+    else:
+        # the body never started, or stopped after its first chunk
+        assert len(read) <= 1
+    # batches are pulled while the slot is held, and it is returned
+    # whether the client read everything, nothing or part of the body
+    assert set(read) <= {1}
+    assert releases.current.pool.stats().in_use == 0
+    assert releases.current.users == 0
@@ -0,0 +1,220 @@
+import asyncio
+from typing import List
+
+import pytest
+from fastapi.testclient import TestClient
+
+from plantgenie_api.cache import ResultCache
+from tests.plantgenie_api.conftest import EXAMPLE_GENE_IDS
+
+METADATA_ENDPOINTS = [
+    "/available-species",
+    "/v1/genome/available-genomes",
+    "/v1/expression/available-experiments",
+    "/v1/blast/available-databases",
+]
+
+
+def test_metadata_responses(api_client: TestClient):
+    assert api_client.get("/available-species").json() == {
+        "species": [
+            {
+                "id": 1,
+                "speciesName": "Picea abies",
+                "speciesAbbreviation": "Pab",
+                "avatarPath": "avatars/picea-abies.png",
+            }
+        ]
+    }
+    assert api_client.get("/v1/genome/available-genomes").json() == {
+        "genomes": [
+            {
+                "id": 1,
+                "speciesId": 1,
+                "speciesName": "Picea abies",
+                "version": "v2.0",
+                "publicationDate": "2023-09-26",
+                "doi": None,
+            }
+        ]
+    }
+    experiments = api_client.get(
+        "/v1/expression/available-experiments"
+    ).json()["experiments"]
+    assert experiments[0]["experimentTitle"] == "Example atlas"
+    assert api_client.get("/v1/blast/available-databases").json() == [
+        {
+            "species": "Picea abies",
+            "genome": "v2.0",
+            "sequenceType": "cds",
+            "program": "blastn",
+            "databasePath": "blast/Pab02_cds.fa",
+        }
+    ]
+
+
+def test_metadata_cache_hits_skip_the_database(api_client: TestClient):
+    first = [api_client.get(path).content for path in METADATA_ENDPOINTS]
+    checkouts = api_client.get("/status").json()["database"]["checkouts"]
+
+    assert [
+        api_client.get(path).content for path in METADATA_ENDPOINTS
+    ] == first
+
+    status = api_client.get("/status").json()
+    assert status["database"]["checkouts"] == checkouts
+    assert status["metadataCache"]["misses"] == 4
+    assert status["metadataCache"]["hits"] == 4
+    assert (
+        status["metadataCache"]["version"]
+        == status["database"]["databaseVersion"]
+    )
+
+
+def test_metadata_cache_follows_database_version(api_client: TestClient):
+    api_client.get("/available-species")
+    api_client.app.state.database_releases.current.pool.version = (
+        "redeployed"
+    )
+    api_client.get("/available-species")
+    api_client.get("/available-species")
+
+    cache = api_client.get("/status").json()["metadataCache"]
+    assert cache["version"] == "redeployed"
+    assert cache["misses"] == 2
+    assert cache["hits"] == 1
+
+
+def test_metadata_not_modified(api_client: TestClient):
+    response = api_client.get("/v1/genome/available-genomes")
+    etag = response.headers["etag"]
+    assert response.headers["cache-control"] == "public, max-age=300"
+
+    not_modified = api_client.get(
+        "/v1/genome/available-genomes",
+        headers={"If-None-Match": f'"other", W/{etag}'},
+    )
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert not_modified.headers["etag"] == etag
+
+    api_client.app.state.database_releases.current.pool.version = (
+        "redeployed"
+    )
+    modified = api_client.get(
+        "/v1/genome/available-genomes", headers={"If-None-Match": etag}
+    )
+    assert modified.status_code == 200
+    assert modified.headers["etag"] != etag
+
+
+def test_annotations_not_modified(api_client: TestClient):
+    request = {"species": "Picea abies", "geneIds": EXAMPLE_GENE_IDS[:3]}
+    response = api_client.post("/v1/annotations", json=request)
+    etag = response.headers["etag"]
+    assert len(response.json()["results"]) == 3
+
+    checkouts = api_client.get("/status").json()["database"]["checkouts"]
+    not_modified = api_client.post(
+        "/v1/annotations", json=request, headers={"If-None-Match": etag}
+    )
+    assert not_modified.status_code == 304
+    assert (
+        api_client.get("/status").json()["database"]["checkouts"]
+        == checkouts
+    )
+
+    other_genes = api_client.post(
+        "/v1/annotations",
+        json={"species": "Picea abies", "geneIds": EXAMPLE_GENE_IDS[:2]},
+        headers={"If-None-Match": etag},
+    )
+    assert other_genes.status_code == 200
+    assert other_genes.headers["etag"] != etag
+
+
+@pytest.fixture(scope="module")
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.mark.anyio
+async def test_result_cache_coalesces_and_evicts():
+    now = [0.0]
+    cache = ResultCache(
+        max_entries=2, max_bytes=1024, ttl=10.0, clock=lambda: now[0]
+    )
+    builds: List[str] = []
+
+    async def build(key: str) -> bytes:
+        builds.append(key)
+        await asyncio.sleep(0.01)
+        return key.encode()
+
+    results = await asyncio.gather(
+        *[cache.get_or_build("a", lambda: build("a")) for _ in range(5)]
+    )
+    assert results == [b"a"] * 5
+    assert builds == ["a"]
+
+    await cache.get_or_build("b", lambda: build("b"))
+    await cache.get_or_build("a", lambda: build("a"))
+    await cache.get_or_build("c", lambda: build("c"))
+    # "b" was the least recently used entry
+    await cache.get_or_build("b", lambda: build("b"))
+    assert builds == ["a", "b", "c", "b"]
+
+    now[0] = 11.0
+    await cache.get_or_build("b", lambda: build("b"))
+
+    stats = cache.stats()
+    assert stats.coalesced == 4
+    assert stats.hits == 1
+    assert stats.misses == 5
+    assert stats.evictions == 2
+    assert stats.expirations == 1
+    assert stats.entries == 2
+
+
+@pytest.mark.anyio
+async def test_result_cache_does_not_keep_failures():
+    cache = ResultCache()
+
+    async def fail() -> bytes:
+        await asyncio.sleep(0.01)
+        raise ValueError("no such experiment")
+
+    results = await asyncio.gather(
+        cache.get_or_build("a", fail),
+        cache.get_or_build("a", fail),
+        return_exceptions=True,
+    )
+    assert all(isinstance(result, ValueError) for result in results)
+    assert cache.stats().entries == 0
+    assert await cache.get_or_build("a", lambda: asyncio.sleep(0, b"a"))
+
+
+def test_expression_cache_skips_the_database(api_client: TestClient):
+    request = {
+        "experimentId": 1,
+        "geneIds": [EXAMPLE_GENE_IDS[1], EXAMPLE_GENE_IDS[0]],
+    }
+    first = api_client.post("/v1/expression", json=request)
+    checkouts = api_client.get("/status").json()["database"]["checkouts"]
+
+    # repeating a gene does not change the response or the cache key
+    second = api_client.post(
+        "/v1/expression",
+        json={**request, "geneIds": request["geneIds"] * 2},
+    )
+    reordered = api_client.post(
+        "/v1/expression",
+        json={**request, "geneIds": request["geneIds"][::-1]},
+    )
+
+    status = api_client.get("/status").json()
+    assert second.content == first.content
+    assert reordered.json()["geneIds"] == request["geneIds"][::-1]
+    assert status["database"]["checkouts"] == checkouts + 1
+    assert status["expressionCache"]["hits"] == 1
+    assert status["expressionCache"]["misses"] == 2
@@ -0,0 +1,110 @@
+import json
+from pathlib import Path
+
+import duckdb
+import numpy
+import pyarrow.ipc
+import pytest
+from fastapi.testclient import TestClient
+from shared.expression_matrix import export_expression_matrix
+
+from plantgenie_api.api.v1.expression import routes
+from plantgenie_api.api.v1.expression.arrow import ARROW_STREAM_MEDIA_TYPE
+from plantgenie_api.api.v1.expression.clustering import cluster_expression
+from plantgenie_api.api.v1.expression.models import ClusteringOptions
+from plantgenie_api.main import app
+from tests.plantgenie_api.conftest import (
+    EXAMPLE_GENE_IDS,
+    EXAMPLE_SAMPLE_IDS,
+)
+
+hierarchy = pytest.importorskip("scipy.cluster.hierarchy")
+distance = pytest.importorskip("scipy.spatial.distance")
+
+
+def test_correlated_genes_are_ordered_together():
+    generator = numpy.random.default_rng(3)
+    rising = numpy.arange(8, dtype=numpy.float32)
+    # genes 0, 2 and 4 rise across the samples, 1, 3 and 5 fall
+    values = numpy.stack(
+        [
+            (rising if gene % 2 == 0 else -rising)
+            + generator.normal(scale=0.1, size=8)
+            for gene in range(6)
+        ]
+    ).astype(numpy.float32)
+    values[2, 3] = numpy.nan
+
+    clustering = cluster_expression(
+        values,
+        [f"G{gene}" for gene in range(6)],
+        [f"S{sample}" for sample in range(8)],
+        ClusteringOptions(axes=["genes"], linkage="complete"),
+    )
+
+    assert clustering.sample_order is None
+    groups = [int(gene_id[1:]) % 2 for gene_id in clustering.gene_order]
+    assert groups in ([0, 0, 0, 1, 1, 1], [1, 1, 1, 0, 0, 0])
+
+
+def test_expression_clustering(
+    api_environment: Path, monkeypatch: pytest.MonkeyPatch
+):
+    request = {
+        "experimentId": 1,
+        "geneIds": EXAMPLE_GENE_IDS[:6],
+        "cluster": {"distance": "euclidean"},
+    }
+    headers = {"Accept": ARROW_STREAM_MEDIA_TYPE}
+
+    with TestClient(app, root_path="") as client:
+        from_database = client.post("/v1/expression", json=request)
+        as_arrow = client.post(
+            "/v1/expression", json=request, headers=headers
+        )
+        unclustered = client.post(
+            "/v1/expression", json={**request, "cluster": None}
+        )
+
+    with duckdb.connect(
+        (api_environment / "plantgenie-backend.db").as_posix(),
+        read_only=True,
+    ) as connection:
+        export_expression_matrix(
+            connection, 1, api_environment / "expression-matrices"
+        )
+
+    with TestClient(app, root_path="") as client:
+        from_matrix = client.post("/v1/expression", json=request)
+
+    assert from_database.status_code == 200, from_database.text
+    body = from_database.json()
+    values = numpy.array(body["values"]).reshape(6, len(body["samples"]))
+
+    def leaves(rows: numpy.ndarray) -> list:
+        return hierarchy.leaves_list(
+            hierarchy.linkage(distance.pdist(rows), "average")
+        ).tolist()
+
+    assert body["clustering"] == {
+        "geneOrder": [body["geneIds"][row] for row in leaves(values)],
+        "sampleOrder": [body["samples"][row] for row in leaves(values.T)],
+    }
+    assert sorted(body["clustering"]["sampleOrder"]) == sorted(
+        EXAMPLE_SAMPLE_IDS
+    )
+    assert from_matrix.json() == body
+
+    metadata = (
+        pyarrow.ipc.open_stream(as_arrow.content)
+        .read_all()
+        .schema.metadata
+    )
+    assert json.loads(metadata[b"clustering"]) == body["clustering"]
+    assert unclustered.json()["clustering"] is None
+
+    monkeypatch.setattr(routes, "MAX_CLUSTERED_GENES", 5)
+    with TestClient(app, root_path="") as client:
+        too_many = client.post("/v1/expression", json=request)
+
+    assert too_many.status_code == 422
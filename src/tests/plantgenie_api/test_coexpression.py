@@ -0,0 +1,184 @@
+from pathlib import Path
+
+import duckdb
+import numpy
+import pytest
+from fastapi.testclient import TestClient
+from shared.coexpression import (
+    CoexpressionNetwork,
+    average_ranks,
+    build_coexpression_network,
+)
+from shared.expression_matrix import (
+    MANIFEST_FILENAME,
+    MATRIX_FILENAME,
+    ExpressionMatrixManifest,
+    export_expression_matrix,
+)
+
+from plantgenie_api.api.v1.expression.coexpression import (
+    StandardizedMatrix,
+)
+from plantgenie_api.main import app
+from tests.plantgenie_api.conftest import EXAMPLE_GENE_IDS
+
+
+@pytest.fixture
+def values() -> numpy.ndarray:
+    generator = numpy.random.default_rng(7)
+    values = generator.normal(size=(40, 12)).astype(numpy.float32)
+    # ties, as from genes that are not expressed in some samples
+    values[:, :3] = numpy.round(values[:, :3])
+    # a gene with the same value everywhere has no correlation
+    values[5] = 1.0
+    return values
+
+
+def test_pearson_neighbours_match_corrcoef(values: numpy.ndarray):
+    gene_ids = [f"G{i}" for i in range(len(values))]
+    standardized = StandardizedMatrix(gene_ids, values, "pearson")
+
+    (neighbours,) = standardized.neighbours([3], k=5)
+
+    correlations = numpy.corrcoef(values.astype(numpy.float64))[3]
+    expected = [
+        row for row in numpy.argsort(-correlations) if row not in (3, 5)
+    ][:5]
+    assert [gene_id for gene_id, _ in neighbours] == [
+        gene_ids[row] for row in expected
+    ]
+    numpy.testing.assert_allclose(
+        [correlation for _, correlation in neighbours],
+        correlations[expected],
+        rtol=1e-5,
+    )
+    assert standardized.neighbours([5], k=5) == [[]]
+
+
+def test_average_ranks_match_scipy(values: numpy.ndarray):
+    stats = pytest.importorskip("scipy.stats")
+    values[0, 4] = numpy.nan
+
+    ranks = average_ranks(values)
+
+    numpy.testing.assert_array_equal(
+        ranks[1:], stats.rankdata(values[1:], axis=1)
+    )
+    assert numpy.isnan(ranks[0, 4])
+    numpy.testing.assert_array_equal(
+        numpy.delete(ranks[0], 4),
+        stats.rankdata(numpy.delete(values[0], 4)),
+    )
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_network_matches_neighbours(
+    values: numpy.ndarray, tmp_path: Path, processes: int
+):
+    gene_ids = [f"G{i:02}" for i in range(len(values))]
+    numpy.save(tmp_path / MATRIX_FILENAME, values)
+    (tmp_path / MANIFEST_FILENAME).write_text(
+        ExpressionMatrixManifest(
+            experiment_id=1,
+            relation_name="expression_1",
+            expression_units=None,
+            gene_ids=gene_ids,
+            sample_ids=[f"S{i}" for i in range(values.shape[1])],
+        ).model_dump_json()
+    )
+
+    # blocks of 7 genes, to cross block boundaries
+    directory = build_coexpression_network(
+        tmp_path,
+        method="spearman",
+        k=6,
+        processes=processes,
+        block_bytes=7 * len(values) * 4,
+    )
+    network = CoexpressionNetwork(directory)
+
+    standardized = StandardizedMatrix(gene_ids, values, "spearman")
+    expected = standardized.neighbours(list(range(len(values))), k=6)
+
+    assert network.indptr[-1] == 6 * (len(values) - 1)
+    for row, neighbours in enumerate(expected):
+        rows, correlations = network.partners(row)
+        assert [gene_ids[partner] for partner in rows] == [
+            gene_id for gene_id, _ in neighbours
+        ]
+        numpy.testing.assert_allclose(
+            correlations,
+            [correlation for _, correlation in neighbours],
+            atol=1e-3,
+        )
+    # the gene with no correlation has no partners and is no partner
+    assert network.partners(5) == ([], [])
+    assert 5 not in network.indices
+    assert not list(tmp_path.glob(".*"))
+
+
+def test_coexpression_endpoint(api_environment: Path):
+    request = {
+        "experimentId": 1,
+        "geneIds": [EXAMPLE_GENE_IDS[2], "PA_chr01_G999999"],
+        "method": "spearman",
+        "k": 3,
+    }
+
+    with TestClient(app, root_path="") as client:
+        from_database = client.post(
+            "/v1/expression/coexpression", json=request
+        )
+        client.post("/v1/expression/coexpression", json=request)
+        cache = client.get("/status").json()["coexpressionCache"]
+
+    assert from_database.status_code == 200, from_database.text
+    body = from_database.json()
+    assert body["missingGeneIds"] == ["PA_chr01_G999999"]
+    (result,) = body["results"]
+    assert result["geneId"] == EXAMPLE_GENE_IDS[2]
+    # every example gene rises the same way across the samples
+    assert result["neighbours"] == [
+        {"geneId": gene_id, "correlation": pytest.approx(1.0)}
+        for gene_id in [
+            EXAMPLE_GENE_IDS[0],
+            EXAMPLE_GENE_IDS[1],
+            EXAMPLE_GENE_IDS[3],
+        ]
+    ]
+    assert (cache["misses"], cache["hits"]) == (1, 1)
+
+    with duckdb.connect(
+        (api_environment / "plantgenie-backend.db").as_posix(),
+        read_only=True,
+    ) as connection:
+        export_expression_matrix(
+            connection, 1, api_environment / "expression-matrices"
+        )
+
+    with TestClient(app, root_path="") as client:
+        from_matrix = client.post(
+            "/v1/expression/coexpression", json=request
+        )
+        unknown = client.post(
+            "/v1/expression/coexpression",
+            json={**request, "experimentId": 99},
+        )
+
+    assert from_matrix.json() == body
+    assert unknown.status_code == 422
+
+    build_coexpression_network(
+        api_environment / "expression-matrices" / "1", "spearman", k=3
+    )
+
+    with TestClient(app, root_path="") as client:
+        from_network = client.post(
+            "/v1/expression/coexpression", json=request
+        )
+        beyond_network = client.post(
+            "/v1/expression/coexpression", json={**request, "k": 4}
+        )
+
+    assert from_network.json() == {**body, "precomputed": True}
+    assert beyond_network.json()["precomputed"] is False
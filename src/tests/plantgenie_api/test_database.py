@@ -0,0 +1,131 @@
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from plantgenie_api.database import (
+    EXPRESSION_QUERY,
+    METADATA_QUERY,
+    DatabasePool,
+    DatabasePoolTimeout,
+    QueryExecutor,
+    QueryTimeout,
+)
+from plantgenie_api.main import app
+
+
+def test_pool_hands_out_cursors_on_one_connection(
+    example_data_path: Path,
+):
+    pool = DatabasePool(
+        example_data_path / "plantgenie-backend.db", pool_size=2
+    )
+
+    with pool.checkout() as first, pool.checkout() as second:
+        assert first is not second
+        assert first.sql("SELECT count(*) FROM species").fetchone() == (1,)
+        assert pool.stats().in_use == 2
+
+    stats = pool.stats()
+    assert stats.in_use == 0
+    assert stats.checkouts == 2
+    pool.close()
+
+
+def test_pool_times_out_when_exhausted(example_data_path: Path):
+    pool = DatabasePool(
+        example_data_path / "plantgenie-backend.db",
+        pool_size=1,
+        checkout_timeout=0.01,
+    )
+
+    with pool.checkout():
+        with pytest.raises(DatabasePoolTimeout):
+            pool.acquire()
+
+    assert pool.stats().timeouts == 1
+
+    with pool.checkout():
+        assert pool.stats().in_use == 1
+    pool.close()
+
+
+def test_pool_configuration_is_locked(example_data_path: Path):
+    pool = DatabasePool(
+        example_data_path / "plantgenie-backend.db",
+        threads=2,
+        memory_limit="256MB",
+    )
+
+    with pool.checkout() as cursor:
+        assert cursor.sql(
+            "SELECT current_setting('threads')"
+        ).fetchone() == (2,)
+
+        with pytest.raises(Exception):
+            cursor.execute("SET threads = 4")
+
+    pool.close()
+
+
+def test_status_reports_pool(api_client: TestClient):
+    response = api_client.get("/available-species")
+    assert response.status_code == 200
+    assert response.json()["species"][0]["speciesName"] == "Picea abies"
+
+    status = api_client.get("/status").json()
+    assert status["database"]["checkouts"] >= 1
+    assert status["database"]["inUse"] == 0
+
+
+def test_query_timeouts_come_from_the_settings(
+    api_environment: Path, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setenv("DATABASE_QUERY_TIMEOUT", "5")
+    monkeypatch.setenv("DATABASE_EXPRESSION_QUERY_TIMEOUT", "7")
+    monkeypatch.setenv("DATABASE_METADATA_QUERY_TIMEOUT", "0")
+
+    with TestClient(app, root_path="") as client:
+        executor = app.state.query_executor
+        assert executor.timeout(None) == 5
+        assert executor.timeout(EXPRESSION_QUERY) == 7
+        assert executor.timeout(2.5) == 2.5
+
+        response = client.get("/available-species")
+
+    assert executor.timeout(METADATA_QUERY) == 0
+    assert response.status_code == 504
+
+
+@pytest.fixture(scope="module")
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.mark.anyio
+async def test_executor_interrupts_slow_query(example_data_path: Path):
+    pool = DatabasePool(example_data_path / "plantgenie-backend.db")
+    executor = QueryExecutor(max_workers=1)
+
+    with pool.checkout() as cursor:
+        with pytest.raises(QueryTimeout):
+            await executor.run(
+                cursor,
+                lambda c: c.execute(
+                    "SELECT sum(a.range * b.range)"
+                    " FROM range(1000000) a, range(1000000) b"
+                ).fetchall(),
+                timeout=0.2,
+            )
+
+        assert await executor.run(
+            cursor, lambda c: c.execute("SELECT 42").fetchone()
+        ) == (42,)
+
+    stats = executor.stats()
+    assert stats.timeouts == 1
+    assert stats.interrupted == 1
+    assert stats.running == 0
+
+    executor.shutdown()
+    pool.close()
@@ -0,0 +1,187 @@
+from pathlib import Path
+
+import duckdb
+import pytest
+from fastapi.testclient import TestClient
+from typer.testing import CliRunner
+
+from plantgenie_api.api.v1.expression.arrow import ARROW_STREAM_MEDIA_TYPE
+from plantgenie_api.db.build import optimize_database, table_layout
+from plantgenie_api.db.cli import app as db_app
+from plantgenie_api.main import app
+from tests.plantgenie_api.conftest import (
+    EXAMPLE_GENE_IDS,
+    write_example_sources,
+)
+
+runner = CliRunner()
+
+
+@pytest.fixture
+def built_database(tmp_path: Path) -> Path:
+    manifest_path = write_example_sources(tmp_path / "sources")
+    database_path = tmp_path / "built" / "plantgenie-backend.db"
+
+    result = runner.invoke(
+        db_app,
+        ["build", manifest_path.as_posix(), database_path.as_posix()],
+    )
+    assert result.exit_code == 0, result.output
+    assert "expression_example" in result.output
+
+    return database_path
+
+
+def test_build_sorts_and_indexes_lookup_keys(built_database: Path):
+    with duckdb.connect(built_database.as_posix(), read_only=True) as db:
+        stored_keys = [
+            row[0]
+            for row in db.execute(
+                "SELECT gene_key FROM expression_example_keys ORDER BY rowid"
+            ).fetchall()
+        ]
+        gene_ids = [
+            row[0]
+            for row in db.execute(
+                "SELECT gene_id FROM genes ORDER BY gene_key"
+            ).fetchall()
+        ]
+        indexes = {
+            row[0]
+            for row in db.execute(
+                "SELECT index_name FROM duckdb_indexes()"
+            ).fetchall()
+        }
+
+    assert stored_keys == sorted(stored_keys)
+    assert gene_ids == sorted(EXAMPLE_GENE_IDS)
+    assert indexes == {
+        "annotation_search_dictionary_term_idx",
+        "annotation_search_documents_doc_id_idx",
+        "annotation_search_terms_term_idx",
+        "annotations_gene_id_idx",
+        "expression_example_keys_gene_key_idx",
+        "expression_metadata_experiment_id_idx",
+        "genes_gene_id_idx",
+        "gff_feature_id_idx",
+    }
+    assert not list(built_database.parent.glob(".*.tmp*"))
+
+
+def test_layout_reports_stored_row_groups(tmp_path: Path):
+    with duckdb.connect((tmp_path / "layout.db").as_posix()) as db:
+        db.execute(
+            """
+            CREATE TABLE sorted AS
+            SELECT (range // 1000)::INTEGER AS gene_key FROM range(300000)
+            ORDER BY gene_key;
+            CREATE TABLE shuffled AS
+            SELECT * FROM sorted ORDER BY hash(gene_key);
+            """
+        )
+        sorted_layout = table_layout(db, "sorted", "gene_key")
+        shuffled_layout = table_layout(db, "shuffled", "gene_key")
+        stored = db.execute(
+            "SELECT count(DISTINCT row_group_id)"
+            " FROM pragma_storage_info('sorted')"
+        ).fetchone()[0]
+
+    assert sorted_layout.rows == 300000
+    assert sorted_layout.row_groups == stored > 1
+    assert sorted_layout.max_row_groups_per_key == 2
+    assert shuffled_layout.max_row_groups_per_key == stored
+
+
+def test_views_keep_original_columns(built_database: Path):
+    with duckdb.connect(built_database.as_posix(), read_only=True) as db:
+        rows = db.execute(
+            """
+            SELECT sample_id, gene_id, expression_value
+            FROM expression_example
+            ORDER BY gene_id, sample_id
+            LIMIT 2
+            """
+        ).fetchall()
+
+    assert rows == [
+        ("S1", EXAMPLE_GENE_IDS[0], 0.0),
+        ("S2", EXAMPLE_GENE_IDS[0], 1.0),
+    ]
+
+
+def expression_responses(client: TestClient):
+    return [
+        client.post(
+            "/v1/expression",
+            headers=headers,
+            json={"experimentId": 1, "geneIds": gene_ids},
+        ).content
+        for gene_ids in [
+            EXAMPLE_GENE_IDS[:3],
+            [EXAMPLE_GENE_IDS[4], "PA_chr01_G999999", EXAMPLE_GENE_IDS[1]],
+            ["PA_chr01_G999999"],
+        ]
+        for headers in [{}, {"Accept": ARROW_STREAM_MEDIA_TYPE}]
+    ]
+
+
+@pytest.mark.parametrize(
+    "convert", ["build", "encode", "encode-optimized"]
+)
+def test_api_serves_keyed_database(
+    convert: str,
+    built_database: Path,
+    api_environment: Path,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    with TestClient(app, root_path="") as client:
+        assert client.app.state.database_releases.current.gene_keys is None
+        expected = expression_responses(client)
+
+    if convert == "encode-optimized":
+        # as written by `plantgenie-db build`, with every table indexed
+        with duckdb.connect(
+            (api_environment / "plantgenie-backend.db").as_posix()
+        ) as connection:
+            optimize_database(connection)
+
+    if convert.startswith("encode"):
+        database_path = tmp_path / "encoded" / "plantgenie-backend.db"
+        result = runner.invoke(
+            db_app,
+            [
+                "encode",
+                (api_environment / "plantgenie-backend.db").as_posix(),
+                database_path.as_posix(),
+            ],
+        )
+        assert result.exit_code == 0, result.output
+    else:
+        database_path = built_database
+
+    monkeypatch.setenv("DATA_PATH", database_path.parent.as_posix())
+    with TestClient(app, root_path="") as client:
+        gene_keys = client.app.state.database_releases.current.gene_keys
+        assert len(gene_keys) == len(EXAMPLE_GENE_IDS)
+        assert expression_responses(client) == expected
+
+
+def test_build_requires_api_tables(tmp_path: Path):
+    manifest_path = write_example_sources(tmp_path / "sources")
+    manifest_path.write_text(
+        manifest_path.read_text().replace('gff = "gff.tsv"', "")
+    )
+
+    result = runner.invoke(
+        db_app,
+        [
+            "build",
+            manifest_path.as_posix(),
+            (tmp_path / "x.db").as_posix(),
+        ],
+    )
+
+    assert result.exit_code == 1
+    assert "gff" in result.output
+    assert not (tmp_path / "x.db").exists()
@@ -0,0 +1,170 @@
+from pathlib import Path
+
+import duckdb
+import pytest
+from fastapi.testclient import TestClient
+from shared.expression_matrix import export_expression_matrix
+from shared.releases import current_release, publish_release
+from typer.testing import CliRunner
+
+from plantgenie_api.db.build import encode_existing_database
+from plantgenie_api.db.cli import app as db_app
+from plantgenie_api.main import app
+from tests.plantgenie_api.conftest import (
+    EXAMPLE_GENE_IDS,
+    build_example_database,
+)
+
+runner = CliRunner()
+
+
+@pytest.fixture(params=["varchar", "gene-keys"])
+def releases_path(
+    request: pytest.FixtureRequest, api_environment: Path, tmp_path: Path
+) -> Path:
+    releases_path = api_environment / "releases"
+    database_path = releases_path / "2025-01" / "plantgenie-backend.db"
+    database_path.parent.mkdir(parents=True)
+
+    if request.param == "gene-keys":
+        encode_existing_database(
+            build_example_database(tmp_path / "example.db"), database_path
+        )
+    else:
+        build_example_database(database_path)
+
+    with duckdb.connect(database_path.as_posix(), read_only=True) as db:
+        export_expression_matrix(
+            db, 1, database_path.parent / "expression-matrices"
+        )
+
+    publish_release(releases_path, "2025-01", "plantgenie-backend.db")
+    return releases_path
+
+
+def write_experiment(source_path: Path, gene_ids) -> Path:
+    source_path.mkdir()
+    (source_path / "samples.tsv").write_text(
+        # columns expression_metadata does not have are not loaded
+        "abbreviation\tcondition\tnotes\nL1\tleaf\tx\nR1\troot\ty\n"
+    )
+    (source_path / "values.csv").write_text(
+        "sample_id,gene_id,expression_value\n"
+        + "".join(
+            f"{sample_id},{gene_id},{float(i)}\n"
+            for i, gene_id in enumerate(gene_ids)
+            for sample_id in ["R1", "L1"]
+        )
+    )
+    manifest_path = source_path / "experiment.toml"
+    manifest_path.write_text(
+        """
+        [[experiments]]
+        id = 2
+        genome_id = 1
+        title = "Leaf and root"
+        relation_name = "expression_leaf_root"
+        expression_units = "tpm"
+        samples = "samples.tsv"
+        expression = "values.csv"
+        """
+    )
+    return manifest_path
+
+
+def test_ingest_adds_experiment_as_new_release(
+    releases_path: Path, tmp_path: Path
+):
+    manifest_path = write_experiment(
+        tmp_path / "experiment", EXAMPLE_GENE_IDS[:4]
+    )
+
+    result = runner.invoke(
+        db_app,
+        [
+            "ingest",
+            manifest_path.as_posix(),
+            releases_path.as_posix(),
+            "2025-02",
+            "--publish",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert current_release(releases_path) == "2025-02"
+
+    base = releases_path / "2025-01" / "plantgenie-backend.db"
+    with duckdb.connect(base.as_posix(), read_only=True) as db:
+        assert db.execute(
+            "SELECT count(*) FROM experiments"
+        ).fetchone() == (1,)
+
+    matrices = releases_path / "2025-02" / "expression-matrices"
+    assert sorted(path.name for path in matrices.iterdir()) == ["1", "2"]
+
+    with TestClient(app, root_path="") as client:
+        response = client.post(
+            "/v1/expression",
+            json={"experimentId": 2, "geneIds": EXAMPLE_GENE_IDS[:2]},
+        ).json()
+        experiments = client.get(
+            "/v1/expression/available-experiments"
+        ).json()["experiments"]
+
+    assert response["samples"] == ["L1", "R1"]
+    assert response["values"] == [0.0, 0.0, 1.0, 1.0]
+    assert len(experiments) == 2
+
+
+def test_ingest_rejects_unknown_genes(releases_path: Path, tmp_path: Path):
+    manifest_path = write_experiment(
+        tmp_path / "experiment", [EXAMPLE_GENE_IDS[0], "PA_chr99_G000001"]
+    )
+
+    result = runner.invoke(
+        db_app,
+        [
+            "ingest",
+            manifest_path.as_posix(),
+            releases_path.as_posix(),
+            "2025-02",
+        ],
+    )
+
+    assert result.exit_code == 1
+    assert "PA_chr99_G000001" in result.output
+    assert not (releases_path / "2025-02").exists()
+    assert current_release(releases_path) == "2025-01"
+
+
+def test_ingest_removes_matrices_when_export_fails(
+    releases_path: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    manifest_path = write_experiment(
+        tmp_path / "experiment", EXAMPLE_GENE_IDS[:4]
+    )
+
+    def failing_export(connection, experiment_id, matrix_path):
+        (matrix_path / str(experiment_id)).mkdir()
+        raise ValueError(
+            f"experiment {experiment_id} could not be exported"
+        )
+
+    monkeypatch.setattr(
+        "plantgenie_api.db.cli.export_expression_matrix", failing_export
+    )
+
+    result = runner.invoke(
+        db_app,
+        [
+            "ingest",
+            manifest_path.as_posix(),
+            releases_path.as_posix(),
+            "2025-02",
+            "--publish",
+        ],
+    )
+
+    assert result.exit_code == 1
+    assert "experiment 2 could not be exported" in result.output
+    assert not (releases_path / "2025-02" / "expression-matrices").exists()
+    assert current_release(releases_path) == "2025-01"
@@ -0,0 +1,390 @@
+from pathlib import Path
+
+import duckdb
+import numpy
+import pyarrow.ipc
+from fastapi.testclient import TestClient
+from shared.expression_matrix import (
+    ExpressionMatrixStore,
+    export_expression_matrix,
+)
+
+from plantgenie_api.api.v1.expression.arrow import ARROW_STREAM_MEDIA_TYPE
+from plantgenie_api.api.v1.expression.queries import expression_query
+from plantgenie_api.main import app
+from tests.plantgenie_api.conftest import (
+    EXAMPLE_GENE_IDS,
+    EXAMPLE_SAMPLE_IDS,
+)
+
+
+def test_query_text_does_not_depend_on_gene_ids():
+    assert expression_query("expression_example") is expression_query(
+        "expression_example"
+    )
+    assert "PA_chr01" not in expression_query("expression_example")
+
+
+def test_expression_keeps_request_order(api_client: TestClient):
+    response = api_client.post(
+        "/v1/expression",
+        json={
+            "experimentId": 1,
+            "geneIds": [
+                EXAMPLE_GENE_IDS[2],
+                EXAMPLE_GENE_IDS[0],
+                EXAMPLE_GENE_IDS[2],
+                "PA_chr01_G999999",
+                "x'); DROP TABLE gff; --",
+            ],
+        },
+    )
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["geneIds"] == [EXAMPLE_GENE_IDS[2], EXAMPLE_GENE_IDS[0]]
+    assert body["samples"] == EXAMPLE_SAMPLE_IDS
+    assert body["values"][:2] == [20.0, 21.0]
+    assert body["values"][6:8] == [0.0, 1.0]
+    assert body["missingGeneIds"] == [
+        "PA_chr01_G999999",
+        "x'); DROP TABLE gff; --",
+    ]
+
+
+def test_exported_matrix_matches_table(example_data_path: Path):
+    matrix_path = example_data_path / "expression-matrices"
+    with duckdb.connect(
+        (example_data_path / "plantgenie-backend.db").as_posix()
+    ) as connection:
+        connection.execute(
+            "DELETE FROM expression_example"
+            " WHERE gene_id = ? AND sample_id = 'S2'",
+            [EXAMPLE_GENE_IDS[1]],
+        )
+        export_expression_matrix(connection, 1, matrix_path)
+        # exporting again replaces the matrix in place
+        export_expression_matrix(connection, 1, matrix_path)
+
+    store = ExpressionMatrixStore(matrix_path)
+    matrix = store.get(1)
+
+    assert len(store) == 1
+    assert matrix is not None
+    assert matrix.sample_ids == EXAMPLE_SAMPLE_IDS
+    assert matrix.values.shape == (20, 6)
+    assert matrix.values[2, 4] == 24.0
+    assert numpy.isnan(matrix.values[1, 1])
+
+    found, rows, missing = matrix.lookup(
+        [EXAMPLE_GENE_IDS[3], "PA_chr01_G999999", EXAMPLE_GENE_IDS[3]]
+    )
+    assert found == [EXAMPLE_GENE_IDS[3]]
+    assert missing == ["PA_chr01_G999999"]
+    assert matrix.rows(rows).tolist() == [
+        [30.0, 31.0, 32.0, 33.0, 34.0, 35.0]
+    ]
+
+
+def test_expression_served_from_matrix(api_environment: Path):
+    request = {
+        "experimentId": 1,
+        "geneIds": [EXAMPLE_GENE_IDS[5], "PA_chr01_G999999"],
+    }
+
+    with TestClient(app, root_path="") as client:
+        from_database = client.post("/v1/expression", json=request).json()
+
+    with duckdb.connect(
+        (api_environment / "plantgenie-backend.db").as_posix(),
+        read_only=True,
+    ) as connection:
+        export_expression_matrix(
+            connection, 1, api_environment / "expression-matrices"
+        )
+
+    with TestClient(app, root_path="") as client:
+        release = client.app.state.database_releases.current
+        assert len(release.expression_matrix_store) == 1
+        from_matrix = client.post("/v1/expression", json=request).json()
+
+    assert from_matrix == from_database
+
+
+def test_expression_as_arrow_stream(api_environment: Path):
+    request = {
+        "experimentId": 1,
+        "geneIds": [
+            EXAMPLE_GENE_IDS[4],
+            # resolved to EXAMPLE_GENE_IDS[1]
+            "pa_chr01_g000002.1",
+            "PA_chr01_G999999",
+        ],
+    }
+    headers = {"Accept": ARROW_STREAM_MEDIA_TYPE}
+
+    with TestClient(app, root_path="") as client:
+        from_database = client.post(
+            "/v1/expression", json=request, headers=headers
+        )
+        as_json = client.post("/v1/expression", json=request).json()
+
+    with duckdb.connect(
+        (api_environment / "plantgenie-backend.db").as_posix(),
+        read_only=True,
+    ) as connection:
+        export_expression_matrix(
+            connection, 1, api_environment / "expression-matrices"
+        )
+
+    with TestClient(app, root_path="") as client:
+        from_matrix = client.post(
+            "/v1/expression", json=request, headers=headers
+        )
+
+    assert from_database.headers["content-type"] == ARROW_STREAM_MEDIA_TYPE
+    database_table = pyarrow.ipc.open_stream(
+        from_database.content
+    ).read_all()
+    matrix_table = pyarrow.ipc.open_stream(from_matrix.content).read_all()
+
+    assert database_table.equals(matrix_table, check_metadata=True)
+    assert (
+        database_table.column("gene_id").unique().to_pylist()
+        == (as_json["geneIds"])
+    )
+    assert (
+        database_table.column("expression_value").to_pylist()
+        == as_json["values"]
+    )
+    assert database_table.schema.metadata == {
+        b"units": b"tpm",
+        b"missing_gene_ids": b'["PA_chr01_G999999"]',
+        b"resolved_gene_ids": (
+            b'{"pa_chr01_g000002.1": "PA_chr01_G000002"}'
+        ),
+        b"ambiguous_gene_ids": b"{}",
+    }
+    assert as_json["geneIds"] == [EXAMPLE_GENE_IDS[4], EXAMPLE_GENE_IDS[1]]
+
+
+def test_sparse_expression_is_the_same_from_every_source(
+    api_environment: Path,
+):
+    with duckdb.connect(
+        (api_environment / "plantgenie-backend.db").as_posix()
+    ) as connection:
+        connection.execute(
+            """
+            DELETE FROM expression_example
+            WHERE (gene_id = $first AND sample_id IN ('S2', 'S6'))
+               OR (gene_id = $third AND sample_id IN ('S5', 'S6'))
+               OR gene_id = $second
+            """,
+            {
+                "first": EXAMPLE_GENE_IDS[0],
+                "second": EXAMPLE_GENE_IDS[1],
+                "third": EXAMPLE_GENE_IDS[2],
+            },
+        )
+
+    request = {
+        "experimentId": 1,
+        "geneIds": EXAMPLE_GENE_IDS[:3] + ["PA_chr01_G999999"],
+        "cluster": {"axes": ["samples"]},
+    }
+    headers = {"Accept": ARROW_STREAM_MEDIA_TYPE}
+
+    def responses() -> tuple:
+        with TestClient(app, root_path="") as client:
+            as_json = client.post("/v1/expression", json=request)
+            as_arrow = client.post(
+                "/v1/expression", json=request, headers=headers
+            )
+        assert as_json.status_code == 200, as_json.text
+        return (
+            as_json.json(),
+            pyarrow.ipc.open_stream(as_arrow.content).read_all(),
+        )
+
+    database_json, database_table = responses()
+    with duckdb.connect(
+        (api_environment / "plantgenie-backend.db").as_posix(),
+        read_only=True,
+    ) as connection:
+        export_expression_matrix(
+            connection, 1, api_environment / "expression-matrices"
+        )
+    matrix_json, matrix_table = responses()
+
+    # S2 comes before S5 although the first gene has no value for it;
+    # no gene has a value for S6
+    assert database_json["geneIds"] == [
+        EXAMPLE_GENE_IDS[0],
+        EXAMPLE_GENE_IDS[2],
+    ]
+    assert database_json["samples"] == ["S1", "S2", "S3", "S4", "S5"]
+    assert database_json["values"] == [
+        *[0.0, None, 2.0, 3.0, 4.0],
+        *[20.0, 21.0, 22.0, 23.0, None],
+    ]
+    assert database_json["missingGeneIds"] == [
+        "PA_chr01_G999999",
+        EXAMPLE_GENE_IDS[1],
+    ]
+    assert matrix_json == database_json
+
+    assert database_table.column("gene_id").to_pylist() == [
+        gene_id for gene_id in database_json["geneIds"] for _ in range(5)
+    ]
+    assert (
+        database_table.column("sample_id").to_pylist()
+        == database_json["samples"] * 2
+    )
+    assert (
+        database_table.column("expression_value").to_pylist()
+        == database_json["values"]
+    )
+    assert matrix_table.equals(database_table, check_metadata=True)
+
+
+def test_expression_aggregated_per_condition(client: TestClient):
+    request = {
+        "experimentId": 1,
+        "geneIds": [EXAMPLE_GENE_IDS[3], EXAMPLE_GENE_IDS[0]],
+    }
+
+    def aggregated(**aggregate) -> dict:
+        response = client.post(
+            "/v1/expression", json={**request, "aggregate": aggregate}
+        )
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    # the values of gene g in sample s are g * 10 + s; S1-S3 are the
+    # control samples and S4-S6 the treated ones
+    mean = aggregated()
+    assert mean["geneIds"] == [EXAMPLE_GENE_IDS[3], EXAMPLE_GENE_IDS[0]]
+    assert mean["samples"] == ["control", "treated"]
+    assert mean["values"] == [31.0, 34.0, 1.0, 4.0]
+    assert aggregated(function="median")["values"] == mean["values"]
+    assert aggregated(function="sd")["values"] == [1.0, 1.0, 1.0, 1.0]
+
+    per_sample = aggregated(groupBy="abbreviation")
+    assert per_sample["samples"] == EXAMPLE_SAMPLE_IDS
+    assert per_sample["values"][:6] == [30.0, 31, 32, 33, 34, 35]
+    # a single replicate has no standard deviation
+    assert (
+        aggregated(groupBy="abbreviation", function="sd")["values"] == []
+    )
+
+    as_arrow = client.post(
+        "/v1/expression",
+        json={**request, "aggregate": {}},
+        headers={"Accept": ARROW_STREAM_MEDIA_TYPE},
+    )
+    table = pyarrow.ipc.open_stream(as_arrow.content).read_all()
+    assert (
+        table.column("sample_id").to_pylist() == ["control", "treated"] * 2
+    )
+    assert table.column("expression_value").to_pylist() == mean["values"]
+
+    unknown = client.post(
+        "/v1/expression",
+        json={**request, "aggregate": {"groupBy": "tissue"}},
+    )
+    assert unknown.status_code == 422
+    injected = client.post(
+        "/v1/expression",
+        json={**request, "aggregate": {"groupBy": 'condition"; --'}},
+    )
+    assert injected.status_code == 422
+
+
+def test_expression_sample_filter(client: TestClient):
+    request = {"experimentId": 1, "geneIds": [EXAMPLE_GENE_IDS[2]]}
+
+    def filtered(**extra) -> dict:
+        response = client.post("/v1/expression", json={**request, **extra})
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    by_id = filtered(samples={"sampleIds": ["S5", "S2", "S9"]})
+    # in the order of the experiment, not of the filter
+    assert by_id["samples"] == ["S2", "S5"]
+    assert by_id["values"] == [21.0, 24.0]
+
+    treated = filtered(samples={"metadata": {"condition": ["treated"]}})
+    assert treated["samples"] == ["S4", "S5", "S6"]
+
+    both = filtered(
+        samples={
+            "sampleIds": ["S1", "S4", "S5"],
+            "metadata": {"condition": ["treated"]},
+        },
+        aggregate={},
+    )
+    assert (both["samples"], both["values"]) == (["treated"], [23.5])
+
+    assert (
+        client.post(
+            "/v1/expression",
+            json={
+                **request,
+                "samples": {"metadata": {"tissue": ["leaf"]}},
+            },
+        ).status_code
+        == 422
+    )
+    assert (
+        client.post(
+            "/v1/expression", json={**request, "samples": {}}
+        ).status_code
+        == 422
+    )
+
+
+def test_sample_filter_is_part_of_the_sample_collector():
+    query = expression_query("expression_example", None, ("condition",))
+
+    sample_collector = query[: query.index("requested_genes_with_order")]
+    assert (
+        'list_contains($sample_filter_0::VARCHAR[], "condition"::VARCHAR)'
+        in sample_collector
+    )
+    assert query is expression_query(
+        "expression_example", None, ("condition",)
+    )
+
+
+def test_matrix_and_database_serialise_the_same_values(
+    api_environment: Path,
+):
+    with duckdb.connect(
+        (api_environment / "plantgenie-backend.db").as_posix()
+    ) as connection:
+        connection.execute(
+            "UPDATE expression_example"
+            " SET expression_value = expression_value / 10 + 1 / 3"
+        )
+        export_expression_matrix(
+            connection, 1, api_environment / "expression-matrices"
+        )
+
+    request = {"experimentId": 1, "geneIds": EXAMPLE_GENE_IDS[:3]}
+    # every sample, but filtered samples come from the database
+    from_database = {
+        **request,
+        "samples": {"metadata": {"condition": ["control", "treated"]}},
+    }
+
+    with TestClient(app, root_path="") as client:
+        matrix_body = client.post("/v1/expression", json=request).json()
+        database_body = client.post(
+            "/v1/expression", json=from_database
+        ).json()
+
+    assert database_body["samples"] == matrix_body["samples"]
+    assert database_body["values"] == matrix_body["values"]
+    # float32 values in their shortest form, not widened to float64
+    assert matrix_body["values"][:2] == [0.33333334, 0.43333334]
@@ -0,0 +1,182 @@
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from plantgenie_api import gene_lists
+from plantgenie_api.api.v1.enrichment import routes as enrichment_routes
+from plantgenie_api.gene_lists import (
+    GENE_LIST_STORE_FILENAME,
+    GeneListStore,
+)
+from plantgenie_api.local_storage import on_network_filesystem
+from plantgenie_api.main import app
+from tests.plantgenie_api.conftest import EXAMPLE_GENE_IDS
+
+GENE_LIST = [
+    EXAMPLE_GENE_IDS[4],
+    EXAMPLE_GENE_IDS[1].lower(),
+    "PA_chr01_G999999",
+    EXAMPLE_GENE_IDS[4],
+]
+
+
+def create_gene_list(client: TestClient) -> str:
+    response = client.post(
+        "/v1/gene-lists", json={"name": "wizard", "geneIds": GENE_LIST}
+    )
+    assert response.status_code == 201, response.text
+
+    body = response.json()
+    assert body["name"] == "wizard"
+    assert body["geneCount"] == 2
+    assert body["resolvedGeneIds"] == {
+        EXAMPLE_GENE_IDS[1].lower(): EXAMPLE_GENE_IDS[1]
+    }
+    assert body["unresolvedGeneIds"] == ["PA_chr01_G999999"]
+
+    return body["geneListId"]
+
+
+def test_gene_list_round_trip(client: TestClient):
+    gene_list_id = create_gene_list(client)
+
+    response = client.get(f"/v1/gene-lists/{gene_list_id}").json()
+    assert response["geneIds"] == GENE_LIST
+    assert response["name"] == "wizard"
+
+    assert client.get("/v1/gene-lists/unknown").status_code == 404
+
+
+def test_gene_lists_outlive_a_restart(
+    api_environment: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.delenv("GENE_LIST_STORE_PATH")
+
+    # the store is never put in DATA_PATH, a network mount
+    with pytest.raises(RuntimeError, match="GENE_LIST_STORE_PATH"):
+        with TestClient(app, root_path=""):
+            pass
+
+    monkeypatch.setenv("DATABASE_LOCAL_COPY_PATH", str(tmp_path / "local"))
+
+    with TestClient(app, root_path="") as client:
+        gene_list_id = create_gene_list(client)
+
+    with TestClient(app, root_path="") as client:
+        response = client.get(f"/v1/gene-lists/{gene_list_id}")
+
+    assert response.status_code == 200
+    assert response.json()["geneIds"] == GENE_LIST
+    assert (tmp_path / "local" / GENE_LIST_STORE_FILENAME).exists()
+    assert not (api_environment / GENE_LIST_STORE_FILENAME).exists()
+
+
+@pytest.fixture(scope="module")
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.mark.anyio
+async def test_store_on_a_network_mount_does_not_use_wal(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    mounts = tmp_path / "mounts"
+    mounts.write_text(
+        "/dev/sda1 / ext4 rw 0 0\n"
+        f"server:/srv/shared {tmp_path / 'shared'} nfs4 rw 0 0\n"
+    )
+    monkeypatch.setattr(
+        gene_lists,
+        "on_network_filesystem",
+        lambda path: on_network_filesystem(path, mounts),
+    )
+
+    for directory, journal_mode in [
+        ("shared", "delete"),
+        ("local", "wal"),
+    ]:
+        store = GeneListStore(
+            (tmp_path / directory / GENE_LIST_STORE_FILENAME).as_posix()
+        )
+        await store.open()
+        async with store.connection.execute(
+            "PRAGMA journal_mode"
+        ) as cursor:
+            assert await cursor.fetchone() == (journal_mode,)
+        await store.close()
+
+
+def test_expression_and_annotations_by_gene_list(client: TestClient):
+    gene_list_id = create_gene_list(client)
+
+    for path, body in [
+        ("/v1/expression", {"experimentId": 1}),
+        ("/v1/annotations", {"species": "Picea abies"}),
+    ]:
+        by_ids = client.post(path, json={**body, "geneIds": GENE_LIST})
+        # twice, the second time from the cached resolution
+        for _ in range(2):
+            by_list = client.post(
+                path, json={**body, "geneListId": gene_list_id}
+            )
+            assert by_list.status_code == 200, by_list.text
+            assert by_list.json() == by_ids.json()
+
+    response = client.post(
+        "/v1/expression", json={"experimentId": 1, "geneListId": "unknown"}
+    )
+    assert response.status_code == 404
+
+
+def test_gene_ids_or_gene_list(client: TestClient):
+    gene_list_id = create_gene_list(client)
+
+    for body in [
+        {"experimentId": 1},
+        {"experimentId": 1, "geneIds": [], "geneListId": None},
+        {
+            "experimentId": 1,
+            "geneIds": GENE_LIST,
+            "geneListId": gene_list_id,
+        },
+    ]:
+        response = client.post("/v1/expression", json=body)
+        assert response.status_code == 422
+
+
+def test_go_enrichment_from_gene_lists(
+    api_client: TestClient,
+    api_environment: Path,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    output_path = api_environment / "pg-service-go-enrichment"
+    output_path.mkdir()
+    enqueued = []
+    monkeypatch.setattr(
+        enrichment_routes,
+        "enqueue",
+        lambda name, args, task_id: enqueued.append(args),
+    )
+    gene_list_id = create_gene_list(api_client)
+
+    response = api_client.post(
+        "/v1/go-enrichment/submit",
+        data={
+            "genome_id": "1",
+            "target_gene_list_id": gene_list_id,
+            "background_gene_list_id": gene_list_id,
+        },
+    )
+    assert response.status_code == 200, response.text
+
+    (args,) = enqueued
+    assert Path(args.target_path).read_text().splitlines() == [
+        EXAMPLE_GENE_IDS[4],
+        EXAMPLE_GENE_IDS[1],
+    ]
+
+    response = api_client.post(
+        "/v1/go-enrichment/submit", data={"genome_id": "1"}
+    )
+    assert response.status_code == 422
@@ -0,0 +1,179 @@
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+from typer.testing import CliRunner
+
+from plantgenie_api.db.cli import app as db_app
+from plantgenie_api.genes import GeneIdIndex, GeneIdResolver
+from plantgenie_api.main import app
+from tests.plantgenie_api.conftest import (
+    EXAMPLE_GENE_IDS,
+    write_example_sources,
+)
+
+
+def complete(client: TestClient, **params):
+    response = client.get("/v1/genes/complete", params=params)
+    assert response.status_code == 200, response.text
+    return response.json()["geneIds"]
+
+
+def test_complete_gene_ids(api_client: TestClient):
+    genes_10_to_19 = EXAMPLE_GENE_IDS[9:19]
+    assert complete(api_client, prefix="PA_chr01_G00001") == genes_10_to_19
+    assert complete(api_client, prefix="pa_chr01_g00002") == [
+        EXAMPLE_GENE_IDS[19]
+    ]
+    assert complete(api_client, prefix="PA_chr01", limit=3) == [
+        *EXAMPLE_GENE_IDS[:3]
+    ]
+    assert complete(api_client, prefix="PA_chr01", genome_id=2) == []
+    assert complete(api_client, prefix="Potra") == []
+
+
+def test_complete_requires_prefix(api_client: TestClient):
+    response = api_client.get("/v1/genes/complete", params={"prefix": ""})
+    assert response.status_code == 422
+
+
+def test_gene_id_index_per_genome():
+    index = GeneIdIndex(
+        {1: ["Pa_G2", "Pa_G1", "Pa_G1"], 2: ["Ps_G1", "pa_G3"]}
+    )
+
+    assert len(index) == 4
+    assert index.complete("pa_g") == ["Pa_G1", "Pa_G2", "pa_G3"]
+    assert index.complete("pa_g", genome_id=1) == ["Pa_G1", "Pa_G2"]
+    assert index.complete("p", genome_id=2, limit=1) == ["pa_G3"]
+    assert index.complete("pa", genome_id=3) == []
+
+
+def test_resolver_normalizes_and_follows_aliases():
+    resolver = GeneIdResolver(
+        ["Pa_G1", "Pa_G2", "Potri.001G000100"],
+        {
+            "PAL1": ["Pa_G1"],
+            "Pa_G2": ["Pa_G1"],
+            "Pa_old_G3": ["Pa_G2"],
+            # split into two genes, or two aliases that only differ in
+            # case
+            "Pa_old_G4": ["Pa_G2", "Pa_G1"],
+            "pal2": ["Pa_G1"],
+            "PAL2": ["Pa_G2"],
+        },
+    )
+
+    genes = resolver.resolve(
+        [
+            "Pa_G1",
+            " pa_g2 ",
+            "Potri.001G000100.2",
+            "pal1",
+            "Pa_old_G3.1",
+            "Pa_G1",
+            "Pa_G9",
+            "pa_old_g4.1",
+            "PAL2",
+            "Pal2",
+        ]
+    )
+
+    # a feature id is never shadowed by an alias that looks the same
+    assert genes.gene_ids == ["Pa_G1", "Pa_G2", "Potri.001G000100"]
+    assert genes.resolved == {
+        " pa_g2 ": "Pa_G2",
+        "Potri.001G000100.2": "Potri.001G000100",
+        "pal1": "Pa_G1",
+        "Pa_old_G3.1": "Pa_G2",
+        "PAL2": "Pa_G2",
+    }
+    # an alias of several genes resolves to none of them
+    assert genes.unresolved == ["Pa_G9", "pa_old_g4.1", "Pal2"]
+    assert genes.ambiguous == {
+        "pa_old_g4.1": ["Pa_G1", "Pa_G2"],
+        "Pal2": ["Pa_G1", "Pa_G2"],
+    }
+
+
+def test_resolve_gene_ids(api_client: TestClient):
+    response = api_client.post(
+        "/v1/genes/resolve",
+        json={"geneIds": [EXAMPLE_GENE_IDS[0].lower(), "Potra2n1c1"]},
+    )
+
+    assert response.json() == {
+        "geneIds": [EXAMPLE_GENE_IDS[0]],
+        "resolvedGeneIds": {
+            EXAMPLE_GENE_IDS[0].lower(): EXAMPLE_GENE_IDS[0]
+        },
+        "unresolvedGeneIds": ["Potra2n1c1"],
+        "ambiguousGeneIds": {},
+    }
+
+
+def test_annotations_resolve_gene_ids(api_client: TestClient):
+    response = api_client.post(
+        "/v1/annotations",
+        json={
+            "species": "Picea abies",
+            "geneIds": [f"{EXAMPLE_GENE_IDS[2]}.1", "Potra2n1c1"],
+        },
+    ).json()
+
+    assert [r["geneId"] for r in response["results"]] == [
+        EXAMPLE_GENE_IDS[2]
+    ]
+    assert response["resolvedGeneIds"] == {
+        f"{EXAMPLE_GENE_IDS[2]}.1": EXAMPLE_GENE_IDS[2]
+    }
+    assert response["unresolvedGeneIds"] == ["Potra2n1c1"]
+
+
+def test_built_aliases_are_resolved(
+    tmp_path: Path, api_environment: Path, monkeypatch: pytest.MonkeyPatch
+):
+    manifest_path = write_example_sources(tmp_path / "sources")
+    (manifest_path.parent / "aliases.tsv").write_text(
+        "alias\tgene_id\n"
+        f"MA_10001g0010\t{EXAMPLE_GENE_IDS[3]}\n"
+        "MA_10001g0020\tnot_a_gene\n"
+        f"MA_10001g0030\t{EXAMPLE_GENE_IDS[4]}\n"
+        f"MA_10001g0030\t{EXAMPLE_GENE_IDS[5]}\n"
+    )
+    manifest_path.write_text(
+        manifest_path.read_text().replace(
+            'annotations = "annotations.tsv"',
+            'annotations = "annotations.tsv"\n'
+            'gene_aliases = "aliases.tsv"',
+        )
+    )
+    database_path = tmp_path / "built" / "plantgenie-backend.db"
+    result = CliRunner().invoke(
+        db_app,
+        ["build", manifest_path.as_posix(), database_path.as_posix()],
+    )
+    assert result.exit_code == 0, result.output
+
+    monkeypatch.setenv("DATA_PATH", database_path.parent.as_posix())
+    with TestClient(app, root_path="") as client:
+        response = client.post(
+            "/v1/expression",
+            json={
+                "experimentId": 1,
+                "geneIds": [
+                    "ma_10001g0010",
+                    "MA_10001g0020",
+                    "MA_10001g0030",
+                ],
+            },
+        ).json()
+
+    assert response["geneIds"] == [EXAMPLE_GENE_IDS[3]]
+    assert response["resolvedGeneIds"] == {
+        "ma_10001g0010": EXAMPLE_GENE_IDS[3]
+    }
+    assert response["missingGeneIds"] == ["MA_10001g0020", "MA_10001g0030"]
+    assert response["ambiguousGeneIds"] == {
+        "MA_10001g0030": EXAMPLE_GENE_IDS[4:6]
+    }
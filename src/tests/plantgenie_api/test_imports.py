@@ -0,0 +1,43 @@
+import json
+import subprocess
+import sys
+
+# modules only the workers need; the API enqueues tasks by name and
+# must not import them
+WORKER_ONLY_MODULES = [
+    "FastaValidator",
+    "go_enrich.main",
+    "go_enrich.methods",
+    "networkx",
+    "scipy",
+    "task_queue.blast.tasks",
+    "task_queue.enrichment.tasks",
+    "typer",
+]
+IMPORT_TIME_BUDGET_SECONDS = 5.0
+
+
+def test_api_does_not_import_worker_dependencies():
+    # a fresh interpreter, since the test session may have imported
+    # these already
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import json, sys, time\n"
+            "start = time.perf_counter()\n"
+            "import plantgenie_api.main\n"
+            "print(json.dumps({\n"
+            "    'seconds': time.perf_counter() - start,\n"
+            f"    'imported': [m for m in {WORKER_ONLY_MODULES!r}"
+            " if m in sys.modules],\n"
+            "}))",
+        ],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+
+    result = json.loads(output.splitlines()[-1])
+    assert result["imported"] == []
+    assert result["seconds"] < IMPORT_TIME_BUDGET_SECONDS
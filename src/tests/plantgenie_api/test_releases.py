@@ -0,0 +1,228 @@
+import asyncio
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import duckdb
+import pytest
+from fastapi.testclient import TestClient
+from shared.expression_matrix import export_expression_matrix
+from shared.releases import publish_release
+
+from plantgenie_api.local_storage import (
+    clone_or_copy,
+    copy_to_local_storage,
+)
+from plantgenie_api.main import app
+from tests.plantgenie_api.conftest import build_example_database
+
+
+@pytest.fixture
+def releases_path(
+    api_environment: Path, monkeypatch: pytest.MonkeyPatch
+) -> Path:
+    releases_path = api_environment / "releases"
+
+    for release, species_name in [
+        ("2025-01", "Picea abies"),
+        ("2025-02", "Pinus sylvestris"),
+    ]:
+        database_path = releases_path / release / "plantgenie-backend.db"
+        database_path.parent.mkdir(parents=True)
+        build_example_database(database_path)
+        with duckdb.connect(database_path.as_posix()) as connection:
+            connection.execute(
+                "UPDATE species SET species_name = ?", [species_name]
+            )
+
+    publish_release(releases_path, "2025-01", "plantgenie-backend.db")
+    monkeypatch.setenv("DATABASE_RELEASE_POLL_SECONDS", "0")
+    return releases_path
+
+
+def species_name(client: TestClient) -> str:
+    return client.get("/available-species").json()["species"][0][
+        "speciesName"
+    ]
+
+
+def test_release_is_swapped_without_restart(releases_path: Path):
+    with TestClient(app, root_path="") as client:
+        releases = client.app.state.database_releases
+
+        assert species_name(client) == "Picea abies"
+        assert client.get("/status").json()["release"]["name"] == "2025-01"
+        assert client.portal.call(releases.refresh) is False
+
+        publish_release(releases_path, "2025-02", "plantgenie-backend.db")
+        assert client.portal.call(releases.refresh) is True
+
+        # the metadata cache follows the new database version
+        assert species_name(client) == "Pinus sylvestris"
+
+        status = client.get("/status").json()["release"]
+        assert status["name"] == "2025-02"
+        assert status["swaps"] == 1
+
+
+def test_old_release_drains_before_closing(releases_path: Path):
+    with TestClient(app, root_path="") as client:
+        releases = client.app.state.database_releases
+        old_release = releases.current
+        cursor = old_release.pool.acquire()
+
+        publish_release(releases_path, "2025-02", "plantgenie-backend.db")
+        client.portal.call(releases.refresh)
+
+        # a request that checked out a cursor before the swap finishes
+        # on the old release
+        assert cursor.execute(
+            "SELECT species_name FROM species"
+        ).fetchone() == ("Picea abies",)
+        assert client.get("/status").json()["release"]["draining"] == [
+            "2025-01"
+        ]
+
+        old_release.pool.release(cursor)
+        client.portal.call(releases.wait_drained)
+
+        assert client.get("/status").json()["release"]["draining"] == []
+
+
+def test_release_is_held_while_waiting_for_a_cursor(
+    releases_path: Path,
+):
+    with TestClient(app, root_path="") as client:
+        releases = client.app.state.database_releases
+
+        # as open_database_session does before awaiting the checkout
+        with releases.use() as release:
+            publish_release(
+                releases_path, "2025-02", "plantgenie-backend.db"
+            )
+            client.portal.call(releases.refresh)
+            client.portal.call(asyncio.sleep, 0.3)
+
+            with release.pool.checkout() as cursor:
+                assert cursor.execute(
+                    "SELECT species_name FROM species"
+                ).fetchone() == ("Picea abies",)
+            assert client.get("/status").json()["release"]["draining"] == [
+                "2025-01"
+            ]
+
+        client.portal.call(releases.wait_drained)
+        assert client.get("/status").json()["release"]["draining"] == []
+
+
+def test_separate_matrix_path_is_per_release(
+    releases_path: Path,
+    tmp_path_factory: pytest.TempPathFactory,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    matrix_path = tmp_path_factory.mktemp("matrices")
+    monkeypatch.setenv("EXPRESSION_MATRIX_PATH", matrix_path.as_posix())
+    with duckdb.connect(
+        (releases_path / "2025-01" / "plantgenie-backend.db").as_posix(),
+        read_only=True,
+    ) as connection:
+        export_expression_matrix(connection, 1, matrix_path / "2025-01")
+
+    with TestClient(app, root_path="") as client:
+        releases = client.app.state.database_releases
+        assert len(releases.current.expression_matrix_store) == 1
+
+        publish_release(releases_path, "2025-02", "plantgenie-backend.db")
+        client.portal.call(releases.refresh)
+
+        # the matrices of 2025-01 are not served with 2025-02
+        store = releases.current.expression_matrix_store
+        assert store.matrix_path == matrix_path / "2025-02"
+        assert len(store) == 0
+
+
+def test_database_is_copied_to_local_storage(
+    releases_path: Path,
+    tmp_path_factory: pytest.TempPathFactory,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    local_root = tmp_path_factory.mktemp("local")
+    monkeypatch.setenv("DATABASE_LOCAL_COPY_PATH", local_root.as_posix())
+
+    with TestClient(app, root_path="") as client:
+        status = client.get("/status").json()
+        assert species_name(client) == "Picea abies"
+
+    # a restart reuses the verified copy
+    with TestClient(app, root_path="") as client:
+        restarted = client.get("/status").json()
+
+        publish_release(releases_path, "2025-02", "plantgenie-backend.db")
+        releases = client.app.state.database_releases
+        client.portal.call(releases.refresh)
+        client.portal.call(releases.wait_drained)
+
+    local_copy = local_root / "2025-01" / "plantgenie-backend.db"
+    assert status["release"]["storage"] == "local"
+    assert status["release"]["openedPath"] == local_copy.as_posix()
+    assert (
+        restarted["database"]["databaseVersion"]
+        == (status["database"]["databaseVersion"])
+    )
+    # the copy of the replaced release is removed once it has drained
+    assert not local_copy.exists()
+    assert (local_root / "2025-02" / "plantgenie-backend.db").exists()
+
+
+def test_concurrent_starts_share_one_local_copy(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    source = build_example_database(tmp_path / "plantgenie-backend.db")
+    local_root = tmp_path / "local"
+    copies = []
+
+    def slow_copy(source: Path, destination: Path) -> str:
+        copies.append(destination)
+        time.sleep(0.2)
+        return clone_or_copy(source, destination)
+
+    monkeypatch.setattr(
+        "plantgenie_api.local_storage.clone_or_copy", slow_copy
+    )
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(
+            pool.map(
+                lambda _: copy_to_local_storage(
+                    source, local_root, "2025-01"
+                ),
+                range(4),
+            )
+        )
+
+    local_copy = local_root / "2025-01" / "plantgenie-backend.db"
+    assert results == [local_copy] * 4
+    assert len(copies) == 1
+
+
+def test_local_copy_falls_back_without_space(
+    releases_path: Path,
+    tmp_path_factory: pytest.TempPathFactory,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setenv(
+        "DATABASE_LOCAL_COPY_PATH",
+        tmp_path_factory.mktemp("local").as_posix(),
+    )
+    monkeypatch.setattr(
+        "plantgenie_api.local_storage.shutil.disk_usage",
+        lambda _: shutil._ntuple_diskusage(0, 0, 0),
+    )
+
+    with TestClient(app, root_path="") as client:
+        release = client.get("/status").json()["release"]
+        assert species_name(client) == "Picea abies"
+
+    assert release["storage"] == "shared"
+    assert release["openedPath"] == release["databasePath"]
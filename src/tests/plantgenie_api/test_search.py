@@ -0,0 +1,94 @@
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+from typer.testing import CliRunner
+
+from plantgenie_api.db.cli import app as db_app
+from plantgenie_api.main import app
+from plantgenie_api.search_index import term_clauses
+from tests.plantgenie_api.conftest import (
+    EXAMPLE_GENE_IDS,
+    write_example_sources,
+)
+
+ANNOTATIONS = {
+    EXAMPLE_GENE_IDS[0]: ("PAL1", "Phenylalanine ammonia-lyase 1"),
+    EXAMPLE_GENE_IDS[1]: ("CAD", "Cinnamyl alcohol dehydrogenase"),
+    EXAMPLE_GENE_IDS[2]: ("CCR", "Cinnamoyl-CoA reductase"),
+    EXAMPLE_GENE_IDS[3]: (
+        "ADH1",
+        "Alcohol dehydrogenase 1, alcohol dehydrogenase family",
+    ),
+}
+
+
+@pytest.fixture
+def search_client(
+    tmp_path: Path, api_environment: Path, monkeypatch: pytest.MonkeyPatch
+):
+    manifest_path = write_example_sources(tmp_path / "sources")
+    (manifest_path.parent / "annotations.tsv").write_text(
+        "gene_id\tgene_name\tdescription\n"
+        + "".join(
+            f"{gene_id}\t{name}\t{description}\n"
+            for gene_id, (name, description) in ANNOTATIONS.items()
+        )
+    )
+    database_path = tmp_path / "built" / "plantgenie-backend.db"
+    result = CliRunner().invoke(
+        db_app,
+        ["build", manifest_path.as_posix(), database_path.as_posix()],
+    )
+    assert result.exit_code == 0, result.output
+
+    monkeypatch.setenv("DATA_PATH", database_path.parent.as_posix())
+    with TestClient(app, root_path="") as client:
+        yield client
+
+
+def search(client: TestClient, **params):
+    response = client.get("/v1/annotations/search", params=params)
+    assert response.status_code == 200, response.text
+    body = response.json()
+    return body["total"], [hit["geneId"] for hit in body["results"]]
+
+
+def test_search_ranks_by_bm25(search_client: TestClient):
+    assert search(search_client, q="Alcohol dehydrogenase") == (
+        2,
+        [EXAMPLE_GENE_IDS[3], EXAMPLE_GENE_IDS[1]],
+    )
+    assert search(search_client, q="alcohol reductase") == (0, [])
+    assert search(search_client, q="pal1") == (1, [EXAMPLE_GENE_IDS[0]])
+
+
+def test_search_prefix_mode(search_client: TestClient):
+    assert search(search_client, q="cinnam") == (0, [])
+    assert search(search_client, q="cinnam", prefix=True) == (
+        2,
+        [EXAMPLE_GENE_IDS[1], EXAMPLE_GENE_IDS[2]],
+    )
+    assert search(search_client, q="coa red", prefix=True) == (
+        1,
+        [EXAMPLE_GENE_IDS[2]],
+    )
+
+
+def test_search_filters_and_pages(search_client: TestClient):
+    assert search(search_client, q="dehydrogenase", genome_id=2) == (0, [])
+    assert search(
+        search_client, q="dehydrogenase", genome_id=1, limit=1, offset=1
+    ) == (2, [EXAMPLE_GENE_IDS[1]])
+
+
+def test_prefix_clause_bounds():
+    assert term_clauses(["alcohol", "dehy"], prefix=True) == [
+        ("term", "alcohol"),
+        ("prefix", ("dehy", "dehz")),
+    ]
+
+
+def test_search_without_index(api_client: TestClient):
+    response = api_client.get("/v1/annotations/search", params={"q": "x"})
+    assert response.status_code == 501
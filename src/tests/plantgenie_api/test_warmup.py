@@ -0,0 +1,83 @@
+import time
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from plantgenie_api.main import app
+from plantgenie_api.warmup import WARMUP_STEPS, Warmup
+
+
+def wait_until_ready(client: TestClient, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        response = client.get("/ready")
+        if response.status_code == 200:
+            return response.json()
+        assert response.json()["ready"] is False
+        time.sleep(0.02)
+    raise AssertionError("API did not become ready")
+
+
+def test_warmup_fills_caches_before_ready(
+    api_environment: Path, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setenv("WARMUP_STEPS", ",".join(WARMUP_STEPS))
+
+    with TestClient(app, root_path="") as client:
+        readiness = wait_until_ready(client)
+        status = client.get("/status").json()
+
+    assert [step["name"] for step in readiness["steps"]] == WARMUP_STEPS
+    assert all(step["error"] is None for step in readiness["steps"])
+    assert status["metadataCache"]["entries"] == 4
+    assert status["expressionCache"]["entries"] == 1
+
+
+def test_without_warmup_steps_ready_immediately(api_client: TestClient):
+    assert wait_until_ready(api_client) == {"ready": True, "steps": []}
+
+
+@pytest.mark.parametrize(
+    "experiments, warmed", [("", [1]), ("1", [1]), ("7", [])]
+)
+def test_warmup_reads_ranges_of_the_hottest_experiments(
+    api_environment: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    experiments: str,
+    warmed: list,
+):
+    monkeypatch.setenv("WARMUP_STEPS", "expression")
+    monkeypatch.setenv("WARMUP_EXPERIMENTS", experiments)
+    fetchall = Warmup.fetchall
+    queries = []
+
+    async def recording_fetchall(self, release, query, params=None):
+        # every query runs on a release held by the warm-up
+        queries.append((query, params, release.users))
+        return await fetchall(self, release, query, params)
+
+    monkeypatch.setattr(Warmup, "fetchall", recording_fetchall)
+
+    with TestClient(app, root_path="") as client:
+        readiness = wait_until_ready(client)
+        release = client.app.state.database_releases.current
+
+    assert readiness["steps"][0]["error"] is None
+    assert all(users >= 1 for _, _, users in queries)
+    assert release.users == 0
+
+    expression_queries = [
+        (query, params)
+        for query, params, _ in queries
+        if "expression_value" in query
+    ]
+    # a few ranges of genes per experiment, never the whole table
+    assert len(expression_queries) == len(warmed) * len(
+        Warmup.gene_ranges(release)
+    )
+    assert all(
+        "BETWEEN $low AND $high" in query
+        and params["low"] <= params["high"]
+        for query, params in expression_queries
+    )
@@ -0,0 +1,53 @@
+from pathlib import Path
+
+import pytest
+
+from shared.releases import (
+    current_release,
+    list_releases,
+    publish_release,
+    resolve_database_path,
+)
+
+
+@pytest.fixture
+def releases_path(tmp_path: Path) -> Path:
+    for release in ["2025-01", "2025-02"]:
+        (tmp_path / "releases" / release).mkdir(parents=True)
+        (tmp_path / "releases" / release / "example.db").write_text(
+            release
+        )
+    (tmp_path / "example.db").write_text("unversioned")
+    return tmp_path / "releases"
+
+
+def test_unversioned_database_without_current(releases_path: Path):
+    assert (
+        resolve_database_path(releases_path.parent, "example.db")
+        == (releases_path.parent / "example.db").resolve()
+    )
+    assert current_release(releases_path) is None
+
+
+def test_publish_moves_current(releases_path: Path):
+    publish_release(releases_path, "2025-01", "example.db")
+    first = resolve_database_path(releases_path.parent, "example.db")
+
+    publish_release(releases_path, "2025-02", "example.db")
+    second = resolve_database_path(releases_path.parent, "example.db")
+
+    assert first.read_text() == "2025-01"
+    assert second.read_text() == "2025-02"
+    assert current_release(releases_path) == "2025-02"
+    assert list_releases(releases_path) == ["2025-01", "2025-02"]
+
+
+def test_publish_rejects_incomplete_release(releases_path: Path):
+    (releases_path / "2025-03").mkdir()
+
+    with pytest.raises(FileNotFoundError):
+        publish_release(releases_path, "2025-03", "example.db")
+    with pytest.raises(ValueError):
+        publish_release(releases_path, "current", "example.db")
+
+    assert current_release(releases_path) is None